@@ -1,4 +1,38 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from .hd_energy_control import HDEnergyControl
+# the classes are imported on first access, so importing the package
+# (e.g. for python -m hd_energy_control --help) does not load pymodbus
+_EXPORTS = {
+    'HDEnergyControl': '.hd_energy_control',
+    'HDEnergyControlSnapshot': '.snapshot',
+    'AsyncHDEnergyControl': '.async_hd_energy_control',
+    'ModbusRTUBus': '.bus',
+    'BusScheduler': '.bus',
+    'RegisterCache': '.read_cache',
+    'WatchdogKeepalive': '.watchdog',
+    'TransactionMetrics': '.metrics',
+    'SessionTracker': '.sessions',
+    'DeadbandFilter': '.deadband',
+    'WindowRollup': '.rollup',
+    'HistoryBuffer': '.history',
+    'Pipeline': '.pipeline',
+    'ModbusGateway': '.gateway',
+    'RequestDispatcher': '.dispatcher',
+    'ThreadSafeHDEnergyControl': '.dispatcher',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,173 @@
+"""Command line tool of HD Energy Control
+
+Usage:
+    python -m hd_energy_control --port /dev/ttyAMA0 --unit 1 read power charging_state
+    python -m hd_energy_control write maximal_current_command 10.0
+    python -m hd_energy_control --format csv snapshot
+    python -m hd_energy_control watch power currents_rms --interval 5
+
+pymodbus is only imported when a command talks to the bus,
+--help and argument errors return without loading it.
+"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import contextlib
+import json
+import sys
+import time
+
+from .constants import HDEnergyControlConstants as CONSTS
+from .pipeline import flatten_record as _flatten
+
+
+class _Output:
+    """Writes records as JSON lines, CSV rows (header once) or text
+    """
+    def __init__(self, output_format, file = sys.stdout):
+        self._format = output_format
+        self._file = file
+        self._csv_writer = None
+
+    def write(self, record) -> None:
+        if self._format == 'json':
+            print(json.dumps(record, default=list), file=self._file)
+        elif self._format == 'csv':
+            import csv
+            record = _flatten(record)
+            if self._csv_writer is None:
+                self._csv_writer = csv.DictWriter(self._file, fieldnames=list(record))
+                self._csv_writer.writeheader()
+            self._csv_writer.writerow(record)
+        else:
+            for name, value in record.items():
+                unit = CONSTS.REGISTERS[name].unit if name in CONSTS.REGISTERS else ''
+                print(f'{name:<32}: {value} {unit}'.rstrip(), file=self._file)
+        self._file.flush()
+
+
+def _register_names(names) -> tuple:
+    """Validate register names, 'all' = all registers
+    """
+    if not names or names == ['all']:
+        return tuple(CONSTS.REGISTERS)
+    unknown = [name for name in names if name not in CONSTS.REGISTERS]
+    if unknown:
+        raise SystemExit(f"unknown register {', '.join(unknown)}, known: {', '.join(CONSTS.REGISTERS)}")
+    return tuple(names)
+
+
+def _connect(args):
+    """HDEnergyControl of the arguments, without cache and prints
+    """
+    from .hd_energy_control import HDEnergyControl
+    wallbox = HDEnergyControl(port=args.port, device_unit_id=args.unit, cache=False, verbose=False, \
+                              baudrate=args.baudrate, parity=args.parity, stopbits=args.stopbits, \
+                              retries=args.retries)
+    wallbox.connect()
+    return wallbox
+
+
+def _read(args, output) -> int:
+    names = _register_names(args.names)
+    wallbox = _connect(args)
+    try:
+        values = wallbox.get_registers(*names)
+    finally:
+        wallbox.close()
+    if values is False:
+        print('ERROR: reading the registers failed', file=sys.stderr)
+        return 1
+    output.write({'timestamp': round(time.time(), 3), **values})
+    return 0
+
+
+def _write(args, output) -> int:
+    if args.name not in CONSTS.HOLDING_REGISTERS:
+        raise SystemExit(f"register {args.name} is not writable, writable: {', '.join(CONSTS.HOLDING_REGISTERS)}")
+    value = float(args.value) if CONSTS.REGISTERS[args.name].scale != 1 else int(args.value)
+    wallbox = _connect(args)
+    try:
+        # infos of the setters must not mix with the output
+        with contextlib.redirect_stdout(sys.stderr):
+            result = getattr(wallbox, f'set_{args.name}')(value)
+        if result is False and args.name == 'maximal_current_command':
+            # False also means the value was already set
+            result = wallbox.shadow.get(CONSTS.REGISTERS[args.name].address) == int(value * 10)
+    finally:
+        wallbox.close()
+    output.write({'timestamp': round(time.time(), 3), 'name': args.name, 'value': value, 'result': bool(result)})
+    return 0 if result else 1
+
+
+def _snapshot(args, output) -> int:
+    wallbox = _connect(args)
+    try:
+        snapshot = wallbox.get_snapshot(include_config=not args.no_config)
+    finally:
+        wallbox.close()
+    if snapshot is False:
+        print('ERROR: reading the snapshot failed', file=sys.stderr)
+        return 1
+    from dataclasses import asdict
+    output.write(asdict(snapshot))
+    return 0
+
+
+def _watch(args, output) -> int:
+    names = _register_names(args.names or list(CONSTS.MEASUREMENT_REGISTERS))
+    wallbox = _connect(args)
+    count = 0
+    next_poll = time.monotonic()
+    try:
+        while args.count is None or count < args.count:
+            values = wallbox.get_registers(*names)
+            if values is False:
+                print('ERROR: reading the registers failed', file=sys.stderr)
+            else:
+                output.write({'timestamp': round(time.time(), 3), **values})
+            count += 1
+            next_poll += args.interval
+            time.sleep(max(next_poll - time.monotonic(), 0.0))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        wallbox.close()
+    return 0
+
+
+def main(argv = None) -> int:
+    """Entry point of python -m hd_energy_control
+    """
+    parser = argparse.ArgumentParser(prog='python -m hd_energy_control', \
+                                     description='Read and write HD Energy Control wallboxes')
+    parser.add_argument('--port', default='/dev/ttyAMA0', help='serial port or socket://host:port')
+    parser.add_argument('--unit', type=int, default=1, help='Modbus unit id')
+    parser.add_argument('--baudrate', type=int, default=19200)
+    parser.add_argument('--parity', default='E', choices=('N', 'E', 'O'))
+    parser.add_argument('--stopbits', type=int, default=1, choices=(1, 2))
+    parser.add_argument('--retries', type=int, default=1, help='retries of a request without response')
+    parser.add_argument('--format', default='json', choices=('json', 'csv', 'text'), help='output format')
+    commands = parser.add_subparsers(dest='command', required=True)
+    read = commands.add_parser('read', help='read registers once')
+    read.add_argument('names', nargs='*', help=f"register names or all: {', '.join(CONSTS.REGISTERS)}")
+    read.set_defaults(function=_read)
+    write = commands.add_parser('write', help='write a holding register')
+    write.add_argument('name', choices=CONSTS.HOLDING_REGISTERS)
+    write.add_argument('value', help='value in the unit of the register, e.g. 10.0 (A)')
+    write.set_defaults(function=_write)
+    snapshot = commands.add_parser('snapshot', help='read all input registers with block reads')
+    snapshot.add_argument('--no-config', action='store_true', help='without hw config and sw revision')
+    snapshot.set_defaults(function=_snapshot)
+    watch = commands.add_parser('watch', help='read registers periodically')
+    watch.add_argument('names', nargs='*', help='register names, default measurement registers')
+    watch.add_argument('--interval', type=float, default=10.0, help='seconds between two reads')
+    watch.add_argument('--count', type=int, help='number of reads, default until Ctrl-C')
+    watch.set_defaults(function=_watch)
+    args = parser.parse_args(argv)
+    return args.function(args, _Output(args.format))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
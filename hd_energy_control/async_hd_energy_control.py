@@ -0,0 +1,330 @@
+"""module providing the asyncio HD Energy Control ModbusRTU implementation"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+from pymodbus.client import AsyncModbusSerialClient as AsyncModBusClient
+from pymodbus import (FramerType, ModbusException)
+from .constants import HDEnergyControlConstants as CONSTS
+from .hd_energy_control import ModbusRTU
+from .metrics import OK, TransactionMetrics, classify
+from .register_map import (REGISTER_PLANS, MEASUREMENT_PLAN, SNAPSHOT_PLAN, compile_read_plan)
+from .snapshot import HDEnergyControlSnapshot, describe_charging_state, format_layout_version
+
+class AsyncModbusRTU:
+    """Base class for ModbusRTU with asyncio
+
+    Same interface as ModbusRTU, but all bus transactions are coroutines
+    and never block the event loop.
+    """
+    def __init__(self, port = "/dev/ttyUSB0", device_unit_id = 1, metrics = None, verbose = True, \
+                 baudrate = 19200, bytesize = 8, parity = 'E', stopbits = 1, timeout = 3.0, retries = 3):
+        self._client = AsyncModBusClient(port=port, framer=FramerType.RTU, baudrate=baudrate, \
+                                         bytesize=bytesize, parity=parity, stopbits=stopbits, \
+                                         timeout=timeout, retries=retries)
+        self._device_unit_id = device_unit_id
+        self._metrics = metrics if metrics is not None else TransactionMetrics()
+        self.verbose = verbose
+        if verbose:
+            print("Device Unit: ", self._device_unit_id)
+
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    async def connect(self):
+        """Establish connection of client
+        """
+        try:
+            if await self._client.connect():
+                if self.verbose:
+                    print("INFO: client connected successfully to Modbus-RTU Device!", end='\n\n')
+            else:
+                print("ERROR: client cannot connect to Modbus-RTU Device!")
+        except Exception as exc:
+            print(f"ERROR: received exception {exc}! Probably an Syntax Error!")
+
+
+    def close(self):
+        """Close connection of client
+        """
+        if self._client.connected:
+            self._client.close()
+            if self.verbose:
+                print("INFO: Connection closed!")
+        return None
+
+    @property
+    def metrics(self) -> TransactionMetrics:
+        """Transaction metrics of the device
+        """
+        return self._metrics
+
+    async def read_input_register(self, register_address, datatype, count = 1):
+        """Read the input register from the HD Wallbox
+        """
+        length = CONSTS.TYPE_TO_LENGTH[datatype] * count
+        result = await self._read_registers(0x04, register_address, length)
+        if result is False:
+            return False
+        return self.decode_register_readings(result, datatype, count)
+
+    async def read_holding_register(self, register_address, datatype, count = 1):
+        """Read the holding register from the HD Wallbox
+        """
+        length = CONSTS.TYPE_TO_LENGTH[datatype] * count
+        result = await self._read_registers(0x03, register_address, length)
+        if result is False:
+            return False
+        return self.decode_register_readings(result, datatype, count)
+
+    async def read_input_register_block(self, register_address, length):
+        """Read a block of input registers (code 0x04) in one transaction
+
+        Returns the raw 16 bit register values as list or False on error.
+        """
+        result = await self._read_registers(0x04, register_address, length)
+        if result is False:
+            return False
+        return result.registers
+
+    async def _read_registers(self, function_code, register_address, length):
+        """Read `length` registers with function code 0x03 or 0x04 with error handling
+        """
+        caller = 'read_input_register' if function_code == 0x04 else 'read_holding_register'
+        read = self._client.read_input_registers if function_code == 0x04 \
+            else self._client.read_holding_registers
+        return await self._transaction(caller, function_code, register_address, length, \
+                                       read(register_address, count=length, slave=self._device_unit_id))
+
+    async def _transaction(self, caller, function_code, register_address, count, request):
+        """Await one request, record it in the metrics
+
+        Returns the pymodbus result or False on error
+        """
+        start = time.monotonic()
+        try:
+            result = await request
+        except ModbusException as exc:
+            result = exc
+        outcome, exception_code = classify(result)
+        self._metrics.record(self._device_unit_id, function_code, register_address, count, \
+                             time.monotonic() - start, outcome, exception_code)
+        if outcome != OK:
+            if self.verbose:
+                if isinstance(result, Exception):
+                    print(f">>> {caller}: Received ModbusException({result}) from library")
+                else:
+                    # THIS IS NOT A PYTHON EXCEPTION, but a valid modbus message
+                    print(f">>> {caller}: Received Modbus library error({result})")
+            return False
+        return result
+
+    # decoding does not touch the bus, share it with the synchronous client
+    decode_register_readings = ModbusRTU.decode_register_readings
+
+    async def read_plan(self, plan):
+        """Execute a precompiled ReadPlan
+
+        Returns the list of raw register blocks or False on error
+        """
+        raw_blocks = []
+        for block in plan:
+            result = await self._read_registers(block.function_code, block.address, block.length)
+            if result is False:
+                return False
+            raw_blocks.append(result.registers)
+        return raw_blocks
+
+    async def write_register(self, register_address, value):
+        """Write register method (code 0x06) with error handling
+        """
+        register_values = self._client.convert_to_registers(value, data_type=self._client.DATATYPE.UINT16)
+        result = await self._transaction('write_register', 0x10, register_address, len(register_values), \
+                                         self._client.write_registers(register_address, values=register_values, \
+                                                                      slave=self._device_unit_id))
+        return result is not False
+
+
+
+class AsyncHDEnergyControl(AsyncModbusRTU):
+    """asyncio class for connecting the Wallbox Heidelberg Energy Control
+
+    All getters and setters are coroutines with the same arguments and
+    return values as in HDEnergyControl, see there for the register description.
+    """
+    async def get_snapshot(self, include_config = True):
+        """Get a snapshot of all input registers, see HDEnergyControl.get_snapshot
+        """
+        plan = SNAPSHOT_PLAN if include_config else MEASUREMENT_PLAN
+        values = await self.get_registers(plan=plan)
+        if values is False:
+            return False
+        return HDEnergyControlSnapshot.from_values(values)
+
+    async def get_register(self, name):
+        """Get one value of the register map, see HDEnergyControl.get_register
+        """
+        values = await self.get_registers(plan=REGISTER_PLANS[name])
+        if values is False:
+            return False
+        return values[name]
+
+    async def get_registers(self, *names, plan = None) -> dict:
+        """Get several values of the register map, see HDEnergyControl.get_registers
+        """
+        if plan is None:
+            plan = compile_read_plan(tuple(sorted(names)))
+        raw_blocks = await self.read_plan(plan)
+        if raw_blocks is False:
+            return False
+        return plan.decode(raw_blocks)
+
+    async def get_register_layout_version(self) -> str:
+        """Get register layout version (register 4)
+        """
+        return format_layout_version(await self.get_register('register_layout_version'))
+
+    async def get_charging_state(self) -> tuple[str]:
+        """Get charging state (register 5)
+        """
+        return describe_charging_state(await self.get_register('charging_state'))
+
+    async def get_currents_rms(self) -> tuple:
+        """Get the currents i1, i2, i3 in A (register 6, 7, 8)
+        """
+        return await self.get_register('currents_rms')
+
+    async def get_pcb_temperature(self) -> float:
+        """Get PCB temperature in °C (register 9)
+        """
+        return await self.get_register('pcb_temperature')
+
+    async def get_voltages_rms(self) -> tuple[int]:
+        """Get the voltages L1-N L2-N L3-N in V (register 10, 11, 12)
+        """
+        return await self.get_register('voltages_rms')
+
+    async def get_extern_lock_state(self) -> tuple:
+        """Get extern lock state (register 13)
+        """
+        lock_state = await self.get_register('extern_lock_state')
+        return (lock_state, CONSTS.EXTERN_LOCK[lock_state])
+
+    async def get_power(self) -> int:
+        """Get the power of all phases in VA (register 14)
+        """
+        return await self.get_register('power')
+
+    async def get_energy_since_power_on(self) -> int:
+        """Get energy since power on in VAh (register 15 + 16)
+        """
+        return await self.get_register('energy_since_power_on')
+
+    async def get_energy_since_installation(self) -> int:
+        """Get energy since installation in VAh (register 17 + 18)
+        """
+        return await self.get_register('energy_since_installation')
+
+    async def get_hw_config_max_current(self) -> int:
+        """Get the hw config max current in A (register 100)
+        """
+        return await self.get_register('hw_config_max_current')
+
+    async def get_hw_config_min_current(self) -> int:
+        """Get the hw config min current in A (register 101)
+        """
+        return await self.get_register('hw_config_min_current')
+
+    async def get_application_software_revision(self) -> int:
+        """Get the application software revision (register 203)
+        """
+        return await self.get_register('application_software_revision')
+
+    async def get_watchdog_timeout(self) -> int:
+        """Get the watchdog timeout in ms (register 257)
+        """
+        return await self.get_register('watchdog_timeout')
+
+    async def set_watchdog_timeout(self, timeout_ms = 0) -> bool:
+        """Set the watchdog timeout in ms (register 257)
+        """
+        return await self.write_register(CONSTS.REGISTERS['watchdog_timeout'].address, timeout_ms)
+
+    async def get_standby_function_control(self) -> tuple:
+        """Get the StandByFunction Control (register 258)
+        """
+        standby = await self.get_register('standby_function_control')
+        return (standby, CONSTS.STANDBY_FUNCTION[standby])
+
+    async def set_standby_function_control(self, state) -> bool:
+        """Set the StandByFunction Control (register 258)
+
+        state: 0 = enable Standby, 4 = disable Standby
+        """
+        if state not in (0, 4):
+            print ('ERROR: No valid value for setting the StandBy Function Control')
+            return False
+        return await self.write_register(CONSTS.REGISTERS['standby_function_control'].address, state)
+
+    async def get_remote_lock(self) -> tuple:
+        """Get the Remote lock state (register 259)
+        """
+        result = await self.get_register('remote_lock')
+        return (result, CONSTS.REMOTE_LOCK[result])
+
+    async def set_remote_lock(self, state) -> bool:
+        """Set the Remote lock state (register 259)
+
+        state: 0 = locked / 1 = unlocked
+        """
+        if state not in (0, 1):
+            print ('ERROR: No valid value for setting the Remote Lock')
+            return False
+        return await self.write_register(CONSTS.REGISTERS['remote_lock'].address, state)
+
+    async def get_maximal_current_command(self) -> float:
+        """Get maximal current in A (register 261)
+        """
+        return await self.get_register('maximal_current_command')
+
+    async def set_maximal_current_command(self, max_current = 16.0) -> bool:
+        """Set maximal current in A (register 261)
+
+        Returns True if update was successful; False if not needed
+        """
+        if max_current > 16.0:
+            # bound value to max of 16.0 A
+            max_current = 16.0
+        elif max_current < 6.0:
+            print (f'Input ({max_current}) is bound to 0 A, due to HW restriction < 6.0 A')
+        _max_current = int(max_current * 10)
+
+        actual_current = await self.get_maximal_current_command()
+        if actual_current == max_current:
+            print(f'[set_maximal_current_command]: value not written, {max_current} A is already set!', end='\n\n')
+            return False
+        return await self.write_register(CONSTS.REGISTERS['maximal_current_command'].address, _max_current)
+
+    async def get_failsafe_current_config(self) -> float:
+        """Get FailSafe Current in A (register 262)
+        """
+        return await self.get_register('failsafe_current_config')
+
+    async def set_failsafe_current_config(self, fs_current = 16.0) -> bool:
+        """Set Failsafe current in A (register 262)
+        """
+        if fs_current > 16.0:
+            # bound value to max of 16.0 A
+            fs_current = 16.0
+        elif fs_current < 6.0:
+            print (f'Input ({fs_current}) is bound to 0 A, due to HW restriction < 6.0 A')
+        _fs_current = int(fs_current * 10)
+        return await self.write_register(CONSTS.REGISTERS['failsafe_current_config'].address, _fs_current)
@@ -0,0 +1,188 @@
+"""Benchmark of the bus throughput and the latency of HD Energy Control getters and setters
+
+Usage:
+    python -m hd_energy_control.benchmark --baudrates 9600,19200,115200 --output benchmark.json
+
+Every baudrate is measured against the simulator (RTU framing over TCP,
+emulated transmission time) with the read cache disabled, so every call
+is a real transaction. The results are written as JSON, one record per
+baudrate and measured operation, latencies in ms:
+    {"baudrate": 19200, "kind": "getter", "name": "get_power", "calls": 50,
+     "errors": 0, "transactions": 50, "tx_per_s": 21.3, "mean_ms": 46.9,
+     "p50_ms": 46.5, "p95_ms": 48.1, "p99_ms": 49.0}
+"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+from .constants import HDEnergyControlConstants as CONSTS
+from .hd_energy_control import HDEnergyControl
+from .register_map import compile_read_plan
+from .simulator import SimulatorThread, create_context
+
+GETTERS = tuple(f'get_{name}' for name in CONSTS.REGISTERS)
+# two alternating arguments, so no write is skipped by the shadow state
+SETTERS = {
+    'set_watchdog_timeout': (0, 60000),
+    'set_standby_function_control': (0, 4),
+    'set_remote_lock': (1, 0),
+    'set_maximal_current_command': (16.0, 10.0),
+    'set_failsafe_current_config': (6.0, 8.0),
+}
+ALL_REGISTERS = CONSTS.MEASUREMENT_REGISTERS + CONSTS.CONFIG_REGISTERS + CONSTS.HOLDING_REGISTERS
+# strategies of a full poll of all registers
+POLL_STRATEGIES = {
+    'per_getter': None,
+    'block_gap_0': compile_read_plan(ALL_REGISTERS, max_gap=0),
+    'block_gap_1': compile_read_plan(ALL_REGISTERS, max_gap=1),
+    'block_max_8': compile_read_plan(ALL_REGISTERS, max_gap=1, max_length=8),
+}
+
+
+def percentile(sorted_values, percent) -> float:
+    """Percentile of sorted values with linear interpolation
+    """
+    if not sorted_values:
+        return float('nan')
+    position = (len(sorted_values) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def _transactions(context) -> int:
+    """Number of requests served by all simulated units
+    """
+    return sum(context[unit_id].requests for unit_id in context.slaves())
+
+
+def measure(function, context, samples = 50, warmup = 2) -> dict:
+    """Call function samples times and summarize the latency
+    -----
+    Args:
+        function: callable with the call index as argument, returns False on error
+        context: ModbusServerContext of the simulator
+        samples (int): measured calls
+        warmup (int): calls before the measurement
+
+    Returns:
+        dict with calls, errors, transactions, tx_per_s, mean_ms, p50_ms, p95_ms, p99_ms
+    """
+    for index in range(warmup):
+        function(index)
+    durations = []
+    errors = 0
+    transactions = _transactions(context)
+    start = time.perf_counter()
+    for index in range(samples):
+        call_start = time.perf_counter()
+        if function(index) is False:
+            errors += 1
+        durations.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    transactions = _transactions(context) - transactions
+    durations.sort()
+    return {
+        'calls': samples,
+        'errors': errors,
+        'transactions': transactions,
+        'tx_per_s': round(transactions / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': round(sum(durations) / samples * 1000, 3),
+        'p50_ms': round(percentile(durations, 50) * 1000, 3),
+        'p95_ms': round(percentile(durations, 95) * 1000, 3),
+        'p99_ms': round(percentile(durations, 99) * 1000, 3),
+    }
+
+
+def _full_poll(wallbox, plan):
+    """One poll of all registers with a strategy of POLL_STRATEGIES
+    """
+    if plan is None:
+        results = [getattr(wallbox, getter)() for getter in GETTERS]
+        return False if any(result is False for result in results) else results
+    return wallbox.get_registers(plan=plan)
+
+
+def run_benchmark(baudrate, samples = 50, response_delay = 0.0, getters = GETTERS, \
+                  setters = tuple(SETTERS), strategies = tuple(POLL_STRATEGIES)) -> list:
+    """Benchmark one baudrate against a new simulator
+    -----
+    Args:
+        baudrate (int): emulated baudrate, 0 = no emulation
+        samples (int): measured calls per operation
+        response_delay (float): processing time of the simulated device in s
+        getters, setters, strategies: names of the measured operations
+
+    Returns:
+        list of result records
+    """
+    context = create_context(response_delay=response_delay, baudrate=baudrate)
+    records = []
+    with SimulatorThread(context) as simulator:
+        wallbox = HDEnergyControl(port=simulator.url, cache=False, verbose=False)
+        wallbox.connect()
+        try:
+            for getter in getters:
+                method = getattr(wallbox, getter)
+                result = measure(lambda index: method(), context, samples)
+                records.append({'baudrate': baudrate, 'kind': 'getter', 'name': getter, **result})
+            for setter in setters:
+                method = getattr(wallbox, setter)
+                values = SETTERS[setter]
+                # the shadow state must know the actual value of every register
+                method(values[1])
+                result = measure(lambda index: method(values[index % 2]), context, samples)
+                records.append({'baudrate': baudrate, 'kind': 'setter', 'name': setter, **result})
+            for strategy in strategies:
+                plan = POLL_STRATEGIES[strategy]
+                result = measure(lambda index: _full_poll(wallbox, plan), context, samples)
+                records.append({'baudrate': baudrate, 'kind': 'poll', 'name': strategy, **result})
+        finally:
+            wallbox.close()
+    return records
+
+
+def print_records(records, file = sys.stdout) -> None:
+    """Print the records as table
+    """
+    print(f'{"baudrate":>8} {"kind":<6} {"name":<34} {"tx/s":>8} {"p50 ms":>8} '
+          f'{"p95 ms":>8} {"p99 ms":>8} {"tx":>5} {"err":>4}', file=file)
+    for record in records:
+        print(f'{record["baudrate"]:>8} {record["kind"]:<6} {record["name"]:<34} '
+              f'{record["tx_per_s"]:>8.1f} {record["p50_ms"]:>8.2f} {record["p95_ms"]:>8.2f} '
+              f'{record["p99_ms"]:>8.2f} {record["transactions"]:>5} {record["errors"]:>4}', file=file)
+
+
+def main(argv = None) -> None:
+    """Entry point of python -m hd_energy_control.benchmark
+    """
+    parser = argparse.ArgumentParser(description='Benchmark of HD Energy Control against the simulator')
+    parser.add_argument('--baudrates', default='9600,19200,115200', help='comma separated baudrates')
+    parser.add_argument('--samples', type=int, default=50, help='measured calls per operation')
+    parser.add_argument('--delay', type=float, default=0.0, help='response delay of the device in s')
+    parser.add_argument('--only', choices=('getter', 'setter', 'poll'), help='measure only one kind')
+    parser.add_argument('--output', help='JSON file of the results')
+    args = parser.parse_args(argv)
+    selection = {
+        'getters': GETTERS if args.only in (None, 'getter') else (),
+        'setters': tuple(SETTERS) if args.only in (None, 'setter') else (),
+        'strategies': tuple(POLL_STRATEGIES) if args.only in (None, 'poll') else (),
+    }
+    records = []
+    for baudrate in (int(baudrate) for baudrate in args.baudrates.split(',')):
+        records.extend(run_benchmark(baudrate, args.samples, args.delay, **selection))
+    print_records(records)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({'created': time.time(), 'python': platform.python_version(), \
+                       'samples': args.samples, 'response_delay': args.delay, \
+                       'results': records}, file, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""Module providing one RS-485 bus with several HD Energy Control units and its scheduler"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+from .hd_energy_control import HDEnergyControl, create_client
+from .metrics import TransactionMetrics
+from .register_map import compile_read_plan
+
+
+class ModbusRTUBus:
+    """One serial port shared by several Modbus units
+
+    The bus owns the pymodbus client, all HDEnergyControl objects
+    created by unit() use this client instead of opening the port again
+    and record their transactions in the shared metrics of the bus.
+    """
+    MAX_UNITS = 16
+
+    def __init__(self, port = "/dev/ttyUSB0", baudrate = 19200, bytesize = 8, parity = 'E', \
+                 stopbits = 1, retries = 1):
+        """Constructor of ModbusRTUBus
+        -----
+        Args:
+            port: serial device of the bus
+            baudrate, bytesize, parity, stopbits: serial parameters, 19200 8E1 by default
+            retries (int): retries of a request without response, the timeout is
+                           learned per unit (see UnitHealth)
+        """
+        self._client = create_client(port, baudrate, bytesize, parity, stopbits)
+        self._retries = retries
+        self._units = {}
+        self._metrics = TransactionMetrics()
+
+    def __del__(self):
+        """ Destructor of ModbusRTUBus
+        """
+        self.close()
+
+    def connect(self) -> bool:
+        """Establish connection of the shared client
+        """
+        try:
+            if self._client.connect():
+                print("INFO: bus connected successfully!", end='\n\n')
+                return True
+            print("ERROR: bus cannot connect to the serial port!")
+        except Exception as exc:
+            print(f"ERROR: received exception {exc}!")
+        return False
+
+    def close(self):
+        """Close the shared client
+        """
+        if self._client.is_socket_open():
+            self._client.close()
+            print("INFO: Bus connection closed!")
+
+    def unit(self, device_unit_id) -> HDEnergyControl:
+        """Get the HDEnergyControl of the unit id (created on first use)
+        """
+        if device_unit_id not in self._units:
+            if len(self._units) >= self.MAX_UNITS:
+                raise ValueError(f'a bus serves at most {self.MAX_UNITS} units')
+            self._units[device_unit_id] = HDEnergyControl(device_unit_id=device_unit_id, \
+                                                          client=self._client, metrics=self._metrics, \
+                                                          retries=self._retries)
+        return self._units[device_unit_id]
+
+    @property
+    def metrics(self) -> TransactionMetrics:
+        """Transaction metrics of all units of the bus
+        """
+        return self._metrics
+
+    @property
+    def units(self) -> dict:
+        """All units of the bus: unit id -> HDEnergyControl
+        """
+        return dict(self._units)
+
+
+class _PollJob:
+    """One block read of one unit, repeated every interval seconds
+    """
+    __slots__ = ('device_unit_id', 'block', 'interval', 'callback')
+
+    def __init__(self, device_unit_id, block, interval, callback):
+        self.device_unit_id = device_unit_id
+        self.block = block
+        self.interval = interval
+        self.callback = callback
+
+
+class _VerifyJob:
+    """Periodic verify read of the holding register shadow of one unit
+    """
+    __slots__ = ('device_unit_id', 'interval')
+
+    def __init__(self, device_unit_id, interval):
+        self.device_unit_id = device_unit_id
+        self.interval = interval
+
+
+class BusScheduler:
+    """Scheduler for all transactions of one ModbusRTUBus
+
+    Polls are registered per unit and register group with their own interval.
+    Every block read of every unit is one job, due jobs are executed in the
+    order of their due time, so the units are interleaved on the bus.
+    Pending writes are always executed before the next poll, the writes
+    of one unit are merged into one control tick.
+
+    Only the scheduler thread uses the bus, submit_write() may be called
+    from every thread. The units are used directly, not through a
+    RequestDispatcher, so do not access the bus from other threads.
+    """
+    def __init__(self, bus):
+        self._bus = bus
+        self._polls = []
+        self._writes = deque()
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._stop_requested = False
+        self.transactions = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self._started = None
+        self._keepalive = None
+
+    def set_keepalive(self, keepalive) -> None:
+        """Let the scheduler refresh the watchdogs of a WatchdogKeepalive
+
+        A refresh is only sent when a unit was not contacted by a poll
+        or write within the margin of its watchdog timeout.
+        """
+        with self._condition:
+            self._keepalive = keepalive
+            self._condition.notify()
+
+    def add_poll(self, device_unit_id, names, interval, callback, max_gap = 8) -> None:
+        """Poll the registers of one unit periodically
+        -----
+        Args:
+            device_unit_id (int): unit id on the bus
+            names (tuple): register names of CONSTS.REGISTERS
+            interval (float): poll interval in seconds
+            callback: called with (device_unit_id, values) for each block read,
+                      values is the dict name -> value or False on error
+            max_gap (int): unused registers read to merge two blocks, one register
+                           costs 2 bytes while an extra request costs a full round trip
+        """
+        self._bus.unit(device_unit_id)
+        plan = compile_read_plan(tuple(sorted(names)), max_gap)
+        now = time.monotonic()
+        with self._condition:
+            for block in plan:
+                job = _PollJob(device_unit_id, block, interval, callback)
+                heapq.heappush(self._polls, (now, next(self._sequence), job))
+            self._condition.notify()
+
+    def add_shadow_verify(self, device_unit_id, interval = 60.0) -> None:
+        """Read the holding registers of one unit periodically and update its shadow
+
+        A value changed on the device (failsafe fallback, power cycle) is
+        detected within interval seconds, so no write is skipped because of
+        a stale shadow state.
+        """
+        self._bus.unit(device_unit_id)
+        with self._condition:
+            heapq.heappush(self._polls, (time.monotonic(), next(self._sequence), \
+                                         _VerifyJob(device_unit_id, interval)))
+            self._condition.notify()
+
+    def submit_write(self, device_unit_id, register_address, value, callback = None) -> None:
+        """Queue a write, it is executed before the next poll
+        -----
+        Args:
+            device_unit_id (int): unit id on the bus
+            register_address (int): holding register address
+            value (int): raw register value
+            callback: called with (device_unit_id, register_address, result)
+        """
+        self._bus.unit(device_unit_id)
+        with self._condition:
+            self._writes.append((device_unit_id, register_address, value, callback))
+            self._condition.notify()
+
+    def run_once(self, timeout = 0.0) -> bool:
+        """Execute the next pending write or due poll
+
+        Waits up to timeout seconds for work, returns True if a
+        transaction was executed.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                job = self._next_job()
+                if job is not None:
+                    break
+                now = time.monotonic()
+                remaining = deadline - now
+                if remaining <= 0 or self._stop_requested:
+                    return False
+                if self._polls:
+                    remaining = min(remaining, self._polls[0][0] - now)
+                if self._keepalive is not None:
+                    remaining = min(remaining, self._keepalive.next_due() - now)
+                self._condition.wait(max(remaining, 0.0))
+        start = time.monotonic()
+        if isinstance(job, list):
+            self._execute_writes(job)
+        elif isinstance(job, _VerifyJob):
+            self._execute_verify(job)
+        elif not isinstance(job, _PollJob):
+            self._execute_refresh(job)
+        else:
+            self._execute_poll(job)
+        self.busy_time += time.monotonic() - start
+        self.transactions += 1
+        return True
+
+    def _next_job(self):
+        """Pop the next write or due poll job (called with the lock held)
+        """
+        if self._writes:
+            # all queued writes of the same unit are executed as one control tick
+            batch = [self._writes.popleft()]
+            for write in list(self._writes):
+                if write[0] == batch[0][0]:
+                    self._writes.remove(write)
+                    batch.append(write)
+            return batch
+        if self._polls and self._polls[0][0] <= time.monotonic():
+            due, _, job = heapq.heappop(self._polls)
+            # keep the schedule, but do not catch up missed cycles in a burst
+            next_due = due + job.interval
+            now = time.monotonic()
+            if next_due < now:
+                next_due = now
+            heapq.heappush(self._polls, (next_due, next(self._sequence), job))
+            return job
+        if self._keepalive is not None:
+            due = self._keepalive.due_units()
+            if due:
+                return due[0]
+        return None
+
+    def _execute_writes(self, batch):
+        """Execute the queued writes of one unit
+
+        Unchanged values are skipped and adjacent registers are merged
+        into one request by the control tick of the unit.
+        """
+        unit = self._bus.unit(batch[0][0])
+        with unit.control_tick():
+            for _, register_address, value, _ in batch:
+                unit.write_register(register_address, value)
+        result = unit.flush_result
+        if not result:
+            self.errors += 1
+        for device_unit_id, register_address, _, callback in batch:
+            if callback is not None:
+                self._callback(callback, device_unit_id, register_address, result)
+
+    def _execute_verify(self, job):
+        """Execute the verify read of the shadow of one unit
+        """
+        try:
+            if self._bus.unit(job.device_unit_id).verify_shadow() is False:
+                self.errors += 1
+        except Exception as exc:
+            self.errors += 1
+            print(f"ERROR: verify of unit {job.device_unit_id} failed ({exc!r})")
+
+    def _execute_refresh(self, unit):
+        """Execute the watchdog refresh of a unit
+        """
+        try:
+            self._keepalive.refresh(unit)
+        except Exception as exc:
+            self.errors += 1
+            print(f"ERROR: watchdog refresh of unit {unit.device_unit_id} failed ({exc!r})")
+
+    def _execute_poll(self, job):
+        """Execute one block read of a poll job
+        """
+        raw_blocks = self._bus.unit(job.device_unit_id).read_plan((job.block,))
+        if raw_blocks is False:
+            self.errors += 1
+            values = False
+        else:
+            values = job.block.decode(raw_blocks[0])
+        self._callback(job.callback, job.device_unit_id, values)
+
+    @staticmethod
+    def _callback(callback, *args) -> None:
+        """Call a user callback, an exception must not stop the scheduler thread
+        """
+        try:
+            callback(*args)
+        except Exception as exc:
+            print(f"ERROR: received exception {exc!r} from callback {getattr(callback, '__name__', callback)}!")
+
+    @property
+    def utilization(self) -> float:
+        """Share of the time the bus was busy since start()
+        """
+        if self._started is None:
+            return 0.0
+        elapsed = time.monotonic() - self._started
+        return self.busy_time / elapsed if elapsed > 0 else 0.0
+
+    def _set_running(self) -> None:
+        with self._condition:
+            self._running = True
+            self._stop_requested = False
+            self._started = time.monotonic()
+
+    def _loop(self) -> None:
+        while self._running:
+            self.run_once(timeout=0.5)
+
+    def run(self) -> None:
+        """Execute transactions until stop() is called
+        """
+        self._set_running()
+        self._loop()
+
+    def start(self) -> None:
+        """Run the scheduler in a background thread
+
+        The scheduler is running when start() returns, so an immediate
+        stop() is not lost.
+        """
+        self._set_running()
+        self._thread = threading.Thread(target=self._loop, name='BusScheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the scheduler thread
+        """
+        with self._condition:
+            self._running = False
+            self._stop_requested = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -2,6 +2,30 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import math
+from typing import NamedTuple, Optional
+
+
+class RegisterDefinition(NamedTuple):
+    """Declarative description of one (multi) register value
+
+    address:       first register address
+    function_code: 0x04 (input register) or 0x03 (holding register)
+    datatype:      'U16', 'S16', 'U32', ... see TYPE_TO_LENGTH
+    scale:         factor from the raw value to the unit, e.g. 0.1
+    unit:          physical unit of the scaled value
+    enum:          mapping of raw value to text or None
+    count:         number of consecutive values of the datatype
+    """
+    address: int
+    function_code: int
+    datatype: str
+    scale: float = 1
+    unit: str = ''
+    enum: Optional[dict] = None
+    count: int = 1
+
+
 class HDEnergyControlConstants:
     """constants for use with pymodbus
     """
@@ -39,3 +63,48 @@ class HDEnergyControlConstants:
 
     REMOTE_LOCK = {0: 'locked', \
                    1: 'unlocked'}
+
+    EXTERN_LOCK = {0: 'System locked', \
+                   1: 'System unlocked'}
+
+    # Register map of the HD Energy Control
+    # see docs/ModBus-Register-Tabelle.pdf and docs/Erweiterte-ModBus-Registerbeschreibung.pdf
+    REGISTERS = {
+        'register_layout_version':        RegisterDefinition(4, 0x04, 'U16'),
+        'charging_state':                 RegisterDefinition(5, 0x04, 'U16', enum=STATE),
+        'currents_rms':                   RegisterDefinition(6, 0x04, 'U16', 0.1, 'A', count=3),
+        'pcb_temperature':                RegisterDefinition(9, 0x04, 'S16', 0.1, '°C'),
+        'voltages_rms':                   RegisterDefinition(10, 0x04, 'U16', 1, 'V', count=3),
+        'extern_lock_state':              RegisterDefinition(13, 0x04, 'U16', enum=EXTERN_LOCK),
+        'power':                          RegisterDefinition(14, 0x04, 'U16', 1, 'VA'),
+        'energy_since_power_on':          RegisterDefinition(15, 0x04, 'U32', 1, 'VAh'),
+        'energy_since_installation':      RegisterDefinition(17, 0x04, 'U32', 1, 'VAh'),
+        'hw_config_max_current':          RegisterDefinition(100, 0x04, 'U16', 1, 'A'),
+        'hw_config_min_current':          RegisterDefinition(101, 0x04, 'U16', 1, 'A'),
+        'application_software_revision':  RegisterDefinition(203, 0x04, 'U16'),
+        'watchdog_timeout':               RegisterDefinition(257, 0x03, 'U16', 1, 'ms'),
+        'standby_function_control':       RegisterDefinition(258, 0x03, 'U16', enum=STANDBY_FUNCTION),
+        'remote_lock':                    RegisterDefinition(259, 0x03, 'U16', enum=REMOTE_LOCK),
+        'maximal_current_command':        RegisterDefinition(261, 0x03, 'U16', 0.1, 'A'),
+        'failsafe_current_config':        RegisterDefinition(262, 0x03, 'U16', 0.1, 'A'),
+    }
+
+    # groups of registers which are read together
+    MEASUREMENT_REGISTERS = ('register_layout_version', 'charging_state', 'currents_rms', \
+                             'pcb_temperature', 'voltages_rms', 'extern_lock_state', 'power', \
+                             'energy_since_power_on', 'energy_since_installation')
+
+    CONFIG_REGISTERS = ('hw_config_max_current', 'hw_config_min_current', \
+                        'application_software_revision')
+
+    HOLDING_REGISTERS = ('watchdog_timeout', 'standby_function_control', 'remote_lock', \
+                         'maximal_current_command', 'failsafe_current_config')
+
+    # freshness of cached register values in seconds, registers without
+    # entry are always read from the bus
+    CACHE_TTL = {'register_layout_version': math.inf,
+                 'hw_config_max_current': math.inf,
+                 'hw_config_min_current': math.inf,
+                 'application_software_revision': math.inf,
+                 'energy_since_power_on': 5.0,
+                 'energy_since_installation': 5.0}
@@ -0,0 +1,197 @@
+"""Long running polling daemon for HD Energy Control wallboxes
+
+Usage:
+    python -m hd_energy_control.daemon --config /etc/hd_energy_control.ini
+
+The daemon keeps the serial bus and the database connection open,
+polls all units on a fixed monotonic schedule and shuts down cleanly
+on SIGINT / SIGTERM. See examples/hd_energy_control_daemon.ini
+"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import configparser
+import signal
+import threading
+import time
+
+from .bus import ModbusRTUBus
+from .deadband import Deadband, DeadbandFilter
+
+
+def snapshot_to_row(snapshot, unit_id = None) -> tuple:
+    """Values of a snapshot in the order of the stored procedure 'add_wb_data'
+
+    [unit id], i1, i2, i3, u1, u2, u3, power, temperature, energy since power on (kVAh),
+    energy since installation (kVAh), the unit id only if it is given
+    """
+    if unit_id is not None:
+        return (unit_id, *snapshot_to_row(snapshot))
+    return (*snapshot.currents_rms, *snapshot.voltages_rms, snapshot.power, \
+            snapshot.pcb_temperature, snapshot.energy_since_power_on/1000, \
+            snapshot.energy_since_installation/1000)
+
+
+class PollingDaemon:
+    """Poll all configured units every interval seconds and store the values
+
+    The daemon thread uses its own bus directly, not through a
+    RequestDispatcher.
+    """
+    def __init__(self, config):
+        """Constructor of PollingDaemon
+        -----
+        Args:
+            config: configparser.ConfigParser with the sections [modbus] and [mariadb] (optional)
+        """
+        modbus = config['modbus']
+        self._interval = modbus.getfloat('interval', 60.0)
+        self._unit_ids = [int(unit_id) for unit_id in modbus.get('unit_ids', '1').split(',')]
+        self._max_current = modbus.getfloat('max_current', fallback=None)
+        self._verify_interval = modbus.getfloat('verify_interval', 300.0)
+        self._next_verify = 0.0
+        self._bus = ModbusRTUBus(modbus.get('port', '/dev/ttyAMA0'), \
+                                 baudrate=modbus.getint('baudrate', 19200), \
+                                 parity=modbus.get('parity', 'E'), \
+                                 stopbits=modbus.getint('stopbits', 1), \
+                                 retries=modbus.getint('retries', 1))
+        self._stop = threading.Event()
+        self._writer = None
+        self._spool = None
+        if config.has_section('mariadb'):
+            self._writer = self._create_writer(config['mariadb'])
+        self._filters = {}
+        if config.has_section('publish'):
+            self._filters = self._create_filters(config['publish'])
+        self.cycles = 0
+        self.overruns = 0
+
+    def _create_writer(self, section):
+        """Create the batch writer of the [mariadb] section
+        """
+        # imported here, the daemon also runs without database
+        from maria_db_mysql import MariaDBMysql, MariaDBBatchWriter, SampleSpool
+        db_config = {key: section[key] for key in ('user', 'password', 'database', 'host')}
+        db_config['port'] = section.getint('port', 3306)
+        if section.get('spool_path'):
+            self._spool = SampleSpool(section['spool_path'], max_rows=section.getint('spool_max_rows', 1000000))
+        maria_db = MariaDBMysql(db_config, pool_size=section.getint('pool_size', fallback=None), \
+                                spool=self._spool)
+        if section.get('table'):
+            target = {'table': section['table'], 'columns': section.get('columns')}
+        else:
+            target = {'procedure': section.get('procedure', 'add_wb_data')}
+        writer = MariaDBBatchWriter(maria_db, **target, \
+                                    batch_size=section.getint('batch_size', 1), \
+                                    flush_interval=section.getfloat('flush_interval', 60.0))
+        writer.start()
+        return writer
+
+    def _create_filters(self, section):
+        """Create one DeadbandFilter per unit of the [publish] section
+
+        heartbeat = seconds, every other key is a field with
+        "absolute" or "absolute, relative" deadband
+        """
+        heartbeat = section.getfloat('heartbeat', 900.0)
+        deadbands = dict(DeadbandFilter.DEFAULT_DEADBANDS)
+        for name, value in section.items():
+            if name != 'heartbeat':
+                deadbands[name] = Deadband(*(float(part) for part in value.split(',')))
+        return {unit_id: DeadbandFilter(deadbands, heartbeat) for unit_id in self._unit_ids}
+
+    def stop(self, *_args) -> None:
+        """Request the shutdown (usable as signal handler)
+        """
+        self._stop.set()
+
+    def verify(self) -> None:
+        """Read the holding registers of all units every verify_interval s
+
+        Keeps the shadow state of the units in line with the devices (e.g. after a
+        power cycle), the configured maximal current is written again if the device
+        value differs from it.
+        """
+        now = time.monotonic()
+        if not self._verify_interval or now < self._next_verify:
+            return
+        self._next_verify = now + self._verify_interval
+        for unit_id in self._unit_ids:
+            unit = self._bus.unit(unit_id)
+            if unit.verify_shadow() is False or self._max_current is None:
+                continue
+            # compared with the target, the shadow may have been cleared before the read
+            if unit.get_maximal_current_command() != self._max_current:
+                unit.set_maximal_current_command(self._max_current)
+
+    def poll(self) -> None:
+        """Poll all units once
+        """
+        for unit_id in self._unit_ids:
+            snapshot = self._bus.unit(unit_id).get_snapshot(include_config=False)
+            if snapshot is False:
+                print(f"ERROR: unit {unit_id} not readable!")
+                continue
+            if unit_id in self._filters and not self._filters[unit_id].update_snapshot(snapshot):
+                # nothing changed
+                continue
+            row = snapshot_to_row(snapshot, unit_id)
+            if self._writer is None:
+                print(*row)
+            else:
+                self._writer.add(row)
+
+    def run(self) -> None:
+        """Poll on a monotonic schedule until stop() is called
+        """
+        self._bus.connect()
+        try:
+            if self._max_current is not None:
+                for unit_id in self._unit_ids:
+                    self._bus.unit(unit_id).set_maximal_current_command(self._max_current)
+            start = time.monotonic()
+            while not self._stop.is_set():
+                self.verify()
+                self.poll()
+                self.cycles += 1
+                next_cycle = start + self.cycles * self._interval
+                now = time.monotonic()
+                if next_cycle < now:
+                    # skip the missed cycles instead of polling in a burst
+                    missed = int((now - next_cycle) // self._interval) + 1
+                    self.overruns += missed
+                    self.cycles += missed
+                    next_cycle = start + self.cycles * self._interval
+                self._stop.wait(next_cycle - now)
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Flush the database writer and close all connections
+        """
+        if self._writer is not None:
+            self._writer.stop()
+        if self._spool is not None:
+            self._spool.close()
+        self._bus.close()
+        print("INFO: daemon stopped!")
+
+
+def main(argv = None) -> None:
+    """Entry point of python -m hd_energy_control.daemon
+    """
+    parser = argparse.ArgumentParser(description='Polling daemon for HD Energy Control wallboxes')
+    parser.add_argument('--config', required=True, help='path of the configuration file (ini)')
+    args = parser.parse_args(argv)
+    config = configparser.ConfigParser()
+    if not config.read(args.config):
+        parser.error(f'cannot read configuration file {args.config}')
+    daemon = PollingDaemon(config)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Module providing the change driven publishing of HD Energy Control values"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+from typing import NamedTuple
+
+
+class Deadband(NamedTuple):
+    """Change of a value which is published
+
+    A value is published if it differs from the last published value by
+    more than absolute and more than relative * |last published value|,
+    so the relative part widens the deadband of large values.
+    """
+    absolute: float = 0.0
+    relative: float = 0.0
+
+    def exceeded(self, last, value) -> bool:
+        """True if value is outside the deadband around last
+        """
+        change = abs(value - last)
+        return change > self.absolute and change > self.relative * abs(last)
+
+
+class DeadbandFilter:
+    """Decide which samples of one wallbox are published (stored)
+
+    A sample is published if
+    - one of the state fields changed (charging state, lock state ...),
+    - one value left its deadband around the last published value,
+    - or heartbeat seconds passed since the last publication.
+    Fields without deadband are published on every change, tuples
+    (e.g. currents of L1, L2, L3) are compared per element.
+    """
+    DEFAULT_DEADBANDS = {
+        'currents_rms': Deadband(0.5),
+        'voltages_rms': Deadband(3),
+        'pcb_temperature': Deadband(1.0),
+        'power': Deadband(100, 0.05),
+        'energy_since_power_on': Deadband(100),
+        'energy_since_installation': Deadband(100),
+    }
+    STATE_FIELDS = ('charging_state', 'extern_lock_state', 'register_layout_version', \
+                    'remote_lock', 'standby_function_control', 'maximal_current_command')
+    IGNORED_FIELDS = ('timestamp',)
+
+    def __init__(self, deadbands = None, heartbeat = 900.0, state_fields = STATE_FIELDS):
+        """Constructor of DeadbandFilter
+        -----
+        Args:
+            deadbands (dict): field name -> Deadband, default DEFAULT_DEADBANDS
+            heartbeat (float): seconds after which a sample is published anyway, None = never
+            state_fields (tuple): fields of which every change is published
+        """
+        self._deadbands = dict(self.DEFAULT_DEADBANDS if deadbands is None else deadbands)
+        self._heartbeat = heartbeat
+        self._state_fields = frozenset(state_fields)
+        self._published = None
+        self._published_at = None
+        self.samples = 0
+        self.published = 0
+
+    @property
+    def suppression(self) -> float:
+        """Share of the samples which were not published
+        """
+        return 1 - self.published / self.samples if self.samples else 0.0
+
+    def _changed(self, name, last, value) -> bool:
+        if name in self._state_fields:
+            return value != last
+        if isinstance(value, (tuple, list)):
+            if not isinstance(last, (tuple, list)) or len(last) != len(value):
+                return True
+            return any(self._changed(name, old, new) for old, new in zip(last, value))
+        if not isinstance(value, (int, float)) or not isinstance(last, (int, float)):
+            return value != last
+        deadband = self._deadbands.get(name)
+        if deadband is None:
+            return value != last
+        return deadband.exceeded(last, value)
+
+    def update(self, values, now = None) -> bool:
+        """Check one sample, it becomes the new reference if it is published
+        -----
+        Args:
+            values (dict): field name -> value, e.g. of get_registers()
+            now (float): time.monotonic() of the sample
+
+        Returns:
+            True if the sample must be published
+        """
+        if now is None:
+            now = time.monotonic()
+        self.samples += 1
+        publish = self._published is None \
+            or (self._heartbeat is not None and now - self._published_at >= self._heartbeat) \
+            or any(self._changed(name, self._published.get(name), value) \
+                   for name, value in values.items() if name not in self.IGNORED_FIELDS)
+        if publish:
+            self._published = dict(values)
+            self._published_at = now
+            self.published += 1
+        return publish
+
+    def update_snapshot(self, snapshot, now = None) -> bool:
+        """Check a HDEnergyControlSnapshot, see update()
+        """
+        return self.update(vars(snapshot), now)
@@ -0,0 +1,204 @@
+"""Module providing the serialized, thread-safe access to HD Energy Control units
+
+ModbusRTU is not thread-safe: two threads using the same serial client
+interleave their frames on the wire. The RequestDispatcher executes all
+jobs in one thread ordered by priority, ThreadSafeHDEnergyControl submits
+every method call of a wallbox as one job and returns its result:
+
+    dispatcher = RequestDispatcher()
+    wallbox = ThreadSafeHDEnergyControl(HDEnergyControl(port="/dev/ttyAMA0"), dispatcher)
+    wallbox.get_snapshot()                          # from every thread
+    future = wallbox.submit('get_power')            # concurrent.futures.Future
+    wallbox.atomic(lambda box: box.set_maximal_current_command(box.get_maximal_current_command() + 1))
+"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+# priorities of the jobs, lower is executed first
+WRITE_PRIORITY = 0
+READ_PRIORITY = 10
+
+# method prefixes of HDEnergyControl which are executed with WRITE_PRIORITY
+WRITE_METHODS = ('set_', 'write_', 'flush_', 'refresh_', 'keep_')
+
+
+class RequestDispatcher:
+    """Single thread which executes the submitted jobs one after another
+
+    Jobs are executed in the order of their priority, jobs of the same
+    priority in the order of submission. A job submitted by a job (in the
+    dispatcher thread) is executed at once, so nested calls do not deadlock.
+    """
+    def __init__(self, name = 'RequestDispatcher'):
+        self.name = name
+        self._jobs = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+        self.executed = 0
+        self.busy_time = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def queued(self) -> int:
+        """Number of waiting jobs
+        """
+        return len(self._jobs)
+
+    def in_dispatcher_thread(self) -> bool:
+        """True if called by a job
+        """
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, function, *args, priority = READ_PRIORITY, **kwargs) -> Future:
+        """Queue function(*args, **kwargs), returns a Future of its result
+        """
+        future = Future()
+        if self.in_dispatcher_thread():
+            self._execute(future, function, args, kwargs, time.monotonic())
+            return future
+        with self._condition:
+            if not self._running:
+                raise RuntimeError(f'{self.name} is not running')
+            heapq.heappush(self._jobs, (priority, next(self._sequence), time.monotonic(), \
+                                        future, function, args, kwargs))
+            self._condition.notify()
+        return future
+
+    def call(self, function, *args, priority = READ_PRIORITY, timeout = None, **kwargs):
+        """Execute function(*args, **kwargs) in the dispatcher thread and return its result
+        """
+        return self.submit(function, *args, priority=priority, **kwargs).result(timeout)
+
+    def _execute(self, future, function, args, kwargs, submitted) -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        start = time.monotonic()
+        self.max_wait = max(self.max_wait, start - submitted)
+        try:
+            result = function(*args, **kwargs)
+        except Exception as exc:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+        self.busy_time += time.monotonic() - start
+        self.executed += 1
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._jobs or not self._running)
+                if not self._jobs:
+                    break
+                _, _, submitted, future, function, args, kwargs = heapq.heappop(self._jobs)
+            self._execute(future, function, args, kwargs, submitted)
+
+    def start(self) -> None:
+        """Start the dispatcher thread
+        """
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Execute the queued jobs and stop the dispatcher thread
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        """Executed jobs, queue length, busy time and the longest wait of a job in s
+        """
+        return {'executed': self.executed, 'queued': self.queued, 'busy_time': self.busy_time, \
+                'max_wait': self.max_wait}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class ThreadSafeHDEnergyControl:
+    """Thread-safe proxy of a HDEnergyControl (or ModbusRTU)
+
+    Every method call is executed as one job of the dispatcher, so the
+    frames, the read cache and the shadow state of the wallbox are only used
+    by the dispatcher thread and a method like set_maximal_current_command
+    (read, then write) is not interleaved with other requests. Setters and
+    writes are executed before queued reads. Use one dispatcher for all
+    units of a ModbusRTUBus, they share the serial client.
+
+    atomic() executes a sequence of calls (e.g. read-modify-write) as one
+    job, control_tick() is only available inside of atomic(). Attributes
+    and properties (e.g. last_contact) are read in the dispatcher thread too.
+
+    BusScheduler and PollingDaemon use the units of their bus directly and
+    not through a dispatcher, do not share a bus between them and a
+    ThreadSafeHDEnergyControl.
+    """
+    def __init__(self, wallbox, dispatcher = None):
+        """Constructor of ThreadSafeHDEnergyControl
+        -----
+        Args:
+            wallbox: HDEnergyControl, not used directly by other threads afterwards
+            dispatcher: shared RequestDispatcher or None for an own one, it is started
+        """
+        self._wallbox = wallbox
+        self._dispatcher = dispatcher if dispatcher is not None else RequestDispatcher()
+        self._dispatcher.start()
+
+    @property
+    def dispatcher(self) -> RequestDispatcher:
+        """Dispatcher which executes the calls
+        """
+        return self._dispatcher
+
+    @staticmethod
+    def _priority(name) -> int:
+        return WRITE_PRIORITY if name.startswith(WRITE_METHODS) else READ_PRIORITY
+
+    def submit(self, name, *args, priority = None, **kwargs) -> Future:
+        """Queue a method call of the wallbox, returns a Future of its result
+        """
+        if priority is None:
+            priority = self._priority(name)
+        return self._dispatcher.submit(getattr(self._wallbox, name), *args, priority=priority, **kwargs)
+
+    def atomic(self, function, *args, priority = WRITE_PRIORITY, timeout = None):
+        """Execute function(wallbox, *args) as one job and return its result
+
+        No other request of the dispatcher is executed in between, e.g.
+            wallbox.atomic(lambda box: box.set_remote_lock(not box.get_remote_lock()[0]))
+        """
+        return self._dispatcher.call(function, self._wallbox, *args, priority=priority, timeout=timeout)
+
+    def __getattr__(self, name):
+        if name == 'control_tick':
+            raise AttributeError('control_tick() is only available inside of atomic()')
+        # a property may use the shadow state or the bus
+        attribute = self._dispatcher.call(getattr, self._wallbox, name)
+        if not callable(attribute):
+            return attribute
+        priority = self._priority(name)
+
+        def call(*args, **kwargs):
+            return self._dispatcher.call(attribute, *args, priority=priority, **kwargs)
+        call.__name__ = name
+        call.__doc__ = attribute.__doc__
+        return call
@@ -0,0 +1,412 @@
+"""Modbus gateway which shares one RS-485 bus with many local clients
+
+Usage:
+    python -m hd_energy_control.gateway --port /dev/ttyAMA0 --units 1,2 --tcp 127.0.0.1:5502 --http 127.0.0.1:8080
+
+The gateway is the only master of the serial bus. Local clients (EMS,
+dashboard, billing) use Modbus TCP with the unit ids of the wallboxes or
+the HTTP/JSON API:
+    GET  /units/1?names=power,currents_rms     values (default the measurement registers)
+    POST /units/1  {"maximal_current_command": 16.0}
+    GET  /stats                                 counters of the gateway
+
+Identical concurrent reads are merged into one bus transaction, reads are
+answered from a short-lived cache and writes are executed before reads.
+Failed bus transactions are answered with the Modbus exception 0x0B
+(gateway target device failed to respond).
+"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import asyncio
+import json
+import signal
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from pymodbus import FramerType, ExceptionResponse
+from pymodbus.datastore import ModbusBaseSlaveContext, ModbusServerContext
+from pymodbus.server import ModbusTcpServer
+
+from .bus import ModbusRTUBus
+from .constants import HDEnergyControlConstants as CONSTS
+from .dispatcher import READ_PRIORITY, WRITE_PRIORITY, RequestDispatcher
+from .read_cache import RegisterCache
+from .register_map import MEASUREMENT_PLAN, compile_read_plan
+
+
+class ModbusGateway:
+    """Serialized, coalescing access to the units of one ModbusRTUBus
+
+    read() and write() may be called from every thread and return a
+    concurrent.futures.Future, only the RequestDispatcher of the gateway
+    uses the bus. The jobs are executed in the order of their priority (writes
+    first), jobs of the same priority in the order of submission.
+
+    A read (unit, function code, address, count) is answered from the cache
+    if all registers are fresh, otherwise it joins an identical queued or
+    running read, so concurrent clients cause one bus transaction only.
+    Written registers are stored in the cache (write-through).
+    """
+    def __init__(self, bus, unit_ids = (1,), cache_ttl = 0.5, dispatcher = None):
+        """Constructor of ModbusGateway
+        -----
+        Args:
+            bus: ModbusRTUBus which owns the serial port
+            unit_ids (tuple): unit ids of the wallboxes served by the gateway
+            cache_ttl (float): freshness in s of the cached registers, the
+                               TTLs of CONSTS.CACHE_TTL are kept, 0 disables the cache
+            dispatcher: RequestDispatcher shared with other users of the bus or None
+        """
+        self._bus = bus
+        self._caches = {}
+        for unit_id in unit_ids:
+            bus.unit(unit_id)
+            self._caches[unit_id] = RegisterCache(default_ttl=cache_ttl) if cache_ttl \
+                else RegisterCache(ttl={})
+        self._dispatcher = dispatcher if dispatcher is not None else RequestDispatcher('ModbusGateway')
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.bus_reads = 0
+        self.bus_writes = 0
+        self.errors = 0
+
+    @property
+    def unit_ids(self) -> tuple:
+        """Unit ids served by the gateway
+        """
+        return tuple(self._caches)
+
+    def read(self, unit_id, function_code, address, count, priority = READ_PRIORITY) -> Future:
+        """Read raw registers with function code 0x03 or 0x04
+
+        Returns a Future of the register list or False on error
+        """
+        if unit_id not in self._caches:
+            raise ValueError(f'unit {unit_id} is not served by the gateway')
+        with self._lock:
+            self.requests += 1
+            registers, first, _ = self._caches[unit_id].lookup(function_code, address, count)
+            if first is None:
+                self.cache_hits += 1
+                future = Future()
+                future.set_result(registers)
+                return future
+            key = (unit_id, function_code, address, count)
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future
+            # placeholder, the job removes the key (with the lock) before it is done
+            future = self._inflight[key] = Future()
+        # submitted without the lock, a call from the dispatcher thread is executed at once
+        try:
+            job = self._dispatcher.submit(self._execute_read, key, priority=priority)
+        except Exception as exc:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(exc)
+            raise
+        job.add_done_callback(lambda done: self._chain(done, future))
+        return future
+
+    @staticmethod
+    def _chain(done, future) -> None:
+        """Copy the result of the done job into the placeholder future
+        """
+        if done.cancelled():
+            future.cancel()
+        elif done.exception() is not None:
+            future.set_exception(done.exception())
+        else:
+            future.set_result(done.result())
+
+    def write(self, unit_id, address, values, priority = WRITE_PRIORITY) -> Future:
+        """Write raw holding registers starting at address
+
+        Values already set according to the shadow state of the unit are
+        not written again. Returns a Future of True or False on error.
+        """
+        if unit_id not in self._caches:
+            raise ValueError(f'unit {unit_id} is not served by the gateway')
+        with self._lock:
+            self.requests += 1
+        return self._dispatcher.submit(self._execute_write, unit_id, address, list(values), priority=priority)
+
+    def read_registers(self, unit_id, names = None, timeout = None):
+        """Read register values by name, see HDEnergyControl.get_registers
+
+        Returns dict name -> value or False on error
+        """
+        plan = MEASUREMENT_PLAN if names is None else compile_read_plan(tuple(sorted(names)))
+        futures = [self.read(unit_id, block.function_code, block.address, block.length) for block in plan]
+        raw_blocks = [future.result(timeout) for future in futures]
+        if any(registers is False for registers in raw_blocks):
+            return False
+        return plan.decode(raw_blocks)
+
+    def write_registers(self, unit_id, values, timeout = None) -> bool:
+        """Write holding register values by name, e.g. {'maximal_current_command': 16.0}
+        """
+        futures = []
+        for name, value in values.items():
+            definition = CONSTS.REGISTERS[name]
+            if definition.function_code != 0x03 or definition.datatype != 'U16' or definition.count != 1:
+                raise ValueError(f'{name} is not a writable register')
+            futures.append(self.write(unit_id, definition.address, [round(value / definition.scale)]))
+        return all([future.result(timeout) for future in futures])
+
+    def _execute_read(self, key):
+        unit_id, function_code, address, count = key
+        unit = self._bus.unit(unit_id)
+        try:
+            if function_code == 0x04:
+                registers = unit.read_input_register_block(address, count)
+            else:
+                registers = unit.read_holding_register_block(address, count)
+        except Exception as exc:
+            registers = False
+            print(f"ERROR: gateway read of unit {unit_id} failed ({exc!r})")
+        with self._lock:
+            self._inflight.pop(key, None)
+            self.bus_reads += 1
+            if registers is False:
+                self.errors += 1
+            else:
+                registers = list(registers)
+                self._caches[unit_id].store(function_code, address, registers)
+        return registers
+
+    def _execute_write(self, unit_id, address, values) -> bool:
+        unit = self._bus.unit(unit_id)
+        try:
+            # unchanged values are dropped, adjacent registers merged,
+            # registers unknown to the shadow are written at once
+            result = True
+            with unit.control_tick():
+                for offset, value in enumerate(values):
+                    result = unit.write_register(address + offset, value) and result
+            result = result and unit.flush_result
+        except Exception as exc:
+            result = False
+            print(f"ERROR: gateway write of unit {unit_id} failed ({exc!r})")
+        with self._lock:
+            self.bus_writes += 1
+            if result:
+                self._caches[unit_id].store(0x03, address, values)
+            else:
+                self.errors += 1
+                self._caches[unit_id].invalidate(0x03, address, len(values))
+        return bool(result)
+
+    def start(self) -> None:
+        """Start the dispatcher which uses the bus
+        """
+        self._dispatcher.start()
+
+    def stop(self) -> None:
+        """Execute the queued jobs and stop the dispatcher
+        """
+        self._dispatcher.stop()
+
+    def stats(self) -> dict:
+        """Counters of the gateway, bus_reads + bus_writes are the bus transactions
+        """
+        with self._lock:
+            return {'requests': self.requests, 'cache_hits': self.cache_hits, \
+                    'coalesced': self.coalesced, 'bus_reads': self.bus_reads, \
+                    'bus_writes': self.bus_writes, 'errors': self.errors, 'queued': self._dispatcher.queued}
+
+
+class GatewayUnitContext(ModbusBaseSlaveContext):
+    """pymodbus datastore of one unit which forwards to the ModbusGateway
+    """
+    def __init__(self, gateway, unit_id):
+        self._gateway = gateway
+        self._unit_id = unit_id
+
+    def reset(self):
+        pass
+
+    async def async_getValues(self, fc_as_hex, address, count = 1):
+        if fc_as_hex == 4:
+            function_code = 0x04
+        elif fc_as_hex in (3, 6, 16, 23):
+            # the response of a write reads the written register back (cache hit)
+            function_code = 0x03
+        else:
+            return ExceptionResponse.ILLEGAL_FUNCTION
+        registers = await asyncio.wrap_future(self._gateway.read(self._unit_id, function_code, address, count))
+        if registers is False:
+            return ExceptionResponse.GATEWAY_NO_RESPONSE
+        return registers
+
+    async def async_setValues(self, fc_as_hex, address, values):
+        if fc_as_hex not in (6, 16, 23):
+            return ExceptionResponse.ILLEGAL_FUNCTION
+        if not await asyncio.wrap_future(self._gateway.write(self._unit_id, address, values)):
+            return ExceptionResponse.GATEWAY_NO_RESPONSE
+        return None
+
+
+class ModbusTCPServerThread(threading.Thread):
+    """Modbus TCP server of a ModbusGateway in a background thread
+    """
+    def __init__(self, gateway, address = ('127.0.0.1', 502)):
+        """Constructor of ModbusTCPServerThread
+        -----
+        Args:
+            gateway: ModbusGateway
+            address (tuple): (host, port), port 0 = free port
+        """
+        super().__init__(name='hd_energy_control.gateway', daemon=True)
+        self.context = ModbusServerContext(slaves={unit_id: GatewayUnitContext(gateway, unit_id) \
+                                                   for unit_id in gateway.unit_ids}, single=False)
+        self.address = address
+        self._loop = None
+        self._server = None
+        self._ready = threading.Event()
+
+    def run(self):
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._ready.set()
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._server = ModbusTcpServer(self.context, framer=FramerType.SOCKET, address=self.address)
+        await self._server.serve_forever(background=True)
+        self.address = self._server.transport.sockets[0].getsockname()[:2]
+        self._ready.set()
+        await self._server.serving
+
+    def start(self):
+        super().start()
+        self._ready.wait()
+        if self._server is None or self._server.transport is None:
+            raise RuntimeError(f'gateway could not listen on {self.address}')
+
+    def stop(self):
+        """Stop the server and wait for the thread
+        """
+        if self._loop is not None and self.is_alive():
+            asyncio.run_coroutine_threadsafe(self._server.shutdown(), self._loop).result()
+            self.join()
+
+
+def serve_http(gateway, address = ('127.0.0.1', 8080), timeout = 10.0) -> ThreadingHTTPServer:
+    """Serve the HTTP/JSON API of the gateway in a background thread
+
+    Returns the server, stop it with shutdown()
+    """
+    class _Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, content):
+            body = json.dumps(content, default=list).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _unit_id(self, path):
+            parts = path.strip('/').split('/')
+            if len(parts) != 2 or parts[0] != 'units' or not parts[1].isdigit() \
+                    or int(parts[1]) not in gateway.unit_ids:
+                return None
+            return int(parts[1])
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == '/stats':
+                self._reply(200, gateway.stats())
+                return
+            unit_id = self._unit_id(url.path)
+            if unit_id is None:
+                self.send_error(404)
+                return
+            names = parse_qs(url.query).get('names')
+            names = names[0].split(',') if names else None
+            if names is not None and any(name not in CONSTS.REGISTERS for name in names):
+                self.send_error(400, 'unknown register name')
+                return
+            values = gateway.read_registers(unit_id, names, timeout)
+            if values is False:
+                self._reply(504, {'error': 'no response of the unit'})
+            else:
+                self._reply(200, values)
+
+        def do_POST(self):
+            unit_id = self._unit_id(urlsplit(self.path).path)
+            if unit_id is None:
+                self.send_error(404)
+                return
+            try:
+                values = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                result = gateway.write_registers(unit_id, values, timeout)
+            except (ValueError, KeyError, TypeError, AttributeError) as exc:
+                self.send_error(400, str(exc))
+                return
+            self._reply(200 if result else 504, {'written': result})
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(address, _Handler)
+    threading.Thread(target=server.serve_forever, name='gateway-http', daemon=True).start()
+    return server
+
+
+def _address(text) -> tuple:
+    host, port = text.rsplit(':', 1)
+    return host, int(port)
+
+
+def main(argv = None) -> None:
+    """Entry point of python -m hd_energy_control.gateway
+    """
+    parser = argparse.ArgumentParser(description='Modbus gateway for HD Energy Control wallboxes')
+    parser.add_argument('--port', default='/dev/ttyUSB0', help='serial port of the bus')
+    parser.add_argument('--units', default='1', help='comma separated unit ids')
+    parser.add_argument('--baudrate', type=int, default=19200)
+    parser.add_argument('--parity', default='E', choices=('N', 'E', 'O'))
+    parser.add_argument('--stopbits', type=int, default=1, choices=(1, 2))
+    parser.add_argument('--retries', type=int, default=1)
+    parser.add_argument('--tcp', default='127.0.0.1:5502', help='host:port of the Modbus TCP server')
+    parser.add_argument('--http', help='host:port of the HTTP/JSON API, default off')
+    parser.add_argument('--cache-ttl', type=float, default=0.5, help='freshness of cached registers in s')
+    args = parser.parse_args(argv)
+
+    bus = ModbusRTUBus(args.port, args.baudrate, parity=args.parity, stopbits=args.stopbits, \
+                       retries=args.retries)
+    if not bus.connect():
+        raise SystemExit(1)
+    gateway = ModbusGateway(bus, [int(unit_id) for unit_id in args.units.split(',')], args.cache_ttl)
+    gateway.start()
+    tcp_server = ModbusTCPServerThread(gateway, _address(args.tcp))
+    tcp_server.start()
+    print(f"INFO: Modbus TCP on {tcp_server.address[0]}:{tcp_server.address[1]}")
+    http_server = None
+    if args.http:
+        http_server = serve_http(gateway, _address(args.http))
+        print(f"INFO: HTTP API on {args.http}")
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    stop.wait()
+    if http_server is not None:
+        http_server.shutdown()
+    tcp_server.stop()
+    gateway.stop()
+    bus.close()
+
+
+if __name__ == "__main__":
+    main()
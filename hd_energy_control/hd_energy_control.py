@@ -2,9 +2,29 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import time
+from contextlib import contextmanager
+
 from pymodbus.client import ModbusSerialClient as ModBusClient
-from pymodbus import (FramerType, ExceptionResponse, ModbusException)
+from pymodbus import (FramerType, ModbusException)
 from .constants import HDEnergyControlConstants as CONSTS
+from .metrics import OK, EXCEPTION, TIMEOUT, TransactionMetrics, classify
+from .register_map import (REGISTER_PLANS, MEASUREMENT_PLAN, SNAPSHOT_PLAN, HOLDING_PLAN, \
+                           compile_read_plan, decode_registers)
+from .read_cache import RegisterCache
+from .shadow import HoldingRegisterShadow
+from .snapshot import HDEnergyControlSnapshot, describe_charging_state, format_layout_version
+from .unit_health import UnitHealth
+
+
+def create_client(port, baudrate = 19200, bytesize = 8, parity = 'E', stopbits = 1) -> ModBusClient:
+    """pymodbus serial client of the bus
+
+    The retries of pymodbus are disabled and the timeout is set per request,
+    both are handled per unit by ModbusRTU.
+    """
+    return ModBusClient(port=port, framer=FramerType.RTU, baudrate=baudrate, bytesize=bytesize, \
+                        parity=parity, stopbits=stopbits, retries=0)
 
 class ModbusRTU:
     """Base class for ModbusRTU
@@ -13,11 +33,52 @@ class ModbusRTU:
     3.) check Register description --> see specific documentation of manufacturer
         e.g.: https://www.amperfied.de/en/service-support-e/downloads-e/ 
     """
-    def __init__(self, port = "/dev/ttyUSB0", device_unit_id = 1):
-        self._client = ModBusClient(port=port, framer=FramerType.RTU, baudrate = 19200, \
-                                    bytesize = 8, stopbits = 1, parity = 'E')
+    def __init__(self, port = "/dev/ttyUSB0", device_unit_id = 1, client = None, cache = True, \
+                 metrics = None, verbose = True, baudrate = 19200, bytesize = 8, parity = 'E', \
+                 stopbits = 1, retries = 1, health = None):
+        """Constructor of ModbusRTU
+        -----
+        Args:
+            port: serial device of the bus
+            device_unit_id: Modbus unit id of the device
+            client: shared pymodbus client (e.g. of ModbusRTUBus), the port is ignored then
+            cache: True for a RegisterCache with CONSTS.CACHE_TTL, a RegisterCache or False
+            metrics: shared TransactionMetrics (e.g. of ModbusRTUBus) or None for an own one
+            verbose: print connection infos and failed transactions
+            baudrate, bytesize, parity, stopbits: serial parameters, 19200 8E1 by default
+            retries (int): retries of a request without response
+            health: UnitHealth with the timeout settings or None for the defaults
+        """
+        # a shared client is owned (connected and closed) by the bus
+        self._owns_client = client is None
+        if client is None:
+            client = create_client(port, baudrate, bytesize, parity, stopbits)
+        self._client = client
+        self.retries = retries
+        self._health = health if health is not None else UnitHealth(baudrate=client.comm_params.baudrate)
         self._device_unit_id = device_unit_id
-        print("Device Unit: ", self._device_unit_id)
+        if cache is True:
+            cache = RegisterCache()
+        self._cache = cache or None
+        self._shadow = HoldingRegisterShadow()
+        self._tick_depth = 0
+        # a direct write inside of the control tick failed
+        self._tick_failed = False
+        self.flush_result = True
+        # time.monotonic() of the last successful transaction
+        self.last_contact = None
+        # last known watchdog timeout, kept when the shadow value expires
+        self._watchdog_timeout = None
+        self._metrics = metrics if metrics is not None else TransactionMetrics()
+        self.verbose = verbose
+        if verbose:
+            print("Device Unit: ", self._device_unit_id)
+
+    @property
+    def device_unit_id(self) -> int:
+        """Modbus unit id of the device
+        """
+        return self._device_unit_id
 
 
     def __del__(self):
@@ -31,9 +92,13 @@ class ModbusRTU:
     def connect(self):
         """Establish connection of client
         """
+        if not self._owns_client:
+            # the connection of a shared client is handled by its bus
+            return
         try:
             if self._client.connect():
-                print("INFO: client connected successfully to Modbus-RTU Device!", end='\n\n')
+                if self.verbose:
+                    print("INFO: client connected successfully to Modbus-RTU Device!", end='\n\n')
             else:
                 print("ERROR: client cannot connect to Modbus-RTU Device!")
         except Exception as exc:
@@ -46,9 +111,10 @@ class ModbusRTU:
     def close(self):
         """Close connection of client
         """
-        if self._client.is_socket_open():
+        if self._owns_client and self._client.is_socket_open():
             self._client.close()
-            print("INFO: Connection closed!")
+            if self.verbose:
+                print("INFO: Connection closed!")
         return None
 
     def read_input_register(self, register_address, datatype, count = 1):
@@ -56,20 +122,10 @@ class ModbusRTU:
         """
         length = CONSTS.TYPE_TO_LENGTH[datatype] * count
         #print(f'length : {length}')
-        try:
-            result = self._client.read_input_registers(register_address, count=length, \
-                                                     slave=self._device_unit_id)
-            #print(result, type(result))
-        except ModbusException as exc:
-            print(f">>> read_input_register: Received ModbusException({exc}) from library")
-        if result.isError():
-            print(f">>> read_input_register: Received Modbus library error({result})")
-        if isinstance(result, ExceptionResponse):
-            print(f">>> read_input_register: Received Modbus library exception ({result})")
-            # THIS IS NOT A PYTHON EXCEPTION, but a valid modbus message
+        registers = self._read_registers(0x04, register_address, length)
+        if registers is False:
             return False
-        #print(type(result.registers), ": ", result.registers)
-        data = self.decode_register_readings(result, datatype, count)
+        data = decode_registers(registers, datatype, count)
         return data
 
 
@@ -78,62 +134,335 @@ class ModbusRTU:
         """
         length = CONSTS.TYPE_TO_LENGTH[datatype] * count
         #print(f'length : {length}')
-        try:
-            result = self._client.read_holding_registers(register_address, count=length, \
-                                                     slave=self._device_unit_id)
-            #print(result, type(result))
-        except ModbusException as exc:
-            print(f">>> read_holding_register: Received ModbusException({exc}) from library")
-        if result.isError():
-            print(f">>> read_holding_register: Received Modbus library error({result})")
-        if isinstance(result, ExceptionResponse):
-            print(f">>> read_holding_register: Received Modbus library exception ({result})")
-            # THIS IS NOT A PYTHON EXCEPTION, but a valid modbus message
+        registers = self._read_registers(0x03, register_address, length)
+        if registers is False:
             return False
-        #print(type(result.registers), ": ", result.registers)
-        data = self.decode_register_readings(result, datatype, count)
+        data = decode_registers(registers, datatype, count)
         return data
 
+    def read_input_register_block(self, register_address, length):
+        """Read a block of input registers (code 0x04) in one transaction
+
+        Returns the raw 16 bit register values as list or False on error.
+        """
+        return self._read_registers(0x04, register_address, length)
+
+    def read_holding_register_block(self, register_address, length):
+        """Read a block of holding registers (code 0x03) in one transaction
+
+        Returns the raw 16 bit register values as list or False on error.
+        """
+        return self._read_registers(0x03, register_address, length)
+
+    @property
+    def health(self) -> UnitHealth:
+        """Learned timeout, backoff and quarantine of the device
+        """
+        return self._health
+
+    @property
+    def metrics(self) -> TransactionMetrics:
+        """Transaction metrics of the device
+        """
+        return self._metrics
+
+    @property
+    def cache(self) -> RegisterCache:
+        """Read cache of the device, None if disabled
+        """
+        return self._cache
+
+    def _read_registers(self, function_code, register_address, length):
+        """Read `length` raw registers, fresh values are taken from the cache
+
+        Only the range of not fresh registers is read from the bus.
+        Returns the list of registers or False on error
+        """
+        if self._cache is None:
+            result = self._request_registers(function_code, register_address, length)
+            if result is False:
+                return False
+            if function_code == 0x03:
+                self._update_shadow(register_address, result.registers)
+            return result.registers
+        registers, first, last = self._cache.lookup(function_code, register_address, length)
+        if first is None:
+            return registers
+        result = self._request_registers(function_code, first, last - first + 1)
+        if result is False:
+            return False
+        if function_code == 0x03:
+            self._update_shadow(first, result.registers)
+        self._cache.store(function_code, first, result.registers)
+        offset = first - register_address
+        registers[offset:offset + len(result.registers)] = result.registers
+        return registers
+
+    def _request_registers(self, function_code, register_address, length):
+        """Read `length` registers with function code 0x03 or 0x04 with error handling
+        """
+        caller = 'read_input_register' if function_code == 0x04 else 'read_holding_register'
+        read = self._client.read_input_registers if function_code == 0x04 \
+            else self._client.read_holding_registers
+        return self._transaction(caller, function_code, register_address, length, \
+                                 lambda: read(register_address, count=length, slave=self._device_unit_id))
+
+    def _transaction(self, caller, function_code, register_address, count, request):
+        """Execute one request with the learned timeout and retries, record it in the metrics
+
+        A request to a quarantined unit fails at once without using the bus.
+        Without response the shadow state is invalidated, the device may
+        have been power cycled or fallen back to its failsafe values.
+        Returns the pymodbus result or False on error
+        """
+        if not self._health.allow_request():
+            self._shadow.invalidate()
+            if self.verbose:
+                print(f">>> {caller}: unit {self._device_unit_id} is quarantined, request skipped")
+            return False
+        for attempt in range(self.retries + 1):
+            self._client.comm_params.timeout_connect = self._health.timeout(function_code, count)
+            start = time.monotonic()
+            try:
+                result = request()
+            except ModbusException as exc:
+                result = exc
+            duration = time.monotonic() - start
+            outcome, exception_code = classify(result)
+            self._metrics.record(self._device_unit_id, function_code, register_address, count, \
+                                 duration, outcome, exception_code, attempt)
+            if outcome != TIMEOUT:
+                break
+            self._health.record_timeout()
+            if self._health.quarantined:
+                break
+        if outcome in (OK, EXCEPTION):
+            # the device responded
+            self._health.record_response(function_code, count, duration)
+        elif outcome == TIMEOUT:
+            self._shadow.invalidate()
+        if outcome != OK:
+            if self.verbose:
+                if isinstance(result, Exception):
+                    print(f">>> {caller}: Received ModbusException({result}) from library")
+                else:
+                    # THIS IS NOT A PYTHON EXCEPTION, but a valid modbus message
+                    print(f">>> {caller}: Received Modbus library error({result})")
+            return False
+        self.last_contact = start + duration
+        return result
+
     def decode_register_readings(self, readings, datatype, count):
         """Decode the register readings depend on datatype
+
+        Uses the precompiled struct of the datatype, returns a single value
+        for count == 1 otherwise a list
         """
-        data = []
-        if datatype == 'U16':
-            data = self._client.convert_from_registers(readings.registers, data_type=self._client.DATATYPE.UINT16)
-        elif datatype == 'U32':
-            data = self._client.convert_from_registers(readings.registers, data_type=self._client.DATATYPE.UINT32)
-        elif datatype == 'U64':
-            data = self._client.convert_from_registers(readings.registers, data_type=self._client.DATATYPE.UINT64)
-        elif datatype == 'S16':
-            data = self._client.convert_from_registers(readings.registers, data_type=self._client.DATATYPE.INT16)
-        elif datatype == 'S32':
-            data = self._client.convert_from_registers(readings.registers, data_type=self._client.DATATYPE.INT32)
-        return data
+        return decode_registers(readings.registers, datatype, count)
+
+    def read_plan(self, plan):
+        """Execute a precompiled ReadPlan
+
+        Returns the list of raw register blocks or False on error
+        """
+        raw_blocks = []
+        for block in plan:
+            registers = self._read_registers(block.function_code, block.address, block.length)
+            if registers is False:
+                return False
+            raw_blocks.append(registers)
+        return raw_blocks
 
     def write_register(self, register_address, value):
-        """Write register method (code 0x06) with error handling
+        """Write register method (code 0x10) with error handling
+
+        A value which is already set according to the shadow state is not
+        written again. Inside of control_tick() the write is staged and
+        sent by flush_writes().
         """
-        try:
-            register_values = self._client.convert_to_registers(value, data_type=self._client.DATATYPE.UINT16)
-            #print(register_values)
-            result = self._client.write_registers(register_address, values=register_values, \
-                                                     slave=self._device_unit_id)
-            #print(result, type(result))
-        except ModbusException as exc:
-            print(f">>> write_register: Received ModbusException({exc}) from library")
-        if result.isError():
-            print(f">>> write_register: Received Modbus library error({result})")
-        if isinstance(result, ExceptionResponse):
-            print(f">>> write_register: Received Modbus library exception ({result})")
-            # THIS IS NOT A PYTHON EXCEPTION, but a valid modbus message
+        if self._tick_depth:
+            if register_address in self._shadow:
+                self._shadow.stage(register_address, value)
+                return True
+        elif self._shadow.is_unchanged(register_address, value):
+            return True
+        result = self._write_registers(register_address, [value])
+        if result is False and self._tick_depth:
+            self._tick_failed = True
+        return result
+
+    def _write_registers(self, register_address, values):
+        """Write consecutive registers in one request (code 0x10) with error handling
+        """
+        register_values = []
+        for value in values:
+            register_values += self._client.convert_to_registers(value, data_type=self._client.DATATYPE.UINT16)
+        result = self._transaction('write_register', 0x10, register_address, len(register_values), \
+                                   lambda: self._client.write_registers(register_address, values=register_values, \
+                                                                        slave=self._device_unit_id))
+        if result is False:
             return False
+        self._shadow.update_from_write(register_address, register_values)
+        if self._cache is not None:
+            # a written register is read from the device again
+            self._cache.invalidate(0x03, register_address, len(register_values))
         return True
 
+    @contextmanager
+    def control_tick(self):
+        """Collect the writes of one control tick
+
+        All writes inside the with block are staged, writes of unchanged
+        values are dropped and adjacent registers are merged into one
+        request when the block is left.
+        """
+        self._tick_depth += 1
+        try:
+            yield self
+        finally:
+            self._tick_depth -= 1
+            if not self._tick_depth:
+                self.flush_writes()
+
+    def flush_writes(self) -> bool:
+        """Write the staged writes, one request per run of adjacent registers
+
+        Returns True if all writes were successful, including the direct
+        writes (registers unknown to the shadow) of the control tick
+        """
+        result = not self._tick_failed
+        self._tick_failed = False
+        for register_address, values in self._shadow.take_pending():
+            result = self._write_registers(register_address, values) and result
+        self.flush_result = result
+        return result
+
+    def refresh_watchdog(self) -> bool:
+        """Cheapest transaction to reset the Modbus watchdog of the device
+
+        Reads the single register 5 (charging state) directly from the bus,
+        the read cache is bypassed.
+        """
+        return self._request_registers(0x04, CONSTS.REGISTERS['charging_state'].address, 1) is not False
+
+    def keep_watchdog_alive(self, margin = 0.5) -> bool:
+        """Refresh the watchdog only if it is needed
+
+        The device is refreshed if no transaction was successful within
+        (1 - margin) * watchdog timeout. The timeout (register 257) is taken
+        from the shadow state (the last known value when it expired), a
+        timeout of 0 disables the watchdog.
+        -----
+        Args:
+            margin (float): safety margin as part of the timeout
+
+        Returns:
+            True if the device is alive (refreshed or recently contacted)
+        """
+        timeout_ms = self._shadow.get(CONSTS.REGISTERS['watchdog_timeout'].address)
+        if timeout_ms is not None:
+            self._watchdog_timeout = timeout_ms
+        timeout_ms = self._watchdog_timeout
+        if timeout_ms is None:
+            # reading the timeout also refreshes the watchdog
+            return self.get_watchdog_timeout() is not False
+        if timeout_ms == 0:
+            return True
+        if self.last_contact is not None and \
+                time.monotonic() - self.last_contact < timeout_ms / 1000 * (1 - margin):
+            return True
+        return self.refresh_watchdog()
+
+    @property
+    def shadow(self) -> HoldingRegisterShadow:
+        """Shadow state of the holding registers
+        """
+        return self._shadow
+
+    def verify_shadow(self) -> list:
+        """Read the holding registers 257...262 in one request and compare with the shadow
+
+        Returns the list of (address, shadow value, device value) which drifted
+        or False on error
+        """
+        result = self._request_registers(0x03, HOLDING_PLAN[0].address, HOLDING_PLAN[0].length)
+        if result is False:
+            return False
+        if self._cache is not None:
+            self._cache.store(0x03, HOLDING_PLAN[0].address, result.registers)
+        return self._update_shadow(HOLDING_PLAN[0].address, result.registers)
+
+    def _update_shadow(self, register_address, registers) -> list:
+        """Update the shadow from holding registers read from the device
+        """
+        drift = self._shadow.update_from_read(register_address, registers)
+        if self.verbose:
+            for address, known, value in drift:
+                print(f"WARNING: holding register {address} changed on the device: {known} -> {value}")
+        return drift
+
 
 
 class HDEnergyControl(ModbusRTU):
     """class for connecting the Wallbox Heidelberg Energy Control
     """
+    def get_snapshot(self, include_config = True):
+        """Get a snapshot of all input registers
+
+        Read the input registers with block reads instead of one
+        transaction per getter:
+        register 4...18 in one request and, if include_config is set,
+        register 100...101 and 203 in one request each.
+        -----
+        Args:
+            include_config (bool): read also hw config and sw revision
+
+        Returns:
+            HDEnergyControlSnapshot or False if a block read failed
+        -----
+        Register address: 4...18, 100...101, 203; U16 / U32
+        Function-Code: 0x04
+        """
+        plan = SNAPSHOT_PLAN if include_config else MEASUREMENT_PLAN
+        values = self.get_registers(plan=plan)
+        if values is False:
+            return False
+        return HDEnergyControlSnapshot.from_values(values)
+
+    def get_register(self, name):
+        """Get one value of the register map
+
+        Read and decode the register `name` of CONSTS.REGISTERS,
+        the value is scaled to the unit of the register definition.
+        -----
+        Args:
+            name (str): register name, e.g. 'power'
+
+        Returns:
+            value, tuple of values (count > 1) or False on error
+        """
+        values = self.get_registers(plan=REGISTER_PLANS[name])
+        if values is False:
+            return False
+        return values[name]
+
+    def get_registers(self, *names, plan = None) -> dict:
+        """Get several values of the register map with minimal block reads
+        -----
+        Args:
+            names (str): register names of CONSTS.REGISTERS
+            plan (ReadPlan): precompiled plan used instead of names
+
+        Returns:
+            dict name -> value or False on error
+        """
+        if plan is None:
+            plan = compile_read_plan(tuple(sorted(names)))
+        raw_blocks = self.read_plan(plan)
+        if raw_blocks is False:
+            return False
+        return plan.decode(raw_blocks)
+
     def get_register_layout_version(self) -> str:
         """Get register layout version
         
@@ -145,10 +474,10 @@ class HDEnergyControl(ModbusRTU):
         Register address: 4; U16
         Function-Code: 0x04
         """
-        version_dec = self.read_input_register(4, 'U16')
-        #print(type(result.registers), ": ", result.registers)
-        version_hex = f"{version_dec:0x}"
-        version_str = f"v{'.'.join(f'{char}' for char in version_hex)}"
+        version_dec = self.get_register('register_layout_version')
+        if version_dec is False:
+            return False
+        version_str = format_layout_version(version_dec)
         #print(f'[004]\t\tRegister-Layout : {version_str}', end='\n\n')
         return version_str
 
@@ -164,8 +493,10 @@ class HDEnergyControl(ModbusRTU):
         Function-Code:      0x04
         Unit: 1
         """
-        value = self.read_input_register(5, 'U16')
-        charge_state = (CONSTS.STATE[value], CONSTS.CAR[value], CONSTS.WALLBOX[value])
+        value = self.get_register('charging_state')
+        if value is False:
+            return False
+        charge_state = describe_charging_state(value)
         #print('[005]\t\tCharge-State : {}'.format(' '.join(charge_state)), end='\n\n')
         return charge_state
 
@@ -181,8 +512,7 @@ class HDEnergyControl(ModbusRTU):
         Function-Code: 0x04
         Unit: A
         """
-        current_list = self.read_input_register(6, 'U16', 3)
-        i = tuple(i/10 for i in current_list)
+        i = self.get_register('currents_rms')
         #print(f'[006]\t\tL1 Current (rms) : {i[0]:.2f} A')
         #print(f'[007]\t\tL2 Current (rms) : {i[1]:.2f} A')
         #print(f'[008]\t\tL3 Current (rms) : {i[2]:.2f} A', end='\n\n')
@@ -200,8 +530,7 @@ class HDEnergyControl(ModbusRTU):
         Function-Code: 0x04
         Unit: °C
         """
-        data = self.read_input_register(9, 'S16')
-        temperature = data/10
+        temperature = self.get_register('pcb_temperature')
         #print(f'[009]\t\tPCB temperature : {temperature:6.2f} °C', end='\n\n')
         return temperature
 
@@ -217,8 +546,7 @@ class HDEnergyControl(ModbusRTU):
         Function-Code: 0x04
         Unit: V
         """
-        voltage_list = self.read_input_register(10, 'U16', 3)
-        u = tuple(voltage_list)
+        u = self.get_register('voltages_rms')
         #print(f'[010]\t\tL1 Voltage (rms) : {u[0]:.1f} V')
         #print(f'[011]\t\tL2 Voltage (rms) : {u[1]:.1f} V')
         #print(f'[012]\t\tL3 Voltage (rms) : {u[2]:.1f} V', end='\n\n')
@@ -238,10 +566,11 @@ class HDEnergyControl(ModbusRTU):
         Function-Code:      0x04
         Unit: 1
         """
-        lock = {0: 'System locked', 1: 'System unlocked'}
-        lock_state = self.read_input_register(13, 'U16')
-        #print(f'[013]\t\tExtern Lock State : {lock[lock_state]}', end='\n\n')
-        return (lock_state, lock[lock_state])
+        lock_state = self.get_register('extern_lock_state')
+        if lock_state is False:
+            return False
+        #print(f'[013]\t\tExtern Lock State : {CONSTS.EXTERN_LOCK[lock_state]}', end='\n\n')
+        return (lock_state, CONSTS.EXTERN_LOCK[lock_state])
 
     def get_power(self) -> int:
         """Get the power (sum of all phases)
@@ -255,7 +584,7 @@ class HDEnergyControl(ModbusRTU):
         Function-Code: 0x04
         Unit; VA
         """
-        power = self.read_input_register(14, 'U16')
+        power = self.get_register('power')
         #print(f'[014]\t\tPower : {power} VA', end='\n\n')
         return power
 
@@ -278,10 +607,7 @@ class HDEnergyControl(ModbusRTU):
 
         result = (65536 + 1000) = 66536 VAh
         """
-        data = self.read_input_register(15, 'U16', 2)
-        energy_high_byte = data[0]
-        energy_low_byte = data[1]
-        energy = energy_high_byte * pow(2, 16) + energy_low_byte
+        energy = self.get_register('energy_since_power_on')
         #print(f'[015-016]\tEnergy since PowerOn : {energy} VAh', end='\n\n')
         return energy
 
@@ -305,10 +631,7 @@ class HDEnergyControl(ModbusRTU):
 
         result = (327680 + 10) = 327690 VAh
         """
-        data = self.read_input_register(17, 'U16', 2)
-        energy_high_byte = data[0]
-        energy_low_byte = data[1]
-        energy = energy_high_byte * pow(2, 16) + energy_low_byte
+        energy = self.get_register('energy_since_installation')
         #print(f'[017-018]\tEnergy since Installation : {energy} VAh', end='\n\n')
         return energy
 
@@ -324,7 +647,7 @@ class HDEnergyControl(ModbusRTU):
         Function-Code: 0x04
         Unit: A
         """
-        hw_max_current = self.read_input_register(100, 'U16')
+        hw_max_current = self.get_register('hw_config_max_current')
         #print(f'[100]\t\tHardware config max current : {hw_max_current} A', end='\n\n')
         return hw_max_current
 
@@ -340,7 +663,7 @@ class HDEnergyControl(ModbusRTU):
         Function-Code: 0x04
         Unit: A
         """
-        hw_min_current = self.read_input_register(101, 'U16')
+        hw_min_current = self.get_register('hw_config_min_current')
         #print(f'[101]\t\tHardware config min current : {hw_min_current} A', end='\n\n')
         return hw_min_current
 
@@ -353,7 +676,7 @@ class HDEnergyControl(ModbusRTU):
         Function-Code: 0x04
         Unit: -
         """
-        revision_svn = self.read_input_register(203, 'U16')
+        revision_svn = self.get_register('application_software_revision')
         #print(f'[203]\t\tAppl-SW Revision : {revision_svn}', end='\n\n')
         return revision_svn
 
@@ -364,7 +687,7 @@ class HDEnergyControl(ModbusRTU):
         Function-Code: 0x03
         Unit: ms
         """
-        wdt_timeout = self.read_holding_register(257, 'U16')
+        wdt_timeout = self.get_register('watchdog_timeout')
         #print(f'[257]\t\tWatchDog Timeout : {wdt_timeout} ms', end='\n\n')
         return wdt_timeout
 
@@ -383,7 +706,7 @@ class HDEnergyControl(ModbusRTU):
         Function-Code: 0x06
         Unit: ms
         """
-        result = self.write_register(257, timeout_ms)
+        result = self.write_register(CONSTS.REGISTERS['watchdog_timeout'].address, timeout_ms)
         #print(f'[257]\t\tWatchDog Timeout set to : {result} ms', end='\n\n')
         return result
 
@@ -394,7 +717,9 @@ class HDEnergyControl(ModbusRTU):
         Function-Code: 0x03
         Unit: -
         """
-        standby = self.read_holding_register(258, 'U16')
+        standby = self.get_register('standby_function_control')
+        if standby is False:
+            return False
         #print(f'[258]\t\tStandBy Function : {CONSTS.STANDBY_FUNCTION[standby]}', end='\n\n')
         return (standby, CONSTS.STANDBY_FUNCTION[standby])
 
@@ -426,7 +751,7 @@ class HDEnergyControl(ModbusRTU):
             # no valid value reached
             print ('ERROR: No valid value for setting the StandBy Function Control')
             return False
-        result = self.write_register(258, _state)
+        result = self.write_register(CONSTS.REGISTERS['standby_function_control'].address, _state)
         #print(f'[258]\t\tStandBy Function set to : {CONSTS.STANDBY_FUNCTION[self.get_standby_function_control()]} ', end='\n\n')
         return result
 
@@ -441,7 +766,9 @@ class HDEnergyControl(ModbusRTU):
         Function-Code: 0x03
         Unit: -
         """
-        result = self.read_holding_register(259, 'U16')
+        result = self.get_register('remote_lock')
+        if result is False:
+            return False
         #print(f'[259]\t\tRemote-Lock state : {CONSTS.REMOTE_LOCK[result]}', end='\n\n')
         return (result, CONSTS.REMOTE_LOCK[result])
 
@@ -468,7 +795,7 @@ class HDEnergyControl(ModbusRTU):
             # no valid value reached
             print ('ERROR: No valid value for setting the Remote Lock')
             return False
-        result = self.write_register(259, _state)
+        result = self.write_register(CONSTS.REGISTERS['remote_lock'].address, _state)
         #print(f'[259]\t\tRemote-Lock set : {CONSTS.REMOTE_LOCK[self.get_remote_lock()]}', end='\n\n')
         return result
 
@@ -481,8 +808,7 @@ class HDEnergyControl(ModbusRTU):
         Function-Code: 0x03
         Unit: A
         """
-        data = self.read_holding_register(261, 'U16')
-        max_current = data/10
+        max_current = self.get_register('maximal_current_command')
         #print(f'[261]\t\tMaximal Charging Current : {max_current:.2f} A', end='\n\n')
         return max_current
 
@@ -512,13 +838,18 @@ class HDEnergyControl(ModbusRTU):
             print (f'Input ({max_current}) is bound to 0 A, due to HW restriction < 6.0 A')
         _max_current = int(max_current * 10)
 
-        # first read the actual regisster value if it is already the same => no need to write again
-        actual_current = self.get_maximal_current_command()
-        if actual_current == max_current:
+        # the actual register value is taken from the shadow state,
+        # it is read only once if the shadow does not know it yet
+        address = CONSTS.REGISTERS['maximal_current_command'].address
+        actual_value = self._shadow.get(address)
+        if actual_value is None:
+            self.get_maximal_current_command()
+            actual_value = self._shadow.get(address)
+        if actual_value == _max_current:
             print(f'[set_maximal_current_command]: value not written, {max_current} A is already set!', end='\n\n')
             return False
         else:
-            result = self.write_register(261, _max_current)
+            result = self.write_register(address, _max_current)
             #print(f'[261]\t\tMax Charging Current set to : {self.get_maximal_current_command()} A', end='\n\n')
             return result
 
@@ -530,8 +861,7 @@ class HDEnergyControl(ModbusRTU):
         Function-Code: 0x03
         Unit: A
         """
-        data = self.read_holding_register(262, 'U16')
-        fs_current = data/10
+        fs_current = self.get_register('failsafe_current_config')
         #print(f'[262]\t\tFailSafe Current : {fs_current:.2f} A', end='\n\n')
         return fs_current
 
@@ -556,6 +886,6 @@ class HDEnergyControl(ModbusRTU):
         elif fs_current < 6.0:
             print (f'Input ({fs_current}) is bound to 0 A, due to HW restriction < 6.0 A')
         _fs_current = int(fs_current * 10)
-        result = self.write_register(262, _fs_current)
+        result = self.write_register(CONSTS.REGISTERS['failsafe_current_config'].address, _fs_current)
         #print(f'[262]\t\tFailSafe Current set to : {self.get_failsafe_current_config()}', end='\n\n')
         return result
@@ -0,0 +1,235 @@
+"""Module providing a columnar in-memory history of HD Energy Control readings"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+import time
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    # the queries fall back to python loops over the array columns
+    numpy = None
+
+
+def _numpy_type(typecode) -> str:
+    """NumPy dtype of an array typecode with the same item size
+
+    The size of 'i', 'l' ... depends on the platform, e.g. 'l' is 8 bytes on Linux x86-64
+    """
+    bits = array(typecode).itemsize * 8
+    if typecode in 'fd':
+        return f'float{bits}'
+    return f'uint{bits}' if typecode.isupper() else f'int{bits}'
+
+
+class HistoryBuffer:
+    """Fixed capacity ring buffer of readings with one typed column per value
+
+    Each value is stored in a preallocated column (NumPy array if NumPy
+    is installed, array.array otherwise), timestamps as int64 milliseconds.
+    Tuples like currents_rms are stored per phase as currents_rms_1 ...
+    currents_rms_3. Appending is O(1) without allocation, when the buffer
+    is full the oldest reading is overwritten. 1 Hz readings of the default
+    fields need 40 bytes per second, 24 h about 3.5 MB.
+
+    The queries select a time window by binary search and work on the
+    column slices: mean, percentile, minimum, maximum and the energy
+    integration of the power.
+    """
+    # field name -> (typecode, number of values)
+    DEFAULT_FIELDS = {
+        'charging_state': ('B', 1),
+        'currents_rms': ('f', 3),
+        'voltages_rms': ('H', 3),
+        'power': ('I', 1),
+        'pcb_temperature': ('f', 1),
+        'energy_since_installation': ('I', 1),
+    }
+
+    def __init__(self, capacity = 86400, fields = None, use_numpy = True):
+        """Constructor of HistoryBuffer
+        -----
+        Args:
+            capacity (int): number of readings
+            fields (dict): field name -> (array typecode, number of values), default DEFAULT_FIELDS
+            use_numpy (bool): use NumPy columns if NumPy is installed
+        """
+        self._capacity = capacity
+        self._numpy = numpy if use_numpy else None
+        self._fields = []
+        self._columns = {}
+        for name, (typecode, count) in dict(self.DEFAULT_FIELDS if fields is None else fields).items():
+            names = [name] if count == 1 else [f'{name}_{index + 1}' for index in range(count)]
+            for index, column in enumerate(names):
+                self._fields.append((name, None if count == 1 else index, column))
+                self._columns[column] = self._allocate(typecode)
+        self._timestamps = self._allocate('q')
+        self._position = 0
+        self._size = 0
+
+    def _allocate(self, typecode):
+        if self._numpy is not None:
+            return self._numpy.zeros(self._capacity, dtype=_numpy_type(typecode))
+        return array(typecode, [0]) * self._capacity
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def capacity(self) -> int:
+        """Maximal number of readings
+        """
+        return self._capacity
+
+    @property
+    def columns(self) -> tuple:
+        """Names of the value columns
+        """
+        return tuple(self._columns)
+
+    def append(self, values, timestamp = None) -> None:
+        """Append one reading, missing values are stored as 0
+        -----
+        Args:
+            values (dict): field name -> value, e.g. of get_registers()
+            timestamp (float): time.time() of the reading, not older than the last one
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        position = self._position
+        self._timestamps[position] = int(timestamp * 1000)
+        for name, index, column in self._fields:
+            value = values.get(name)
+            if index is not None and value:
+                value = value[index]
+            self._columns[column][position] = value or 0
+        self._position = (position + 1) % self._capacity
+        if self._size < self._capacity:
+            self._size += 1
+
+    def append_snapshot(self, snapshot) -> None:
+        """Append a HDEnergyControlSnapshot, see append()
+        """
+        values = vars(snapshot)
+        if isinstance(snapshot.charging_state, tuple):
+            # the raw value of the charging state is stored
+            values = dict(values, charging_state=self._state_value(snapshot.charging_state[0]))
+        self.append(values, snapshot.timestamp)
+
+    @staticmethod
+    def _state_value(state):
+        from .constants import HDEnergyControlConstants as CONSTS
+        return next((value for value, name in CONSTS.STATE.items() if name == state), 0)
+
+    def _physical(self, index) -> int:
+        """Position in the columns of the index-th oldest reading
+        """
+        start = self._position if self._size == self._capacity else 0
+        return (start + index) % self._capacity
+
+    def _bisect(self, timestamp_ms) -> int:
+        """Index of the oldest reading not older than timestamp_ms
+        """
+        low, high = 0, self._size
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamps[self._physical(middle)] < timestamp_ms:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _slice(self, column, first, last):
+        """Readings first...last - 1 (age order) of a column as one array
+        """
+        if first >= last:
+            return column[0:0]
+        start = self._physical(first)
+        end = start + last - first
+        if end <= self._capacity:
+            return column[start:end]
+        if self._numpy is not None:
+            return self._numpy.concatenate((column[start:], column[:end - self._capacity]))
+        return column[start:] + column[:end - self._capacity]
+
+    def _window(self, start, end) -> tuple:
+        first = 0 if start is None else self._bisect(int(start * 1000))
+        last = self._size if end is None else self._bisect(int(end * 1000))
+        return first, last
+
+    def column(self, name, start = None, end = None):
+        """Values of one column in the time window start <= t < end (time.time())
+        """
+        return self._slice(self._columns[name], *self._window(start, end))
+
+    def timestamps(self, start = None, end = None):
+        """Timestamps in ms of the time window start <= t < end
+        """
+        return self._slice(self._timestamps, *self._window(start, end))
+
+    def mean(self, name, start = None, end = None) -> float:
+        """Mean of a column in the time window, nan without readings
+        """
+        values = self.column(name, start, end)
+        if not len(values):
+            return math.nan
+        if self._numpy is not None:
+            return float(values.mean(dtype='float64'))
+        return math.fsum(values) / len(values)
+
+    def minimum(self, name, start = None, end = None):
+        """Minimum of a column in the time window, nan without readings
+        """
+        values = self.column(name, start, end)
+        return values.min().item() if self._numpy is not None and len(values) \
+            else min(values, default=math.nan)
+
+    def maximum(self, name, start = None, end = None):
+        """Maximum of a column in the time window, nan without readings
+        """
+        values = self.column(name, start, end)
+        return values.max().item() if self._numpy is not None and len(values) \
+            else max(values, default=math.nan)
+
+    def percentile(self, name, percent, start = None, end = None) -> float:
+        """Percentile (0...100) of a column in the time window with linear interpolation
+        """
+        values = self.column(name, start, end)
+        if not len(values):
+            return math.nan
+        if self._numpy is not None:
+            return float(self._numpy.percentile(values, percent))
+        values = sorted(values)
+        position = (len(values) - 1) * percent / 100
+        lower = int(position)
+        upper = min(lower + 1, len(values) - 1)
+        return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+    def energy(self, start = None, end = None, name = 'power', max_gap = None) -> float:
+        """Energy in VAh of the power column in the time window (trapezoidal rule)
+        -----
+        Args:
+            start, end (float): time window (time.time())
+            name (str): power column in VA
+            max_gap (float): gaps between two readings longer than max_gap s are not integrated
+        """
+        first, last = self._window(start, end)
+        power = self._slice(self._columns[name], first, last)
+        timestamps = self._slice(self._timestamps, first, last)
+        if len(power) < 2:
+            return 0.0
+        if self._numpy is not None:
+            power = power.astype('float64')
+            elapsed = self._numpy.diff(timestamps) / 1000
+            areas = (power[1:] + power[:-1]) / 2 * elapsed
+            if max_gap is not None:
+                areas = areas[elapsed <= max_gap]
+            return float(areas.sum()) / 3600
+        energy = 0.0
+        for index in range(1, len(power)):
+            elapsed = (timestamps[index] - timestamps[index - 1]) / 1000
+            if max_gap is None or elapsed <= max_gap:
+                energy += (power[index] + power[index - 1]) / 2 * elapsed
+        return energy / 3600
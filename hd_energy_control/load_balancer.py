@@ -0,0 +1,201 @@
+"""Module providing the phase aware load balancing of many HD Energy Control units"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from .constants import HDEnergyControlConstants as CONSTS
+
+
+class _Box:
+    """State of one wallbox of the fleet
+    """
+    __slots__ = ('state', 'phases', 'currents', 'max_current', 'setpoint')
+
+    def __init__(self, max_current):
+        self.state = 'A1'
+        self.phases = (0, 1, 2)
+        self.currents = (0.0, 0.0, 0.0)
+        self.max_current = max_current
+        self.setpoint = 0.0
+
+
+class FleetAllocator:
+    """Split a per phase current limit (site fuse) among many wallboxes
+
+    The boxes are updated with their charging state (register 5) and their
+    measured phase currents (register 6...8). Boxes with a vehicle plugged
+    (state B or C) get a share, charging boxes (state C) are served first.
+    Every admitted box gets at least min_current, the remaining capacity is
+    distributed max-min fair (water filling) per phase. A box which draws
+    clearly less than its setpoint (e.g. one phase car, full battery) only
+    gets its measured current plus headroom_current.
+
+    allocate() returns only the setpoints which changed by at least min_step,
+    decreases before increases, so the fuse limit also holds while the
+    new setpoints are written one after the other.
+    """
+    CHARGING_STATES = ('C1', 'C2')
+    PLUGGED_STATES = ('B1', 'B2', 'C1', 'C2')
+
+    def __init__(self, phase_limit, min_current = 6.0, max_current = 16.0, \
+                 min_step = 0.5, headroom_current = 2.0, phase_threshold = 1.0):
+        """Constructor of FleetAllocator
+        -----
+        Args:
+            phase_limit (float | tuple): current limit in A of all phases or per phase L1, L2, L3
+            min_current (float): minimal charging current in A
+            max_current (float): maximal charging current in A per box
+            min_step (float): minimal change of a setpoint in A
+            headroom_current (float): headroom above the measured current in A
+            phase_threshold (float): current in A from which a phase counts as used
+        """
+        if isinstance(phase_limit, (int, float)):
+            phase_limit = (phase_limit, phase_limit, phase_limit)
+        self._phase_limit = tuple(phase_limit)
+        self._min_current = min_current
+        self._max_current = max_current
+        self._min_step = min_step
+        self._headroom_current = headroom_current
+        self._phase_threshold = phase_threshold
+        self._boxes = {}
+        self._dirty = False
+
+    @property
+    def setpoints(self) -> dict:
+        """Actual setpoint of every box: box id -> current in A
+        """
+        return {box_id: box.setpoint for box_id, box in self._boxes.items()}
+
+    def update_box(self, box_id, charging_state = None, currents = None, max_current = None) -> None:
+        """Update the live values of one box
+        -----
+        Args:
+            box_id: any hashable id, e.g. (port, unit id)
+            charging_state: result of get_charging_state(), the state string, e.g. 'C2'
+                            or the raw register value
+            currents (tuple): result of get_currents_rms()
+            max_current (float): maximal current of the box (e.g. hw config), default max_current
+        """
+        box = self._boxes.get(box_id)
+        if box is None:
+            box = self._boxes[box_id] = _Box(self._max_current)
+            self._dirty = True
+        if charging_state is not None:
+            if isinstance(charging_state, tuple):
+                charging_state = charging_state[0]
+            elif isinstance(charging_state, int):
+                # raw value of register 5
+                charging_state = CONSTS.STATE.get(charging_state, '--')
+            if charging_state != box.state:
+                box.state = charging_state
+                self._dirty = True
+        if currents is not None:
+            currents = tuple(currents)
+            phases = tuple(index for index, current in enumerate(currents) \
+                           if current >= self._phase_threshold)
+            if phases and phases != box.phases:
+                box.phases = phases
+                self._dirty = True
+            if self._demand(box, currents) != self._demand(box, box.currents):
+                self._dirty = True
+            box.currents = currents
+        if max_current is not None and max_current != box.max_current:
+            box.max_current = min(max_current, self._max_current)
+            self._dirty = True
+
+    def remove_box(self, box_id) -> None:
+        """Remove a box (e.g. unit not reachable), its capacity is redistributed
+        """
+        if self._boxes.pop(box_id, None) is not None:
+            self._dirty = True
+
+    def _demand(self, box, currents) -> float:
+        """Maximal useful current of a box
+        """
+        if box.state not in self.CHARGING_STATES or box.setpoint == 0.0:
+            return box.max_current
+        drawn = max(currents) if currents else 0.0
+        if drawn < box.setpoint - self._headroom_current:
+            # the vehicle does not use its share
+            return max(self._min_current, min(box.max_current, drawn + self._headroom_current))
+        return box.max_current
+
+    def allocate(self, force = False) -> dict:
+        """Recompute the setpoints if a box changed
+        -----
+        Args:
+            force (bool): recompute also without change
+
+        Returns:
+            dict box id -> new current in A of the changed setpoints (0.0 = no charging),
+            decreases first
+        """
+        if not (self._dirty or force):
+            return {}
+        self._dirty = False
+        targets = self._water_filling()
+        decreases = {}
+        increases = {}
+        for box_id, box in self._boxes.items():
+            target = targets.get(box_id, 0.0)
+            if target == box.setpoint:
+                continue
+            start_or_stop = (target == 0.0) != (box.setpoint == 0.0)
+            if not start_or_stop and target > box.setpoint and target - box.setpoint < self._min_step:
+                # small increases are skipped, decreases are always written to keep the limit
+                continue
+            if target < box.setpoint:
+                decreases[box_id] = target
+            else:
+                increases[box_id] = target
+            box.setpoint = target
+        decreases.update(increases)
+        return decreases
+
+    def _water_filling(self) -> dict:
+        """Max-min fair currents of the plugged boxes under the phase limits
+        """
+        remaining = list(self._phase_limit)
+        # charging boxes first, boxes with a setpoint before new ones (no flapping)
+        candidates = [((box.state not in self.CHARGING_STATES, box.setpoint == 0.0), box_id, box) \
+                      for box_id, box in self._boxes.items() if box.state in self.PLUGGED_STATES]
+        candidates.sort(key=lambda item: item[0])
+        # admission: every admitted box gets min_current on its phases
+        admitted = []
+        for _, box_id, box in candidates:
+            if all(remaining[phase] >= self._min_current for phase in box.phases):
+                for phase in box.phases:
+                    remaining[phase] -= self._min_current
+                admitted.append((box_id, box, self._demand(box, box.currents)))
+        currents = {box_id: self._min_current for box_id, _, _ in admitted}
+        # water filling: raise all unsaturated boxes by the same amount
+        active = [(box_id, box, demand) for box_id, box, demand in admitted \
+                  if demand > self._min_current]
+        while active:
+            users = [0, 0, 0]
+            for _, box, _ in active:
+                for phase in box.phases:
+                    users[phase] += 1
+            step = min(demand - currents[box_id] for box_id, _, demand in active)
+            for phase in range(3):
+                if users[phase]:
+                    step = min(step, remaining[phase] / users[phase])
+            for box_id, box, _ in active:
+                currents[box_id] += step
+                for phase in box.phases:
+                    remaining[phase] -= step
+            # freeze boxes which reached their demand or use a full phase
+            full = {phase for phase in range(3) if users[phase] and remaining[phase] <= 1e-9}
+            active = [(box_id, box, demand) for box_id, box, demand in active \
+                      if currents[box_id] < demand - 1e-9 and not full.intersection(box.phases)]
+        # resolution of register 261 is 0.1 A, rounded down to keep the limit
+        return {box_id: int(current * 10 + 1e-9) / 10 for box_id, current in currents.items()}
+
+    def push(self, changes, scheduler, register_address = 261) -> None:
+        """Queue the changed setpoints as writes of a BusScheduler
+        -----
+        Args:
+            changes (dict): result of allocate() with unit ids as box ids
+            scheduler: BusScheduler of the bus
+        """
+        for device_unit_id, current in changes.items():
+            scheduler.submit_write(device_unit_id, register_address, round(current * 10))
@@ -0,0 +1,304 @@
+"""Module providing transaction metrics and tracing hooks of the Modbus communication"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple, Optional
+
+from pymodbus import ExceptionResponse
+from pymodbus.exceptions import ModbusIOException
+
+# outcome of a transaction
+OK = 'ok'
+EXCEPTION = 'exception'     # exception response of the device, e.g. illegal address
+TIMEOUT = 'timeout'         # no (valid) response, also frames with CRC errors
+ERROR = 'error'             # other errors of the library, e.g. port not open
+OUTCOMES = (OK, EXCEPTION, TIMEOUT, ERROR)
+
+
+class TransactionEvent(NamedTuple):
+    """One Modbus transaction as passed to the hooks"""
+    device_unit_id: int
+    function_code: int
+    address: int
+    count: int
+    duration: float             # s
+    outcome: str                # one of OUTCOMES
+    exception_code: Optional[int] = None
+    request_bytes: int = 0
+    response_bytes: int = 0
+    attempt: int = 0            # 0 = first try, > 0 = retry
+    timestamp: float = 0.0      # time.time()
+
+
+def frame_sizes(function_code, count, outcome) -> tuple:
+    """Bytes of the RTU request and response frame (unit id, pdu, crc)
+    """
+    if function_code in (0x03, 0x04):
+        request, response = 8, 5 + 2 * count
+    else:
+        request, response = 9 + 2 * count, 8
+    if outcome == EXCEPTION:
+        response = 5
+    elif outcome != OK:
+        response = 0
+    return request, response
+
+
+def classify(result) -> tuple:
+    """Outcome and exception code of a pymodbus result or exception
+    """
+    if isinstance(result, ModbusIOException):
+        return TIMEOUT, None
+    if isinstance(result, Exception):
+        return ERROR, None
+    if isinstance(result, ExceptionResponse):
+        return EXCEPTION, result.exception_code
+    if result.isError():
+        return ERROR, None
+    return OK, None
+
+
+class Histogram:
+    """Histogram with fixed upper bounds like a Prometheus histogram
+    """
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value) -> None:
+        """Add one value
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list:
+        """(upper bound, count of values <= bound) of all buckets incl. +Inf
+        """
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, quantile) -> float:
+        """Upper bound of the bucket which contains the quantile (0...1)
+        """
+        if not self.count:
+            return float('nan')
+        rank = quantile * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+        return float('inf')
+
+
+class TransactionMetrics:
+    """Counters, histograms and hooks of all transactions of one or more units
+
+    Every transaction is recorded with its duration, outcome and bytes on
+    the wire:
+    - duration histogram per unit and function code
+    - counter per unit, function code, register address and outcome
+    - retry counter per unit, function code and register address
+    - bytes sent and received per unit
+    Hooks are called with a TransactionEvent after every transaction,
+    e.g. for tracing or to log errors. One object may be shared by all
+    units of a bus, it is thread safe.
+    """
+    def __init__(self, buckets = Histogram.DEFAULT_BUCKETS):
+        self._buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._hooks = []
+        self.reset()
+
+    def reset(self) -> None:
+        """Clear all values, the hooks are kept
+        """
+        with self._lock:
+            self._durations = {}
+            self._counters = {}
+            self._retries = {}
+            self._bytes = {}
+            self.busy_time = 0.0
+            self.started = time.monotonic()
+
+    def add_hook(self, hook) -> None:
+        """Call hook(event) after every transaction
+        """
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook) -> None:
+        """Remove a hook of add_hook()
+        """
+        self._hooks.remove(hook)
+
+    def record(self, device_unit_id, function_code, address, count, duration, outcome, \
+               exception_code = None, attempt = 0) -> TransactionEvent:
+        """Record one transaction and call the hooks
+        -----
+        Args:
+            device_unit_id (int): Modbus unit id
+            function_code (int): 0x03, 0x04, 0x06 or 0x10
+            address (int): first register address
+            count (int): number of registers
+            duration (float): duration of the transaction in s
+            outcome (str): one of OUTCOMES
+            exception_code (int): code of an exception response
+            attempt (int): 0 for the first try, > 0 for a retry
+
+        Returns:
+            the TransactionEvent passed to the hooks
+        """
+        request_bytes, response_bytes = frame_sizes(function_code, count, outcome)
+        event = TransactionEvent(device_unit_id, function_code, address, count, duration, outcome, \
+                                 exception_code, request_bytes, response_bytes, attempt, time.time())
+        with self._lock:
+            histogram = self._durations.get((device_unit_id, function_code))
+            if histogram is None:
+                histogram = self._durations[(device_unit_id, function_code)] = Histogram(self._buckets)
+            histogram.observe(duration)
+            key = (device_unit_id, function_code, address, outcome)
+            self._counters[key] = self._counters.get(key, 0) + 1
+            if attempt:
+                key = (device_unit_id, function_code, address)
+                self._retries[key] = self._retries.get(key, 0) + 1
+            sent, received = self._bytes.get(device_unit_id, (0, 0))
+            self._bytes[device_unit_id] = (sent + request_bytes, received + response_bytes)
+            self.busy_time += duration
+        for hook in self._hooks:
+            try:
+                hook(event)
+            except Exception as exc:
+                print(f"ERROR: transaction hook {hook!r} raised {exc!r}")
+        return event
+
+    def histogram(self, device_unit_id, function_code) -> Histogram:
+        """Duration histogram of one unit and function code (None if no transaction)
+        """
+        return self._durations.get((device_unit_id, function_code))
+
+    def counters(self, device_unit_id = None) -> dict:
+        """Transactions per (unit id, function code, address, outcome)
+        """
+        with self._lock:
+            return {key: count for key, count in self._counters.items() \
+                    if device_unit_id is None or key[0] == device_unit_id}
+
+    def errors(self, device_unit_id = None) -> dict:
+        """Failed transactions per (unit id, function code, address, outcome)
+        """
+        return {key: count for key, count in self.counters(device_unit_id).items() if key[3] != OK}
+
+    def retries(self, device_unit_id = None) -> dict:
+        """Retries per (unit id, function code, address)
+        """
+        with self._lock:
+            return {key: count for key, count in self._retries.items() \
+                    if device_unit_id is None or key[0] == device_unit_id}
+
+    @property
+    def utilization(self) -> float:
+        """Share of the time the bus was busy since reset()
+        """
+        elapsed = time.monotonic() - self.started
+        return self.busy_time / elapsed if elapsed > 0 else 0.0
+
+    def stats(self) -> dict:
+        """Summary per unit: transactions, outcomes, retries, bytes, duration p50 / p99
+        """
+        with self._lock:
+            units = {}
+            for (unit, _, _, outcome), count in self._counters.items():
+                summary = units.setdefault(unit, {'transactions': 0, 'retries': 0, \
+                                                  'bytes_sent': 0, 'bytes_received': 0, \
+                                                  **{name: 0 for name in OUTCOMES}})
+                summary['transactions'] += count
+                summary[outcome] += count
+            for (unit, _, _), count in self._retries.items():
+                units[unit]['retries'] += count
+            for unit, (sent, received) in self._bytes.items():
+                units[unit]['bytes_sent'] = sent
+                units[unit]['bytes_received'] = received
+            for (unit, function_code), histogram in self._durations.items():
+                units[unit][f'p50_fc{function_code}'] = histogram.quantile(0.5)
+                units[unit][f'p99_fc{function_code}'] = histogram.quantile(0.99)
+        return units
+
+    def prometheus_text(self, prefix = 'hd_energy_control_modbus') -> str:
+        """All metrics in the Prometheus text exposition format
+        """
+        lines = [f'# HELP {prefix}_transaction_duration_seconds Duration of the Modbus transactions',
+                 f'# TYPE {prefix}_transaction_duration_seconds histogram']
+        with self._lock:
+            for (unit, function_code), histogram in sorted(self._durations.items()):
+                labels = f'unit="{unit}",function_code="{function_code}"'
+                for bound, total in histogram.cumulative():
+                    bound = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{prefix}_transaction_duration_seconds_bucket{{{labels},le="{bound}"}} {total}')
+                lines.append(f'{prefix}_transaction_duration_seconds_sum{{{labels}}} {histogram.sum}')
+                lines.append(f'{prefix}_transaction_duration_seconds_count{{{labels}}} {histogram.count}')
+            lines.append(f'# HELP {prefix}_transactions_total Modbus transactions per register and outcome')
+            lines.append(f'# TYPE {prefix}_transactions_total counter')
+            for (unit, function_code, address, outcome), count in sorted(self._counters.items()):
+                lines.append(f'{prefix}_transactions_total{{unit="{unit}",function_code="{function_code}",'
+                             f'address="{address}",outcome="{outcome}"}} {count}')
+            lines.append(f'# HELP {prefix}_retries_total Retried Modbus transactions per register')
+            lines.append(f'# TYPE {prefix}_retries_total counter')
+            for (unit, function_code, address), count in sorted(self._retries.items()):
+                lines.append(f'{prefix}_retries_total{{unit="{unit}",function_code="{function_code}",'
+                             f'address="{address}"}} {count}')
+            lines.append(f'# HELP {prefix}_bytes_total Bytes on the wire per unit and direction')
+            lines.append(f'# TYPE {prefix}_bytes_total counter')
+            for unit, (sent, received) in sorted(self._bytes.items()):
+                lines.append(f'{prefix}_bytes_total{{unit="{unit}",direction="sent"}} {sent}')
+                lines.append(f'{prefix}_bytes_total{{unit="{unit}",direction="received"}} {received}')
+        lines.append(f'# HELP {prefix}_bus_utilization Share of the time the bus was busy')
+        lines.append(f'# TYPE {prefix}_bus_utilization gauge')
+        lines.append(f'{prefix}_bus_utilization {self.utilization:.6f}')
+        return '\n'.join(lines) + '\n'
+
+
+def print_errors(event) -> None:
+    """Hook which prints failed transactions
+    """
+    if event.outcome != OK:
+        code = '' if event.exception_code is None else f' code {event.exception_code}'
+        print(f">>> unit {event.device_unit_id}: {event.outcome}{code} of function 0x{event.function_code:02X} "
+              f"register {event.address} after {event.duration * 1000:.1f} ms")
+
+
+def serve_prometheus(metrics, address = ('', 9105)) -> ThreadingHTTPServer:
+    """Serve metrics.prometheus_text() on http://address/metrics in a background thread
+
+    Returns the server, stop it with shutdown()
+    """
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(address, _Handler)
+    threading.Thread(target=server.serve_forever, name='prometheus', daemon=True).start()
+    return server
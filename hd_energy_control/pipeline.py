@@ -0,0 +1,425 @@
+"""Module providing the fan-out of HD Energy Control readings to several sinks
+
+The acquisition publishes records (dicts) to a Pipeline, every sink has
+its own worker thread with a bounded queue, so a slow or unreachable sink
+never delays the next bus transaction:
+
+    pipeline = Pipeline()
+    pipeline.add_sink('stdout', JSONLinesSink())
+    pipeline.add_sink('mqtt', MQTTSink('localhost'), policy='drop_oldest')
+    with pipeline:
+        pipeline.run(readings(wallbox, interval=1.0, box_id=1))
+"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+
+
+def flatten_record(record) -> dict:
+    """Flat dict of scalar values, tuples become name_1, name_2 ...
+    """
+    flat = {}
+    for name, value in record.items():
+        if isinstance(value, (tuple, list)):
+            for index, item in enumerate(value, 1):
+                flat[f'{name}_{index}'] = item
+        else:
+            flat[name] = value
+    return flat
+
+
+class Sink(ABC):
+    """Base class of the sinks, write() is called by the worker thread only
+    """
+    def open(self) -> None:
+        """Open the connection or file, called in the worker thread
+        """
+
+    @abstractmethod
+    def write(self, records) -> None:
+        """Write a batch of records, an exception counts as failed batch
+        """
+
+    def close(self) -> None:
+        """Close the connection or file
+        """
+
+
+class JSONLinesSink(Sink):
+    """One JSON object per line on stdout or in a file
+    """
+    def __init__(self, path = None):
+        self._path = path
+        self._file = None
+
+    def open(self) -> None:
+        self._file = sys.stdout if self._path is None else open(self._path, 'a', encoding='utf-8')
+
+    def write(self, records) -> None:
+        for record in records:
+            self._file.write(json.dumps(record, default=list) + '\n')
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None and self._file is not sys.stdout:
+            self._file.close()
+        self._file = None
+
+
+class CSVSink(Sink):
+    """CSV file, tuples are flattened, the header is written to a new file
+    """
+    def __init__(self, path, columns = None):
+        """Constructor of CSVSink
+        -----
+        Args:
+            path (str): CSV file, records are appended
+            columns (tuple): columns of the file, default columns of the first record
+        """
+        self._path = path
+        self._columns = columns
+        self._file = None
+        self._writer = None
+
+    def open(self) -> None:
+        self._write_header = not os.path.exists(self._path) or os.path.getsize(self._path) == 0
+        self._file = open(self._path, 'a', newline='', encoding='utf-8')
+
+    def write(self, records) -> None:
+        for record in records:
+            record = flatten_record(record)
+            if self._writer is None:
+                self._writer = csv.DictWriter(self._file, fieldnames=self._columns or list(record), \
+                                                    extrasaction='ignore')
+                if self._write_header:
+                    self._writer.writeheader()
+            self._writer.writerow(record)
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._writer = None
+
+
+class ParquetSink(Sink):
+    """Parquet file (needs pyarrow), every batch is written as one row group
+    """
+    def __init__(self, path):
+        self._path = path
+        self._pyarrow = None
+        self._writer = None
+
+    def open(self) -> None:
+        # optional dependency, only needed by this sink
+        import pyarrow
+        import pyarrow.parquet
+        self._pyarrow = pyarrow
+
+    def write(self, records) -> None:
+        table = self._pyarrow.Table.from_pylist([flatten_record(record) for record in records])
+        if self._writer is None:
+            self._writer = self._pyarrow.parquet.ParquetWriter(self._path, table.schema)
+        self._writer.write_table(table.cast(self._writer.schema))
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._writer = None
+
+
+class MariaDBSink(Sink):
+    """Rows of a MariaDBBatchWriter, failed rows are requeued or spooled by the writer
+
+    The batch writer is flushed by the worker, do not start() it. A batch
+    kept by the writer (database not reachable) is not a failed batch, it
+    is counted in kept and written with a later flush.
+    """
+    def __init__(self, writer, to_row = None):
+        """Constructor of MariaDBSink
+        -----
+        Args:
+            writer: MariaDBBatchWriter with the table and columns or the procedure
+            to_row: converts a record into the row tuple, default the values of the
+                    flattened record (currents_rms_1, currents_rms_2 ...)
+        """
+        self._writer = writer
+        self._to_row = to_row or (lambda record: tuple(flatten_record(record).values()))
+        self.kept = 0
+
+    def write(self, records) -> None:
+        for record in records:
+            self._writer.add(self._to_row(record))
+        if not self._writer.flush():
+            self.kept += len(records)
+
+    def close(self) -> None:
+        self._writer.flush()
+
+
+class MQTTSink(Sink):
+    """JSON message per record to a MQTT broker (needs paho-mqtt)
+    """
+    def __init__(self, host = 'localhost', port = 1883, topic = 'hd_energy_control/{box_id}', qos = 0):
+        """Constructor of MQTTSink
+        -----
+        Args:
+            host, port: MQTT broker
+            topic (str): topic, formatted with the record, e.g. 'wallbox/{box_id}/values'
+            qos (int): MQTT quality of service
+        """
+        self._host = host
+        self._port = port
+        self._topic = topic
+        self._qos = qos
+        self._client = None
+
+    def open(self) -> None:
+        # optional dependency, only needed by this sink
+        from paho.mqtt import client as mqtt
+        if hasattr(mqtt, 'CallbackAPIVersion'):
+            self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        else:
+            self._client = mqtt.Client()
+        self._client.connect(self._host, self._port)
+        # reconnects in the background of paho
+        self._client.loop_start()
+
+    def write(self, records) -> None:
+        for record in records:
+            info = self._client.publish(self._topic.format(**record), json.dumps(record, default=list), \
+                                        qos=self._qos)
+            if info.rc:
+                raise IOError(f'MQTT publish failed ({info.rc})')
+
+    def close(self) -> None:
+        if self._client is not None:
+            self._client.loop_stop()
+            self._client.disconnect()
+        self._client = None
+
+
+class SinkWorker:
+    """Worker thread with a bounded queue of one sink
+
+    Policies of a full queue:
+    - 'drop_oldest': the oldest queued record is dropped (keeps the latest values)
+    - 'drop_newest': the new record is dropped
+    - 'block': publish() waits up to block_timeout s, then the new record is dropped
+    The lag is the age of the oldest record of a batch when it is written.
+    """
+    POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+    def __init__(self, name, sink, max_queue = 1000, policy = 'drop_oldest', batch_size = 100, \
+                 flush_interval = 1.0, block_timeout = 1.0):
+        if policy not in self.POLICIES:
+            raise ValueError(f'policy {policy} not in {self.POLICIES}')
+        self.name = name
+        self._sink = sink
+        self._max_queue = max_queue
+        self._policy = policy
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._block_timeout = block_timeout
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.errors = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def put(self, record) -> bool:
+        """Queue a record, returns False if it was dropped
+        """
+        with self._condition:
+            if len(self._queue) >= self._max_queue:
+                if self._policy == 'block':
+                    self._condition.wait_for(lambda: len(self._queue) < self._max_queue, \
+                                             self._block_timeout)
+                if self._policy == 'drop_oldest':
+                    self._queue.popleft()
+                    self.dropped += 1
+                elif len(self._queue) >= self._max_queue:
+                    self.dropped += 1
+                    return False
+            self._queue.append((time.monotonic(), record))
+            if len(self._queue) >= self._batch_size:
+                self._condition.notify_all()
+        return True
+
+    def _take_batch(self) -> list:
+        """Wait for a full batch or the flush interval, returns [] when stopped and empty
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._queue) >= self._batch_size or not self._running, \
+                                     self._flush_interval)
+            count = min(len(self._queue), self._batch_size)
+            batch = [self._queue.popleft() for _ in range(count)]
+            # space for blocked publishers
+            self._condition.notify_all()
+        return batch
+
+    def _open(self) -> bool:
+        try:
+            self._sink.open()
+            return True
+        except Exception as exc:
+            print(f"ERROR: sink {self.name} cannot be opened ({exc!r})")
+            self.errors += 1
+            return False
+
+    def _run(self) -> None:
+        opened = self._open()
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                if not self._running:
+                    break
+                continue
+            lag = time.monotonic() - batch[0][0]
+            # a sink which could not be opened is retried with every batch
+            opened = opened or self._open()
+            try:
+                if not opened:
+                    raise IOError('sink not open')
+                self._sink.write([record for _, record in batch])
+                self.written += len(batch)
+            except Exception as exc:
+                print(f"ERROR: sink {self.name} failed ({exc!r})")
+                self.errors += 1
+                self.failed += len(batch)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+        if opened:
+            try:
+                self._sink.close()
+            except Exception as exc:
+                print(f"ERROR: sink {self.name} cannot be closed ({exc!r})")
+
+    def start(self) -> None:
+        """Start the worker thread
+        """
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f'sink-{self.name}', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout = None) -> None:
+        """Write the queued records and stop the worker thread
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self) -> dict:
+        """Counters and lag of the worker
+        """
+        return {'queued': len(self._queue), 'written': self.written, 'dropped': self.dropped, \
+                'failed': self.failed, 'errors': self.errors, 'last_lag': self.last_lag, \
+                'max_lag': self.max_lag}
+
+
+class Pipeline:
+    """Fan-out of the published records to all sinks
+    """
+    def __init__(self):
+        self._workers = []
+        self.published = 0
+
+    def add_sink(self, name, sink, **options) -> SinkWorker:
+        """Add a sink with its worker, options see SinkWorker
+        """
+        worker = SinkWorker(name, sink, **options)
+        self._workers.append(worker)
+        return worker
+
+    def publish(self, record) -> None:
+        """Queue one record (dict) for all sinks
+        """
+        self.published += 1
+        for worker in self._workers:
+            worker.put(record)
+
+    def run(self, source) -> None:
+        """Publish all records of a source, e.g. readings()
+        """
+        for record in source:
+            self.publish(record)
+
+    def start(self) -> None:
+        """Start the workers of all sinks
+        """
+        for worker in self._workers:
+            worker.start()
+
+    def stop(self, timeout = None) -> None:
+        """Write the queued records and stop all workers
+        """
+        for worker in self._workers:
+            worker.stop(timeout)
+
+    def stats(self) -> dict:
+        """Stats of all sinks: name -> SinkWorker.stats()
+        """
+        return {worker.name: worker.stats() for worker in self._workers}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def readings(wallbox, interval, names = None, box_id = None, stop_event = None, count = None):
+    """Generator of the readings of one wallbox on a fixed monotonic schedule
+    -----
+    Args:
+        wallbox: HDEnergyControl object
+        interval (float): seconds between two readings
+        names (tuple): register names, default the measurement registers
+        box_id: id of the wallbox in the records, default the unit id
+        stop_event: threading.Event which ends the generator
+        count (int): number of readings, default endless
+
+    Yields:
+        dict with box_id, timestamp and the values, failed reads are skipped
+    """
+    from .register_map import MEASUREMENT_PLAN, compile_read_plan
+    plan = MEASUREMENT_PLAN if names is None else compile_read_plan(tuple(sorted(names)))
+    if box_id is None:
+        box_id = wallbox.device_unit_id
+    next_reading = time.monotonic()
+    done = 0
+    while count is None or done < count:
+        if stop_event is not None and stop_event.is_set():
+            return
+        values = wallbox.get_registers(plan=plan)
+        done += 1
+        if values is not False:
+            yield {'box_id': box_id, 'timestamp': time.time(), **values}
+        next_reading += interval
+        delay = next_reading - time.monotonic()
+        if delay < 0:
+            # keep the cadence, do not catch up missed readings
+            next_reading -= delay
+            delay = 0.0
+        if stop_event is not None:
+            stop_event.wait(delay)
+        else:
+            time.sleep(delay)
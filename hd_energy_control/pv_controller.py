@@ -0,0 +1,109 @@
+"""Module providing a PV surplus charging controller for HD Energy Control"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+import time
+
+from .constants import HDEnergyControlConstants as CONSTS
+
+
+class PVSurplusController:
+    """Closed loop controller of the maximal charging current from PV surplus
+
+    Each measurement of the surplus power (power exported to the grid,
+    positive = export) is turned into a target current within the limits of
+    set_maximal_current_command (6...16 A, 0 A = no charging):
+
+    - charging starts when the surplus covers min_current + hysteresis_w
+      and stops when it falls below min_current - hysteresis_w
+    - the current is only written when it changes by at least min_step
+    - increases are written at most every min_write_interval seconds,
+      decreases are written immediately (no grid import)
+    """
+    def __init__(self, wallbox = None, phases = 3, voltage = 230.0, min_current = 6.0, \
+                 max_current = 16.0, hysteresis_w = 300.0, min_step = 1.0, \
+                 min_write_interval = 30.0):
+        """Constructor of PVSurplusController
+        -----
+        Args:
+            wallbox: HDEnergyControl object or None (only compute)
+            phases (int): number of phases used for charging
+            voltage (float): phase voltage in V
+            min_current (float): minimal charging current in A
+            max_current (float): maximal charging current in A
+            hysteresis_w (float): hysteresis of start / stop in W
+            min_step (float): minimal change of the current in A
+            min_write_interval (float): minimal seconds between two increases
+        """
+        self._wallbox = wallbox
+        self._watt_per_ampere = phases * voltage
+        self._min_current = min_current
+        self._max_current = max_current
+        self._hysteresis_w = hysteresis_w
+        self._min_step = min_step
+        self._min_write_interval = min_write_interval
+        self.current = 0.0
+        self._last_write = -math.inf
+        self.write_count = 0
+
+    @property
+    def charging(self) -> bool:
+        """True if the controller allows charging
+        """
+        return self.current >= self._min_current
+
+    def compute(self, surplus_w, charging_power_w = None) -> float:
+        """Compute the target current of a surplus measurement
+        -----
+        Args:
+            surplus_w (float): power exported to the grid in W
+            charging_power_w (float): actual charging power (e.g. get_power()),
+                                      if None the power of the actual current is assumed
+
+        Returns:
+            target current in A (0.0 = no charging)
+        """
+        if charging_power_w is None:
+            charging_power_w = self.current * self._watt_per_ampere
+        available_w = surplus_w + charging_power_w
+        min_power_w = self._min_current * self._watt_per_ampere
+        if self.charging:
+            if available_w < min_power_w - self._hysteresis_w:
+                return 0.0
+        elif available_w < min_power_w + self._hysteresis_w:
+            return 0.0
+        # resolution of register 261 is 0.1 A
+        target = math.floor(available_w / self._watt_per_ampere * 10) / 10
+        return min(max(target, self._min_current), self._max_current)
+
+    def update(self, surplus_w, charging_power_w = None, now = None) -> bool:
+        """Process one surplus measurement and write the current if needed
+        -----
+        Args:
+            surplus_w (float): power exported to the grid in W
+            charging_power_w (float): actual charging power in W or None
+            now (float): time.monotonic() of the measurement
+
+        Returns:
+            True if a new current was written
+        """
+        if now is None:
+            now = time.monotonic()
+        target = self.compute(surplus_w, charging_power_w)
+        if target == self.current:
+            return False
+        start_or_stop = (target == 0.0) != (self.current == 0.0)
+        if not start_or_stop and abs(target - self.current) < self._min_step:
+            return False
+        if target > self.current and now - self._last_write < self._min_write_interval:
+            return False
+        if self._wallbox is not None and self._wallbox.set_maximal_current_command(target) is False:
+            # not written: error or the value is already set according to the shadow state
+            if self._wallbox.shadow.get(CONSTS.REGISTERS['maximal_current_command'].address) \
+                    != int(target * 10):
+                return False
+        self.current = target
+        self._last_write = now
+        self.write_count += 1
+        return True
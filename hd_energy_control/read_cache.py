@@ -0,0 +1,105 @@
+"""Module providing the register read cache for ModbusRTU"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+from .constants import HDEnergyControlConstants as CONSTS
+
+
+class RegisterCache:
+    """Cache of raw register values with a freshness (TTL) per register
+
+    A TTL of 0 disables caching of the register, math.inf keeps the
+    value until it is invalidated. The TTLs of the register map are
+    taken from CONSTS.CACHE_TTL.
+    """
+    def __init__(self, ttl = None, default_ttl = 0.0):
+        """Constructor of RegisterCache
+        -----
+        Args:
+            ttl (dict): register name -> TTL in seconds, default CONSTS.CACHE_TTL
+            default_ttl (float): TTL of all registers without own TTL
+        """
+        self._default_ttl = default_ttl
+        self._ttl = {}
+        self._values = {}
+        self.hits = 0
+        self.misses = 0
+        for name, seconds in (CONSTS.CACHE_TTL if ttl is None else ttl).items():
+            self.set_register_ttl(name, seconds)
+
+    def set_register_ttl(self, name, ttl) -> None:
+        """Set the TTL in seconds of all registers of a register name
+        """
+        definition = CONSTS.REGISTERS[name]
+        length = CONSTS.TYPE_TO_LENGTH[definition.datatype] * definition.count
+        for address in range(definition.address, definition.address + length):
+            self.set_ttl(definition.function_code, address, ttl)
+
+    def set_ttl(self, function_code, address, ttl) -> None:
+        """Set the TTL in seconds of one register address
+        """
+        self._ttl[(function_code, address)] = ttl
+
+    def lookup(self, function_code, address, length, now = None):
+        """Look up the registers address ... address + length - 1
+        -----
+        Returns:
+            (registers, first, last): cached registers (None if not fresh) and the
+            range first...last of addresses which need to be read from the bus,
+            first is None on a full hit
+        """
+        if now is None:
+            now = time.monotonic()
+        registers = []
+        first = last = None
+        for current in range(address, address + length):
+            key = (function_code, current)
+            entry = self._values.get(key)
+            if entry is not None and now - entry[0] < self._ttl.get(key, self._default_ttl):
+                registers.append(entry[1])
+                continue
+            registers.append(None)
+            if first is None:
+                first = current
+            last = current
+        if first is None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return registers, first, last
+
+    def store(self, function_code, address, registers, now = None) -> None:
+        """Store raw registers read from the bus starting at address
+        """
+        if now is None:
+            now = time.monotonic()
+        for offset, value in enumerate(registers):
+            key = (function_code, address + offset)
+            if self._ttl.get(key, self._default_ttl) > 0:
+                self._values[key] = (now, value)
+
+    def invalidate(self, function_code = None, address = None, length = 1) -> None:
+        """Invalidate cached registers
+
+        Without arguments the whole cache is cleared, without address all
+        registers of the function code.
+        """
+        if function_code is None:
+            self._values.clear()
+            return
+        if address is None:
+            for key in [key for key in self._values if key[0] == function_code]:
+                del self._values[key]
+            return
+        for current in range(address, address + length):
+            self._values.pop((function_code, current), None)
+
+    def stats(self) -> dict:
+        """Hit and miss counters of the cache
+        """
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, \
+                'hit_ratio': self.hits / total if total else 0.0, \
+                'entries': len(self._values)}
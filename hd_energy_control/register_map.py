@@ -0,0 +1,179 @@
+"""Module providing precompiled read plans for the HD Energy Control register map"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import struct
+from functools import lru_cache
+
+from .constants import HDEnergyControlConstants as CONSTS
+
+# struct format character per datatype, all values are big endian
+# with the high word first (Modbus word order)
+STRUCT_FORMAT = {'U8': 'H', 'U16': 'H', 'U32': 'I', 'U64': 'Q', \
+                 'S8': 'h', 'S16': 'h', 'S32': 'i', 'S64': 'q'}
+
+# maximal number of registers of one read request (Modbus limit)
+MAX_BLOCK_LENGTH = 125
+
+
+@lru_cache(maxsize=None)
+def register_struct(length) -> struct.Struct:
+    """Struct to pack `length` raw 16 bit registers into bytes
+    """
+    return struct.Struct(f'>{length}H')
+
+
+@lru_cache(maxsize=None)
+def value_struct(datatype, count = 1) -> struct.Struct:
+    """Struct to unpack `count` values of `datatype` from register bytes
+    """
+    return struct.Struct(f'>{count}{STRUCT_FORMAT[datatype]}')
+
+
+def decode_registers(registers, datatype, count = 1):
+    """Decode raw registers with the precompiled struct of the datatype
+
+    Returns a single value for count == 1 otherwise a list
+    """
+    data = list(value_struct(datatype, count).unpack(register_struct(len(registers)).pack(*registers)))
+    return data[0] if count == 1 else data
+
+
+def _divisor(scale):
+    """Return the integer divisor for scales like 0.1 or None
+
+    Dividing by 10 keeps 101 * 0.1 at 10.1 instead of 10.100000000000001
+    """
+    if scale == 1:
+        return None
+    inverse = 1 / scale
+    if inverse > 1 and abs(inverse - round(inverse)) < 1e-9:
+        return round(inverse)
+    return None
+
+
+class CompiledRegister:
+    """One register value of a read block with precompiled decoder
+    """
+    __slots__ = ('name', 'definition', 'length', 'offset', '_struct', '_scale', '_divisor')
+
+    def __init__(self, name, definition, offset = 0):
+        self.name = name
+        self.definition = definition
+        self.length = CONSTS.TYPE_TO_LENGTH[definition.datatype] * definition.count
+        # byte offset inside the block
+        self.offset = offset * 2
+        self._struct = value_struct(definition.datatype, definition.count)
+        self._scale = definition.scale
+        self._divisor = _divisor(definition.scale)
+
+    def decode(self, buffer):
+        """Decode the scaled value from the packed bytes of the block
+
+        Returns a single value for count == 1 otherwise a tuple
+        """
+        values = self._struct.unpack_from(buffer, self.offset)
+        if self._divisor is not None:
+            values = tuple(value / self._divisor for value in values)
+        elif self._scale != 1:
+            values = tuple(value * self._scale for value in values)
+        return values[0] if self.definition.count == 1 else values
+
+
+class ReadBlock:
+    """Consecutive registers which are read in one request
+    """
+    __slots__ = ('function_code', 'address', 'length', 'registers', '_pack')
+
+    def __init__(self, function_code, address, length, registers):
+        self.function_code = function_code
+        self.address = address
+        self.length = length
+        self.registers = registers
+        self._pack = register_struct(length)
+
+    def __repr__(self):
+        names = ', '.join(register.name for register in self.registers)
+        return f'ReadBlock(0x{self.function_code:02x}, {self.address}, {self.length}, [{names}])'
+
+    def decode(self, raw_registers, values = None) -> dict:
+        """Decode the raw register values of the block into a dict name -> value
+        """
+        if values is None:
+            values = {}
+        buffer = self._pack.pack(*raw_registers)
+        for register in self.registers:
+            values[register.name] = register.decode(buffer)
+        return values
+
+
+class ReadPlan(tuple):
+    """Tuple of ReadBlocks covering a set of registers
+    """
+    __slots__ = ()
+
+    @property
+    def transactions(self) -> int:
+        """Number of bus transactions needed for the plan
+        """
+        return len(self)
+
+    def decode(self, raw_blocks) -> dict:
+        """Decode the raw registers of all blocks (same order as the plan)
+        """
+        values = {}
+        for block, raw_registers in zip(self, raw_blocks):
+            block.decode(raw_registers, values)
+        return values
+
+
+@lru_cache(maxsize=None)
+def compile_read_plan(names, max_gap = 0, max_length = MAX_BLOCK_LENGTH) -> ReadPlan:
+    """Compile the register names into a plan of minimal block reads
+    -----
+    Args:
+        names (tuple): register names of CONSTS.REGISTERS
+        max_gap (int): number of unused registers allowed inside a block
+        max_length (int): maximal number of registers per block
+
+    Returns:
+        ReadPlan
+    """
+    definitions = sorted(((CONSTS.REGISTERS[name], name) for name in set(names)), \
+                         key=lambda item: (item[0].function_code, item[0].address))
+    blocks = []
+    current = []
+    for definition, name in definitions:
+        length = CONSTS.TYPE_TO_LENGTH[definition.datatype] * definition.count
+        if current:
+            first = current[0][0]
+            last = current[-1][0]
+            end = last.address + CONSTS.TYPE_TO_LENGTH[last.datatype] * last.count
+            if definition.function_code == first.function_code \
+                    and definition.address - end <= max_gap \
+                    and definition.address + length - first.address <= max_length:
+                current.append((definition, name))
+                continue
+            blocks.append(_build_block(current))
+        current = [(definition, name)]
+    if current:
+        blocks.append(_build_block(current))
+    return ReadPlan(blocks)
+
+
+def _build_block(items) -> ReadBlock:
+    """Build a ReadBlock of sorted (definition, name) items
+    """
+    first = items[0][0]
+    last = items[-1][0]
+    end = last.address + CONSTS.TYPE_TO_LENGTH[last.datatype] * last.count
+    registers = tuple(CompiledRegister(name, definition, definition.address - first.address) \
+                      for definition, name in items)
+    return ReadBlock(first.function_code, first.address, end - first.address, registers)
+
+
+# read plans compiled at import
+REGISTER_PLANS = {name: compile_read_plan((name,)) for name in CONSTS.REGISTERS}
+MEASUREMENT_PLAN = compile_read_plan(CONSTS.MEASUREMENT_REGISTERS)
+SNAPSHOT_PLAN = compile_read_plan(CONSTS.MEASUREMENT_REGISTERS + CONSTS.CONFIG_REGISTERS)
+HOLDING_PLAN = compile_read_plan(CONSTS.HOLDING_REGISTERS, max_gap=1)
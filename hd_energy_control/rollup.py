@@ -0,0 +1,139 @@
+"""Module providing the streaming rollup of HD Energy Control readings into time windows"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+import time
+
+
+class _Aggregate:
+    """min / max / sum / last of one value within a window
+    """
+    __slots__ = ('minimum', 'maximum', 'total', 'count', 'last')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.total = 0.0
+        self.count = 0
+        self.last = None
+
+    def add(self, value):
+        if value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+        self.total += value
+        self.count += 1
+        self.last = value
+
+
+class WindowRollup:
+    """Tumbling window rollup of the readings of one wallbox
+
+    Every reading is added to the aggregates (min, max, mean, last) of the
+    running window, the window is emitted as one row when a reading of the
+    next window arrives (or by flush()). Tuples like currents_rms are
+    aggregated per phase (currents_rms_1 ... currents_rms_3). The memory is
+    constant: one aggregate per value, no samples are kept. Windows are
+    aligned to multiples of window seconds of time.time(), windows without
+    readings are not emitted.
+
+    Row: box_id, window_start, window_end, samples and for every value
+    <name>_min, <name>_max, <name>_mean, <name>_last
+    """
+    DEFAULT_FIELDS = {'currents_rms': 3, 'voltages_rms': 3, 'power': 1, 'pcb_temperature': 1}
+    STATISTICS = ('min', 'max', 'mean', 'last')
+
+    def __init__(self, window = 60.0, fields = None, on_row = None, box_id = None):
+        """Constructor of WindowRollup
+        -----
+        Args:
+            window (float): length of a window in s
+            fields (dict): field name -> number of values (3 for tuples of L1, L2, L3),
+                           default DEFAULT_FIELDS
+            on_row: called with every finished row (dict)
+            box_id: id of the wallbox in the rows
+        """
+        self._window = window
+        self._on_row = on_row
+        self.box_id = box_id
+        fields = dict(self.DEFAULT_FIELDS if fields is None else fields)
+        # (field, index or None, column prefix, aggregate)
+        self._values = []
+        for name, count in fields.items():
+            if count == 1:
+                self._values.append((name, None, name, _Aggregate()))
+            else:
+                for index in range(count):
+                    self._values.append((name, index, f'{name}_{index + 1}', _Aggregate()))
+        self._window_start = None
+        self._samples = 0
+        self.rows = 0
+
+    @property
+    def columns(self) -> tuple:
+        """Keys of the rows in their order, e.g. the columns of the table
+        """
+        return ('box_id', 'window_start', 'window_end', 'samples') + \
+            tuple(f'{prefix}_{statistic}' for _, _, prefix, _ in self._values \
+                  for statistic in self.STATISTICS)
+
+    def add(self, values, timestamp = None):
+        """Add one reading
+        -----
+        Args:
+            values (dict): field name -> value, e.g. of get_registers(), missing fields are skipped
+            timestamp (float): time.time() of the reading
+
+        Returns:
+            the finished row of the previous window or None
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        window_start = math.floor(timestamp / self._window) * self._window
+        row = None
+        if self._window_start is not None and window_start != self._window_start:
+            row = self.flush()
+        if self._window_start is None:
+            self._window_start = window_start
+        self._samples += 1
+        for name, index, _, aggregate in self._values:
+            value = values.get(name)
+            if value is None or value is False:
+                continue
+            aggregate.add(value if index is None else value[index])
+        return row
+
+    def add_snapshot(self, snapshot):
+        """Add a HDEnergyControlSnapshot, see add()
+        """
+        return self.add(vars(snapshot), snapshot.timestamp)
+
+    def flush(self):
+        """Emit the running window (e.g. at shutdown)
+
+        Returns the row or None without readings
+        """
+        if self._window_start is None:
+            return None
+        row = {'box_id': self.box_id, 'window_start': self._window_start, \
+               'window_end': self._window_start + self._window, 'samples': self._samples}
+        for _, _, prefix, aggregate in self._values:
+            if aggregate.count:
+                row[f'{prefix}_min'] = aggregate.minimum
+                row[f'{prefix}_max'] = aggregate.maximum
+                row[f'{prefix}_mean'] = aggregate.total / aggregate.count
+                row[f'{prefix}_last'] = aggregate.last
+            else:
+                row.update({f'{prefix}_{statistic}': None for statistic in self.STATISTICS})
+            aggregate.reset()
+        self._window_start = None
+        self._samples = 0
+        self.rows += 1
+        if self._on_row is not None:
+            self._on_row(row)
+        return row
@@ -0,0 +1,157 @@
+"""Module providing the charging session tracker of HD Energy Control"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from .constants import HDEnergyControlConstants as CONSTS
+
+COUNTER_MODULO = 1 << 32
+
+
+@dataclass(frozen=True)
+class ChargingSession:
+    """One charging session from plugging in until unplugging the vehicle
+    """
+    box_id: object
+    start: float                # time.time() of the first plugged sample
+    end: float                  # time.time() of the first unplugged sample
+    duration: float             # s
+    charging_duration: float    # s in state C
+    energy: int                 # VAh
+    peak_power: int             # VA
+    counter_resets: int = 0     # resets of the energy counter within the session
+
+
+class SessionTracker:
+    """Incremental charging session tracker of one wallbox
+
+    A session starts when the charging state changes to B or C (vehicle
+    plugged) and ends with state A (no vehicle), the error and derating
+    states do not end a session. The energy of a session is the sum of
+    the increments of the 32 bit energy counter, so it needs O(1) per
+    sample:
+    - a wraparound of the counter (2**32 - 1 -> 0) is counted as increment
+    - a decrease or an implausible jump (e.g. energy_since_power_on after a
+      power cycle) is a reset, the energy since the reset is counted
+    """
+    PLUGGED_STATES = ('B1', 'B2', 'C1', 'C2')
+    CHARGING_STATES = ('C1', 'C2')
+    UNPLUGGED_STATES = ('A1', 'A2')
+
+    def __init__(self, box_id = None, on_session = None, max_power = 22080):
+        """Constructor of SessionTracker
+        -----
+        Args:
+            box_id: id of the wallbox in the session records
+            on_session: called with every finished ChargingSession
+            max_power (float): maximal possible power in VA, bounds a plausible increment
+        """
+        self.box_id = box_id
+        self._on_session = on_session
+        self._max_power = max_power
+        self._last_counter = None
+        self._last_time = None
+        self._charging = False
+        self._start = None
+        self._charging_duration = 0.0
+        self._energy = 0
+        self._peak_power = 0
+        self._counter_resets = 0
+        self.session_count = 0
+
+    @property
+    def in_session(self) -> bool:
+        """True while a vehicle is plugged
+        """
+        return self._start is not None
+
+    @property
+    def session_energy(self) -> int:
+        """Energy of the running session in VAh (0 without session)
+        """
+        return self._energy
+
+    def _increment(self, counter, elapsed) -> int:
+        """Energy since the last counter value, handles wraparound and resets
+        """
+        last = self._last_counter
+        self._last_counter = counter
+        if last is None:
+            return 0
+        # plausible maximum with a margin for the resolution of the counter
+        plausible = self._max_power * max(elapsed, 0.0) / 3600 * 1.5 + 10
+        increment = (counter - last) % COUNTER_MODULO
+        if increment <= plausible:
+            # also a wraparound from 2**32 - 1 to 0
+            return increment
+        # reset of the counter (power cycle), the energy since the reset
+        self._counter_resets += 1
+        return counter if counter <= plausible else 0
+
+    def update(self, charging_state, energy, power = 0, timestamp = None) -> Optional[ChargingSession]:
+        """Process one sample
+        -----
+        Args:
+            charging_state: result of get_charging_state(), the state string, e.g. 'C2'
+                            or the raw register value
+            energy (int): energy counter in VAh (e.g. get_energy_since_installation())
+            power (int): actual power in VA
+            timestamp (float): time.time() of the sample
+
+        Returns:
+            the finished ChargingSession or None
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        if isinstance(charging_state, tuple):
+            charging_state = charging_state[0]
+        elif isinstance(charging_state, int):
+            charging_state = CONSTS.STATE.get(charging_state, '--')
+        elapsed = timestamp - self._last_time if self._last_time is not None else 0.0
+        increment = self._increment(energy, elapsed) if energy is not None else 0
+        finished = None
+        if self._start is not None:
+            self._energy += increment
+            if self._charging:
+                self._charging_duration += elapsed
+            if power is not None and power > self._peak_power:
+                self._peak_power = power
+            if charging_state in self.UNPLUGGED_STATES:
+                finished = self._finish(timestamp)
+        elif charging_state in self.PLUGGED_STATES:
+            self._start = timestamp
+            self._charging_duration = 0.0
+            self._energy = 0
+            self._peak_power = power or 0
+            self._counter_resets = 0
+        if charging_state in self.PLUGGED_STATES or charging_state in self.UNPLUGGED_STATES:
+            self._charging = charging_state in self.CHARGING_STATES
+        self._last_time = timestamp
+        return finished
+
+    def update_snapshot(self, snapshot, counter = 'energy_since_installation') -> Optional[ChargingSession]:
+        """Process a HDEnergyControlSnapshot, see update()
+        """
+        return self.update(snapshot.charging_state, getattr(snapshot, counter), snapshot.power, \
+                           snapshot.timestamp)
+
+    def close(self, timestamp = None) -> Optional[ChargingSession]:
+        """Finish a running session, e.g. when the tracker is stopped
+        """
+        if self._start is None:
+            return None
+        return self._finish(time.time() if timestamp is None else timestamp)
+
+    def _finish(self, timestamp) -> ChargingSession:
+        session = ChargingSession(self.box_id, self._start, timestamp, timestamp - self._start, \
+                                  self._charging_duration, self._energy, self._peak_power, \
+                                  self._counter_resets)
+        self._start = None
+        self._charging = False
+        self.session_count += 1
+        if self._on_session is not None:
+            self._on_session(session)
+        return session
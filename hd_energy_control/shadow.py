@@ -0,0 +1,116 @@
+"""Module providing the shadow state of the HD Energy Control holding registers"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+
+class HoldingRegisterShadow:
+    """Last known values of the holding registers 257...262
+
+    The shadow is updated by every read and write of the registers.
+    It is used to skip writes of values which are already set and to
+    collect the writes of one control tick, adjacent registers are merged
+    into one write request (code 0x10).
+    A read which returns another value than the shadow counts as drift
+    (e.g. the wallbox fell back to the failsafe current).
+
+    Values older than max_age seconds are unknown, so a change on the
+    device (power cycle, failsafe) skips a write at most max_age seconds.
+    The shadow is invalidated when the device does not respond.
+    """
+    FIRST_ADDRESS = 257
+    LAST_ADDRESS = 262
+
+    def __init__(self, max_age = 60.0):
+        """Constructor of HoldingRegisterShadow
+        -----
+        Args:
+            max_age (float): seconds a read or written value is trusted, None = forever
+        """
+        self.max_age = max_age
+        # address -> (value, time.monotonic() of the read or write)
+        self._values = {}
+        self._pending = {}
+        self.last_update = None
+        self.skipped_writes = 0
+        self.drift_count = 0
+
+    def __contains__(self, address) -> bool:
+        return self.FIRST_ADDRESS <= address <= self.LAST_ADDRESS
+
+    def get(self, address):
+        """Last known value of the register or None if unknown or too old
+        """
+        entry = self._values.get(address)
+        if entry is None:
+            return None
+        if self.max_age is not None and time.monotonic() - entry[1] > self.max_age:
+            return None
+        return entry[0]
+
+    def invalidate(self) -> None:
+        """Forget all known values, e.g. after the device did not respond
+        """
+        self._values.clear()
+
+    def is_unchanged(self, address, value) -> bool:
+        """True if the value is already set, counts the skipped write
+        """
+        if address in self and self.get(address) == value:
+            self.skipped_writes += 1
+            return True
+        return False
+
+    def update_from_read(self, address, registers) -> list:
+        """Update the shadow from registers read from the device
+
+        Returns the list of (address, shadow value, device value) which drifted
+        """
+        drift = []
+        now = time.monotonic()
+        for offset, value in enumerate(registers):
+            current = address + offset
+            if current not in self:
+                continue
+            known = self._values.get(current)
+            if known is not None and known[0] != value:
+                drift.append((current, known[0], value))
+            self._values[current] = (value, now)
+        if drift:
+            self.drift_count += len(drift)
+        self.last_update = now
+        return drift
+
+    def update_from_write(self, address, values) -> None:
+        """Update the shadow after a successful write
+        """
+        now = time.monotonic()
+        for offset, value in enumerate(values):
+            if address + offset in self:
+                self._values[address + offset] = (value, now)
+        self.last_update = now
+
+    def stage(self, address, value) -> None:
+        """Stage a write of the control tick, a write back to the
+        known value cancels the staged write
+        """
+        if self.get(address) == value:
+            if self._pending.pop(address, None) is None:
+                self.skipped_writes += 1
+            return
+        self._pending[address] = value
+
+    def take_pending(self) -> list:
+        """Take the staged writes merged into runs of adjacent registers
+
+        Returns a list of (first address, [values])
+        """
+        runs = []
+        for address in sorted(self._pending):
+            if runs and runs[-1][0] + len(runs[-1][1]) == address:
+                runs[-1][1].append(self._pending[address])
+            else:
+                runs.append((address, [self._pending[address]]))
+        self._pending.clear()
+        return runs
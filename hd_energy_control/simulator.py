@@ -0,0 +1,344 @@
+"""Modbus RTU simulator of HD Energy Control wallboxes for tests and benchmarks
+
+Usage:
+    python -m hd_energy_control.simulator --tcp 127.0.0.1:5020 --units 1,2 --baudrate 19200
+
+The simulator serves the register map of HDEnergyControlConstants.REGISTERS with RTU framing
+over TCP (client port "socket://127.0.0.1:5020") or on a serial port, e.g.
+one end of a pty pair created by
+    socat -d -d pty,raw,echo=0 pty,raw,echo=0
+"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import asyncio
+import random
+import threading
+import time
+
+from pymodbus import FramerType, ExceptionResponse
+from pymodbus.datastore import ModbusBaseSlaveContext, ModbusServerContext
+from pymodbus.server import ModbusTcpServer, StartAsyncTcpServer, StartAsyncSerialServer
+
+# bits per character of 8E1 (start, 8 data, parity, stop)
+BITS_PER_CHAR = 11
+
+
+class SimulatedWallbox:
+    """State model of one HD Energy Control wallbox
+
+    The charging state follows the vehicle:
+        A (no vehicle) -> plug() -> B (plugged) -> request_charge() -> C (charging)
+    In state C the vehicle draws min(maximal current command, vehicle current)
+    when the current is >= 6 A and the wallbox is not remote locked.
+    If the watchdog timeout (register 257) is set and the wallbox is not
+    contacted within the timeout, the failsafe current (register 262) is used.
+    """
+    def __init__(self, vehicle_current = 16.0, vehicle_phases = 3, voltage = 230, \
+                 energy_since_installation = 1234567):
+        self.vehicle_current = vehicle_current
+        self.vehicle_phases = vehicle_phases
+        self.voltage = voltage
+        self.plugged = False
+        self.charge_request = False
+        self.extern_lock = 1
+        self.temperature = 25.0
+        self.energy_since_power_on = 0.0
+        self.energy_since_installation = float(energy_since_installation)
+        self.currents = (0.0, 0.0, 0.0)
+        self.holding = {257: 0, 258: 0, 259: 1, 260: 0, 261: 160, 262: 0}
+        self.last_contact = time.monotonic()
+        self._last_step = time.monotonic()
+        self.state = 2
+
+    def plug(self) -> None:
+        """Plug in a vehicle
+        """
+        self.plugged = True
+
+    def unplug(self) -> None:
+        """Unplug the vehicle
+        """
+        self.plugged = False
+        self.charge_request = False
+
+    def request_charge(self, request = True) -> None:
+        """Vehicle requests charging (state C) or stops the request (state B)
+        """
+        self.charge_request = request and self.plugged
+
+    @property
+    def watchdog_expired(self) -> bool:
+        """True if the watchdog timeout (register 257) elapsed without contact
+        """
+        timeout_ms = self.holding[257]
+        return timeout_ms > 0 and time.monotonic() - self.last_contact > timeout_ms / 1000
+
+    @property
+    def allowed_current(self) -> float:
+        """Current the vehicle may draw in A
+        """
+        if self.holding[259] == 0 or self.extern_lock == 0:
+            return 0.0
+        raw = self.holding[262] if self.watchdog_expired else self.holding[261]
+        current = min(raw / 10, 16.0)
+        return current if current >= 6.0 else 0.0
+
+    def step(self, now = None) -> None:
+        """Advance the simulation to now (time.monotonic())
+        """
+        if now is None:
+            now = time.monotonic()
+        elapsed = max(now - self._last_step, 0.0)
+        self._last_step = now
+        allowed = self.allowed_current
+        if not self.plugged:
+            self.state = 3 if allowed else 2
+        elif not self.charge_request:
+            self.state = 5 if allowed else 4
+        else:
+            self.state = 7 if allowed else 6
+        current = min(allowed, self.vehicle_current) if self.state == 7 else 0.0
+        self.currents = tuple(current if phase < self.vehicle_phases else 0.0 for phase in range(3))
+        energy = self.power * elapsed / 3600
+        self.energy_since_power_on += energy
+        self.energy_since_installation += energy
+        # PCB temperature follows the current slowly
+        target = 25.0 + current * 1.5
+        self.temperature += (target - self.temperature) * min(elapsed / 60, 1.0)
+
+    @property
+    def power(self) -> int:
+        """Power of all phases in VA
+        """
+        return int(sum(current * self.voltage for current in self.currents))
+
+    def input_registers(self) -> dict:
+        """Actual values of the input registers: address -> raw value
+        """
+        self.step()
+        registers = {4: 0x108, 5: self.state, 13: self.extern_lock, 14: self.power, \
+                     100: 16, 101: 6, 203: 4711}
+        for phase in range(3):
+            registers[6 + phase] = int(self.currents[phase] * 10)
+            registers[10 + phase] = self.voltage
+        registers[9] = int(round(self.temperature * 10)) & 0xFFFF
+        for address, value in ((15, self.energy_since_power_on), (17, self.energy_since_installation)):
+            value = int(value) & 0xFFFFFFFF
+            registers[address] = value >> 16
+            registers[address + 1] = value & 0xFFFF
+        return registers
+
+    def write_holding(self, address, value) -> bool:
+        """Write a holding register, returns False for invalid values
+        """
+        if address == 258 and value not in (0, 4):
+            return False
+        if address == 259 and value not in (0, 1):
+            return False
+        if address in (261, 262) and value > 160:
+            return False
+        self.holding[address] = value
+        return True
+
+
+class SimulatedWallboxContext(ModbusBaseSlaveContext):
+    """pymodbus datastore of one simulated wallbox with timing and error injection
+    """
+    def __init__(self, wallbox = None, response_delay = 0.0, baudrate = None, \
+                 error_rate = 0.0, timeout_rate = 0.0, timeout_delay = 2.0, seed = None):
+        """Constructor of SimulatedWallboxContext
+        -----
+        Args:
+            wallbox: SimulatedWallbox or None for a new one
+            response_delay (float): processing time of the device in seconds
+            baudrate (int): emulated transmission time of request and response or None
+            error_rate (float): probability of an exception response (slave busy)
+            timeout_rate (float): probability of a response after timeout_delay seconds
+            timeout_delay (float): delay of a timed out response in seconds
+            seed: seed of the random generator of the error injection
+        """
+        self.wallbox = wallbox or SimulatedWallbox()
+        self.response_delay = response_delay
+        self.baudrate = baudrate
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_delay = timeout_delay
+        self._random = random.Random(seed)
+        self.requests = 0
+
+    def reset(self):
+        """Reset the simulated wallbox
+        """
+        self.wallbox = SimulatedWallbox()
+
+    def _transmission_time(self, request_bytes, response_bytes) -> float:
+        """Time on the wire of request and response including the 3.5 char gaps
+        """
+        if not self.baudrate:
+            return 0.0
+        return (request_bytes + response_bytes + 7) * BITS_PER_CHAR / self.baudrate
+
+    async def _delay_and_inject(self, request_bytes, response_bytes):
+        """Wait the emulated bus and device time, returns an exception code or None
+        """
+        self.requests += 1
+        delay = self.response_delay + self._transmission_time(request_bytes, response_bytes)
+        if self.timeout_rate and self._random.random() < self.timeout_rate:
+            delay += self.timeout_delay
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and self._random.random() < self.error_rate:
+            return ExceptionResponse.SLAVE_BUSY
+        self.wallbox.last_contact = time.monotonic()
+        return None
+
+    async def async_getValues(self, fc_as_hex, address, count = 1):
+        if fc_as_hex in (3, 4):
+            error = await self._delay_and_inject(8, 5 + 2 * count)
+            if error is not None:
+                return error
+        return self.getValues(fc_as_hex, address, count)
+
+    async def async_setValues(self, fc_as_hex, address, values):
+        error = await self._delay_and_inject(9 + 2 * len(values), 8)
+        if error is not None:
+            return error
+        return self.setValues(fc_as_hex, address, values)
+
+    def getValues(self, fc_as_hex, address, count = 1):
+        if fc_as_hex == 4:
+            registers = self.wallbox.input_registers()
+        elif fc_as_hex in (3, 6, 16):
+            registers = self.wallbox.holding
+        else:
+            return ExceptionResponse.ILLEGAL_FUNCTION
+        addresses = range(address, address + count)
+        if any(current not in registers for current in addresses):
+            return ExceptionResponse.ILLEGAL_ADDRESS
+        return [registers[current] for current in addresses]
+
+    def setValues(self, fc_as_hex, address, values):
+        if fc_as_hex not in (6, 16):
+            return ExceptionResponse.ILLEGAL_FUNCTION
+        if any(current not in self.wallbox.holding for current in range(address, address + len(values))):
+            return ExceptionResponse.ILLEGAL_ADDRESS
+        for offset, value in enumerate(values):
+            if not self.wallbox.write_holding(address + offset, value):
+                return ExceptionResponse.ILLEGAL_VALUE
+        return None
+
+
+def create_context(unit_ids = (1,), **kwargs) -> ModbusServerContext:
+    """Server context with one SimulatedWallboxContext per unit id
+    """
+    return ModbusServerContext(slaves={unit_id: SimulatedWallboxContext(**kwargs) \
+                                       for unit_id in unit_ids}, single=False)
+
+
+async def serve(context, tcp = None, serial_port = None, baudrate = 19200) -> None:
+    """Run the simulator until cancelled
+    -----
+    Args:
+        context: ModbusServerContext of create_context()
+        tcp (tuple): (host, port) for RTU framing over TCP
+        serial_port (str): serial device, e.g. one end of a pty pair
+        baudrate (int): baudrate of the serial port
+    """
+    if serial_port is not None:
+        await StartAsyncSerialServer(context, framer=FramerType.RTU, port=serial_port, \
+                                     baudrate=baudrate, bytesize=8, parity='E', stopbits=1)
+    else:
+        await StartAsyncTcpServer(context, framer=FramerType.RTU, address=tcp or ('127.0.0.1', 5020))
+
+
+class SimulatorThread(threading.Thread):
+    """Simulator with RTU framing over TCP in a background thread, e.g. for benchmarks
+
+    with SimulatorThread(create_context()) as simulator:
+        wallbox = HDEnergyControl(port=simulator.url)
+    """
+    def __init__(self, context, address = ('127.0.0.1', 0)):
+        """Constructor of SimulatorThread
+        -----
+        Args:
+            context: ModbusServerContext of create_context()
+            address (tuple): (host, port), port 0 = free port
+        """
+        super().__init__(name='hd_energy_control.simulator', daemon=True)
+        self.context = context
+        self.address = address
+        self._loop = None
+        self._server = None
+        self._ready = threading.Event()
+
+    @property
+    def url(self) -> str:
+        """Port of the client, e.g. socket://127.0.0.1:5020
+        """
+        return f'socket://{self.address[0]}:{self.address[1]}'
+
+    def run(self):
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._ready.set()
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._server = ModbusTcpServer(self.context, framer=FramerType.RTU, address=self.address)
+        await self._server.serve_forever(background=True)
+        self.address = self._server.transport.sockets[0].getsockname()[:2]
+        self._ready.set()
+        await self._server.serving
+
+    def start(self):
+        super().start()
+        self._ready.wait()
+        if self._server is None or self._server.transport is None:
+            raise RuntimeError(f'simulator could not listen on {self.address}')
+
+    def stop(self):
+        """Stop the server and wait for the thread
+        """
+        if self._loop is not None and self.is_alive():
+            asyncio.run_coroutine_threadsafe(self._server.shutdown(), self._loop).result()
+            self.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main(argv = None) -> None:
+    """Entry point of python -m hd_energy_control.simulator
+    """
+    parser = argparse.ArgumentParser(description='Modbus RTU simulator of HD Energy Control wallboxes')
+    parser.add_argument('--tcp', default='127.0.0.1:5020', help='host:port for RTU over TCP')
+    parser.add_argument('--serial', help='serial port instead of TCP, e.g. /dev/pts/3')
+    parser.add_argument('--units', default='1', help='comma separated unit ids')
+    parser.add_argument('--baudrate', type=int, default=19200, help='emulated baudrate, 0 = no emulation')
+    parser.add_argument('--delay', type=float, default=0.0, help='response delay in s')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of exception responses')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='probability of late responses')
+    parser.add_argument('--charging', action='store_true', help='start with a charging vehicle')
+    args = parser.parse_args(argv)
+    unit_ids = [int(unit_id) for unit_id in args.units.split(',')]
+    context = create_context(unit_ids, response_delay=args.delay, \
+                             baudrate=args.baudrate if not args.serial else None, \
+                             error_rate=args.error_rate, timeout_rate=args.timeout_rate)
+    if args.charging:
+        for unit_id in unit_ids:
+            wallbox = context[unit_id].wallbox
+            wallbox.plug()
+            wallbox.request_charge()
+    host, port = args.tcp.rsplit(':', 1)
+    asyncio.run(serve(context, tcp=(host, int(port)), serial_port=args.serial, baudrate=args.baudrate))
+
+
+if __name__ == "__main__":
+    main()
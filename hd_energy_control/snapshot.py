@@ -0,0 +1,70 @@
+"""Module providing the snapshot of all HD Energy Control input registers"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from .constants import HDEnergyControlConstants as CONSTS
+
+
+def format_layout_version(version_dec) -> str:
+    """Format the register layout version, e.g. 0x108 => 'v1.0.8'
+    """
+    version_hex = f"{version_dec:0x}"
+    return f"v{'.'.join(f'{char}' for char in version_hex)}"
+
+
+def describe_charging_state(value) -> tuple:
+    """Charging state, car state and wallbox state of the raw charging state
+    """
+    return (CONSTS.STATE[value], CONSTS.CAR[value], CONSTS.WALLBOX[value])
+
+
+@dataclass(frozen=True)
+class HDEnergyControlSnapshot:
+    """Decoded values of one full poll of the HD Energy Control input registers
+
+    The measurement block (register 4...18) is always present,
+    the configuration values (register 100, 101, 203) are None
+    when the snapshot was taken without them.
+    """
+    register_layout_version: str
+    charging_state: tuple
+    currents_rms: tuple
+    pcb_temperature: float
+    voltages_rms: tuple
+    extern_lock_state: tuple
+    power: int
+    energy_since_power_on: int
+    energy_since_installation: int
+    hw_config_max_current: Optional[int] = None
+    hw_config_min_current: Optional[int] = None
+    application_software_revision: Optional[int] = None
+    timestamp: float = field(default_factory=time.time)
+
+    @classmethod
+    def from_values(cls, values):
+        """Build a snapshot from the decoded values of the register map
+        -----
+        Args:
+            values (dict): register name -> value, see CONSTS.REGISTERS
+
+        Returns:
+            HDEnergyControlSnapshot
+        """
+        lock_state = values['extern_lock_state']
+        return cls(
+            register_layout_version=format_layout_version(values['register_layout_version']),
+            charging_state=describe_charging_state(values['charging_state']),
+            currents_rms=values['currents_rms'],
+            pcb_temperature=values['pcb_temperature'],
+            voltages_rms=values['voltages_rms'],
+            extern_lock_state=(lock_state, CONSTS.EXTERN_LOCK[lock_state]),
+            power=values['power'],
+            energy_since_power_on=values['energy_since_power_on'],
+            energy_since_installation=values['energy_since_installation'],
+            hw_config_max_current=values.get('hw_config_max_current'),
+            hw_config_min_current=values.get('hw_config_min_current'),
+            application_software_revision=values.get('application_software_revision'))
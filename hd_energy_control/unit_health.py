@@ -0,0 +1,118 @@
+"""Module providing adaptive timeouts, backoff and quarantine of Modbus units"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+from .metrics import frame_sizes
+
+# bits per character of 8E1 / 8N2 (start, 8 data, parity or second stop, stop)
+BITS_PER_CHAR = 11
+
+
+def transmission_time(byte_count, baudrate, bits_per_char = BITS_PER_CHAR) -> float:
+    """Time on the wire of byte_count bytes plus the 3.5 character gap
+    """
+    return (byte_count + 3.5) * bits_per_char / baudrate
+
+
+class UnitHealth:
+    """Response time estimation, backoff and quarantine of one unit
+
+    The turnaround time of the device (duration of a transaction minus the
+    transmission time of request and response) is smoothed like the TCP
+    retransmission timer (RFC 6298), the timeout of a request is
+        transmission time + srtt + 4 * rttvar
+    within min_timeout and max_timeout. Until the first response the
+    initial_timeout is used.
+
+    After quarantine_after consecutive timeouts the unit is quarantined,
+    requests fail immediately without using the bus. When the quarantine
+    ends one probe request is sent, every failed probe doubles the
+    quarantine up to backoff_max, so a sleeping unit (e.g. standby)
+    cannot stall the poll cycle of the other units of the bus.
+    """
+    def __init__(self, baudrate = 19200, initial_timeout = 1.0, min_timeout = 0.05, \
+                 max_timeout = 3.0, quarantine_after = 3, backoff_base = 1.0, backoff_max = 300.0):
+        """Constructor of UnitHealth
+        -----
+        Args:
+            baudrate (int): baudrate of the bus
+            initial_timeout (float): timeout in s until the first response
+            min_timeout (float): lower bound of the learned timeout in s (without transmission)
+            max_timeout (float): upper bound of the timeout in s
+            quarantine_after (int): consecutive timeouts until the unit is quarantined
+            backoff_base (float): first quarantine in s
+            backoff_max (float): maximal quarantine in s
+        """
+        self.baudrate = baudrate
+        self.initial_timeout = initial_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.quarantine_after = quarantine_after
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.srtt = None
+        self.rttvar = None
+        self.consecutive_failures = 0
+        self.quarantined_until = None
+        self.quarantine_count = 0
+        self.skipped_requests = 0
+
+    def _transmission(self, function_code, count) -> float:
+        request, response = frame_sizes(function_code, count, 'ok')
+        return transmission_time(request + response, self.baudrate)
+
+    def timeout(self, function_code = 0x04, count = 1) -> float:
+        """Timeout in s of a request
+        """
+        if self.srtt is None:
+            return self.initial_timeout
+        turnaround = max(self.srtt + 4 * self.rttvar, self.min_timeout)
+        return min(self._transmission(function_code, count) + turnaround, self.max_timeout)
+
+    @property
+    def quarantined(self) -> bool:
+        """True while requests to the unit are suppressed
+        """
+        return self.quarantined_until is not None and time.monotonic() < self.quarantined_until
+
+    def allow_request(self) -> bool:
+        """False while the unit is quarantined, counts the skipped request
+        """
+        if self.quarantined:
+            self.skipped_requests += 1
+            return False
+        return True
+
+    def record_response(self, function_code, count, duration) -> None:
+        """The unit responded (also with an exception response) after duration s
+        """
+        turnaround = max(duration - self._transmission(function_code, count), 0.0)
+        if self.srtt is None:
+            self.srtt = turnaround
+            self.rttvar = turnaround / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - turnaround)
+            self.srtt = 0.875 * self.srtt + 0.125 * turnaround
+        self.consecutive_failures = 0
+        self.quarantined_until = None
+        self.quarantine_count = 0
+
+    def record_timeout(self) -> None:
+        """The unit did not respond within the timeout
+        """
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.quarantine_after:
+            backoff = min(self.backoff_base * 2 ** self.quarantine_count, self.backoff_max)
+            self.quarantined_until = time.monotonic() + backoff
+            self.quarantine_count += 1
+
+    def reset(self) -> None:
+        """Forget the learned timeout and end the quarantine
+        """
+        self.srtt = None
+        self.rttvar = None
+        self.consecutive_failures = 0
+        self.quarantined_until = None
+        self.quarantine_count = 0
@@ -0,0 +1,98 @@
+"""Module providing the Modbus watchdog keepalive for HD Energy Control units"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+import time
+
+from .constants import HDEnergyControlConstants as CONSTS
+
+
+class WatchdogKeepalive:
+    """Keep the Modbus watchdog (register 257) of several units fed
+
+    Every successful transaction of a unit (poll, write) resets its
+    watchdog, so a refresh is only sent to units which were not contacted
+    within (1 - margin) * watchdog timeout. On a busy bus no extra
+    transactions are needed. The last known timeout of a unit is kept, it
+    is only read when it was never seen (or changed by a write).
+    """
+    def __init__(self, units, margin = 0.5, retry_interval = 1.0):
+        """Constructor of WatchdogKeepalive
+        -----
+        Args:
+            units: iterable of HDEnergyControl objects
+            margin (float): safety margin as part of the timeout
+            retry_interval (float): seconds until a failed refresh is repeated
+        """
+        self._units = list(units)
+        self._margin = margin
+        self._retry_interval = retry_interval
+        self._retry_at = {}
+        self._timeouts = {}
+        self.refresh_count = 0
+        self.failed_count = 0
+
+    def add_unit(self, unit) -> None:
+        """Add a unit to keep alive
+        """
+        self._units.append(unit)
+
+    def _timeout(self, unit):
+        """Last known watchdog timeout of the unit in ms, None if never seen
+        """
+        timeout_ms = unit.shadow.get(CONSTS.REGISTERS['watchdog_timeout'].address)
+        if timeout_ms is not None:
+            self._timeouts[id(unit)] = timeout_ms
+        return self._timeouts.get(id(unit))
+
+    def _deadline(self, unit):
+        """time.monotonic() when the unit needs a refresh, math.inf without watchdog
+        """
+        retry_at = self._retry_at.get(id(unit), -math.inf)
+        timeout_ms = self._timeout(unit)
+        if timeout_ms is None or unit.last_contact is None:
+            # timeout not known yet, read it now
+            return retry_at
+        if timeout_ms == 0:
+            return math.inf
+        return max(unit.last_contact + timeout_ms / 1000 * (1 - self._margin), retry_at)
+
+    def next_due(self) -> float:
+        """time.monotonic() of the next needed refresh (math.inf if none)
+        """
+        return min((self._deadline(unit) for unit in self._units), default=math.inf)
+
+    def due_units(self, now = None) -> list:
+        """Units which need a refresh now, most urgent first
+        """
+        if now is None:
+            now = time.monotonic()
+        due = [(self._deadline(unit), index, unit) for index, unit in enumerate(self._units)]
+        return [unit for deadline, _, unit in sorted(due) if deadline <= now]
+
+    def service(self, now = None) -> int:
+        """Refresh all due units
+
+        Returns the number of sent refresh transactions
+        """
+        count = 0
+        for unit in self.due_units(now):
+            self.refresh(unit)
+            count += 1
+        return count
+
+    def refresh(self, unit) -> bool:
+        """Refresh one unit, the watchdog timeout is read on the first refresh
+        """
+        if self._timeout(unit) is None:
+            result = unit.get_watchdog_timeout() is not False
+        else:
+            result = unit.refresh_watchdog()
+        if result:
+            self.refresh_count += 1
+            self._retry_at.pop(id(unit), None)
+        else:
+            self.failed_count += 1
+            self._retry_at[id(unit)] = time.monotonic() + self._retry_interval
+        return result
@@ -1,28 +1,102 @@
 """Class for connecting and insert into mariaDB"""
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import threading
+import time
+from contextlib import contextmanager
+
 import mysql.connector
 from mysql.connector import errorcode
+from mysql.connector import pooling
 
 
 class MariaDBMysql:
-    """Class connecting MariaDB Database"""
+    """Class connecting MariaDB Database
+
+    Without pool_size one connection is shared (and locked) by all callers,
+    with pool_size a mysql.connector.pooling pool is used, so several
+    threads can write at the same time.
+    The shared connection is checked with a ping before use when it was
+    idle longer than check_interval and reconnected with exponential backoff.
+    """
 
-    def __init__(self, config):
-        """Contructor of cMariaDB_mysql class 
+    def __init__(self, config, pool_size = None, check_interval = 30.0, \
+                 reconnect_attempts = 3, reconnect_delay = 1.0, spool = None):
+        """Contructor of cMariaDB_mysql class
         -----
 
         Args:
             config: configuration for mariaDB access
+            pool_size: number of pooled connections or None for one connection
+            check_interval: idle seconds after which a connection is pinged before use
+            reconnect_attempts: number of reconnect attempts, at least 1
+            reconnect_delay: delay of the first reconnect attempt in seconds, doubled per attempt
+            spool: SampleSpool for rows which cannot be written while the server is not reachable
         """
         self._config = config
-        # call connect to have the connection object inside
-        self.connector = self.connect()
+        self._check_interval = check_interval
+        self._reconnect_attempts = reconnect_attempts
+        self._reconnect_delay = reconnect_delay
+        self._lock = threading.Lock()
+        self._last_use = {}
+        self._pool_size = pool_size
+        self._pool = None
+        self.connector = False
+        self.spool = spool
+        if reconnect_attempts < 1:
+            raise ValueError("reconnect_attempts must be at least 1")
+        if pool_size:
+            try:
+                self._pool = self._create_pool()
+            except mysql.connector.Error as err:
+                # the pool is created on the first use
+                self._print_error(err)
+        else:
+            # call connect to have the connection object inside
+            self.connector = self.connect()
+        if spool is not None:
+            spool.start(self)
+
+    @property
+    def database(self) -> str:
+        """Name of the database of the configuration"""
+        return self._config['database']
 
     def __del__(self):
         #destoy the connector object
         #print("Call destructor")
-        self.connector.close()
+        if self.connector:
+            self.connector.close()
+
+    @staticmethod
+    def is_connection_error(err) -> bool:
+        """True if the error means the server is not reachable (not a failure of the statement)
+        """
+        return isinstance(err, (mysql.connector.errors.InterfaceError, \
+                                mysql.connector.errors.PoolError)) \
+            or err.errno in (errorcode.CR_CONN_HOST_ERROR, errorcode.CR_CONNECTION_ERROR, \
+                             errorcode.CR_SERVER_GONE_ERROR, errorcode.CR_SERVER_LOST)
+
+    def insert_query(self, table, columns) -> str:
+        """Parameterized insert statement of table and columns
+        """
+        if isinstance(columns, str):
+            columns = tuple(column.strip() for column in columns.split(','))
+        # INSERT INTO `waermepumpe`.`energie` (`E_import_tot`, `E_export_tot`) VALUES (%s, %s)
+        column_str = ', '.join(f"`{column}`" for column in columns)
+        placeholders = ', '.join(['%s'] * len(columns))
+        return f"INSERT INTO `{self.database}`.`{table}` ({column_str}) VALUES ({placeholders})"
+
+    @staticmethod
+    def _print_error(err):
+        if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
+            print("ERROR: User/Password!")
+        elif err.errno == errorcode.ER_BAD_DB_ERROR:
+            print("ERROR: No Database!")
+        elif err.errno == errorcode.CR_CONN_HOST_ERROR:
+            print("ERROR: Connection!")
+        else:
+            print(f"ERROR: {err.errno}")
 
     def connect(self):
         """Method to establish connection to database
@@ -35,22 +109,97 @@ class MariaDBMysql:
             connector_obj = mysql.connector.connect(**self._config)
             #print("cnx: ", cnx)
         except mysql.connector.Error as err:
-            if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
-                print("ERROR: User/Password!")
-                return False
-            elif err.errno == errorcode.ER_BAD_DB_ERROR:
-                print("ERROR: No Database!")
-                return False
-            elif err.errno == errorcode.CR_CONN_HOST_ERROR:
-                print("ERROR: Connection!")
-                return False
-            else:
-                print(f"ERROR: {err.errno}")
-                return False
+            self._print_error(err)
+            return False
         else:
             #print("Connection: successfully established!")
             return connector_obj
 
+    def _reconnect(self):
+        """Connect again with exponential backoff
+        -----
+
+        Returns:
+            MySQLConnection object or False
+        """
+        delay = self._reconnect_delay
+        for attempt in range(self._reconnect_attempts):
+            if attempt:
+                time.sleep(delay)
+                delay *= 2
+            connector_obj = self.connect()
+            if connector_obj:
+                return connector_obj
+        return False
+
+    def _check(self, connector_obj) -> bool:
+        """Check a connection, the ping is only sent after check_interval idle seconds
+        """
+        last_use = self._last_use.get(id(connector_obj))
+        if last_use is not None and time.monotonic() - last_use < self._check_interval:
+            return True
+        try:
+            connector_obj.ping(reconnect=True, attempts=self._reconnect_attempts, \
+                               delay=self._reconnect_delay)
+        except mysql.connector.Error:
+            return False
+        return True
+
+    @contextmanager
+    def connection(self):
+        """Context manager providing a checked connection
+        -----
+
+        Raises:
+            mysql.connector.Error if no connection can be established
+        """
+        if self._pool_size:
+            # the pool checks and reconnects its connections on get_connection()
+            connector_obj = self._get_pooled_connection()
+            try:
+                yield connector_obj
+            finally:
+                # returns the connection into the pool
+                connector_obj.close()
+            return
+        with self._lock:
+            if not self.connector or not self._check(self.connector):
+                self.connector = self._reconnect()
+            if not self.connector:
+                raise mysql.connector.errors.OperationalError( \
+                    msg="no connection to the database", errno=errorcode.CR_CONN_HOST_ERROR)
+            try:
+                yield self.connector
+            except mysql.connector.Error:
+                # check the connection before the next use
+                self._last_use.pop(id(self.connector), None)
+                raise
+            self._last_use[id(self.connector)] = time.monotonic()
+
+    def _create_pool(self):
+        """Create the connection pool (opens pool_size connections)
+        """
+        return pooling.MySQLConnectionPool(pool_name=f"maria_db_{id(self)}", \
+                                           pool_size=self._pool_size, **self._config)
+
+    def _get_pooled_connection(self):
+        """Get a connection of the pool, retried with exponential backoff
+        """
+        delay = self._reconnect_delay
+        for attempt in range(self._reconnect_attempts):
+            if attempt:
+                time.sleep(delay)
+                delay *= 2
+            try:
+                with self._lock:
+                    if self._pool is None:
+                        self._pool = self._create_pool()
+                return self._pool.get_connection()
+            except mysql.connector.Error as err:
+                error = err
+        self._print_error(error)
+        raise error
+
     def insert_by_stored_procedure(self, prodedure_name, arguments) -> bool:
         """Insert data into mariaDB by calling a strored procedure
         -----
@@ -60,13 +209,23 @@ class MariaDBMysql:
             arguments: function parameters for the stored procedure
 
         Returns:
-            True when successful or False when failed
+            True when successful (or spooled) or False when failed
         """
+        if self.spool is not None and len(self.spool):
+            # keep the order, the spool is replayed first
+            self.spool.add_procedure_call(prodedure_name, arguments)
+            return True
         try:
-            cursor = self.connector.cursor()
-            cursor.callproc(prodedure_name, arguments)
-            self.connector.commit()
+            with self.connection() as connector_obj:
+                cursor = connector_obj.cursor()
+                cursor.callproc(prodedure_name, arguments)
+                connector_obj.commit()
+                cursor.close()
         except mysql.connector.Error as err:
+            if self.spool is not None and self.is_connection_error(err):
+                print("INFO: database not reachable, data spooled!")
+                self.spool.add_procedure_call(prodedure_name, arguments)
+                return True
             if err.errno == errorcode.ER_PARSE_ERROR:
                 print(f"ERROR: Syntax! ({err.errno})")
                 return False
@@ -74,7 +233,6 @@ class MariaDBMysql:
                 print(f"ERROR: {err.errno}")
                 return False
         else:
-            cursor.close()
             return True
 
     def insert_by_sql_insert_stmt(self, table, columns, values) -> bool:
@@ -82,21 +240,34 @@ class MariaDBMysql:
         -----
 
         Args:
-            table: string 
-            columns: tuple 
+            table: string
+            columns: tuple or comma separated string
             values: tuple
 
         Returns:
-            True when successful or False when failed
+            True when successful (or spooled) or False when failed
         """
+        if isinstance(columns, str):
+            columns = tuple(column.strip() for column in columns.split(','))
+        if not isinstance(values, (tuple, list)):
+            values = (values,)
+        if self.spool is not None and len(self.spool):
+            # keep the order, the spool is replayed first
+            self.spool.add_insert(table, columns, [values])
+            return True
         try:
-            cursor = self.connector.cursor()
-            # INSERT INTO `waermepumpe`.`energie` (E_import_tot, E_export_tot) VALUES(20.9, 31.4)
-            query_str = f"INSERT INTO `{self._config['database']}`.`{table}` ({columns}) VALUES({str(values)})"
-            #print(query_str)
-            cursor.execute(query_str)
-            self.connector.commit()
+            with self.connection() as connector_obj:
+                cursor = connector_obj.cursor()
+                query_str = self.insert_query(table, columns)
+                #print(query_str)
+                cursor.execute(query_str, tuple(values))
+                connector_obj.commit()
+                cursor.close()
         except mysql.connector.Error as err:
+            if self.spool is not None and self.is_connection_error(err):
+                print("INFO: database not reachable, data spooled!")
+                self.spool.add_insert(table, columns, [values])
+                return True
             if err.errno == errorcode.ER_PARSE_ERROR:
                 print(f"ERROR: Syntax! ({err.errno})")
                 return False
@@ -104,5 +275,7 @@ class MariaDBMysql:
                 print(f"ERROR: {err.errno}")
                 return False
         else:
-            cursor.close()
             return True
+
+from .batch_writer import MariaDBBatchWriter
+from .spool import SampleSpool
@@ -0,0 +1,250 @@
+"""Class for buffered batch inserts into mariaDB"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import mysql.connector
+from mysql.connector import errorcode
+
+
+class MariaDBBatchWriter:
+    """Queue rows in memory and write them in one transaction
+
+    The rows are flushed when batch_size rows are queued or, if the
+    background thread is started, every flush_interval seconds. With the
+    background thread add() never writes in the caller's thread, a full
+    batch wakes the thread. After a failed flush the thread waits
+    flush_interval seconds before the next attempt.
+    Table rows are written with one parameterized executemany (multi-row
+    VALUES), rows for a stored procedure with one commit for all calls.
+    """
+
+    def __init__(self, maria_db, table = None, columns = None, procedure = None, \
+                 batch_size = 100, flush_interval = 10.0, max_queue = 100000):
+        """Constructor of MariaDBBatchWriter
+        -----
+
+        Args:
+            maria_db: MariaDBMysql object
+            table: table name for inserts
+            columns: tuple of column names of the table
+            procedure: name of a stored procedure used instead of table
+            batch_size: number of queued rows which triggers a flush
+            flush_interval: seconds between two flushes of the background thread
+            max_queue: maximal number of queued rows, the oldest are dropped
+        """
+        if (table is None) == (procedure is None):
+            raise ValueError("either table or procedure is needed")
+        self._maria_db = maria_db
+        self._procedure = procedure
+        self._query = None
+        self._table = table
+        if table is not None:
+            if isinstance(columns, str):
+                columns = tuple(column.strip() for column in columns.split(','))
+            self._query = maria_db.insert_query(table, columns)
+        self._columns = columns
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_queue = max_queue
+        self._rows = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        # statistics
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.rows_rejected = 0
+        self.flush_count = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+    def add(self, values) -> None:
+        """Queue one row, flushes when batch_size rows are queued (in the background thread if started)
+        -----
+
+        Args:
+            values: tuple of values (order of columns or procedure arguments)
+        """
+        with self._lock:
+            self._rows.append(tuple(values))
+            if len(self._rows) > self._max_queue:
+                del self._rows[0]
+                self.rows_dropped += 1
+            full = len(self._rows) >= self._batch_size
+        if full:
+            if self._thread is not None:
+                self._wake.set()
+            else:
+                self.flush()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def flush(self) -> bool:
+        """Write all queued rows in one transaction
+        -----
+
+        Returns:
+            True when successful (or spooled) or False when failed (rows stay queued),
+            rows rejected by the server are written row by row, the failing rows are dropped
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return True
+            spool = self._maria_db.spool
+            if spool is not None and len(spool):
+                # keep the order, the spool is replayed first
+                return self._spool(spool, rows, quiet=True)
+            start = time.monotonic()
+            error = self._write(rows)
+            if error is None:
+                self.last_flush_latency = time.monotonic() - start
+                self.max_flush_latency = max(self.max_flush_latency, self.last_flush_latency)
+                self.flush_count += 1
+                self.rows_written += len(rows)
+                return True
+            if self._is_connection_error(error):
+                if spool is not None:
+                    return self._spool(spool, rows)
+                self._requeue(rows)
+                return False
+            # rejected by the server (e.g. duplicate key) or not convertible
+            return self._write_rows(rows)
+
+    def _is_connection_error(self, error) -> bool:
+        return isinstance(error, mysql.connector.Error) and self._maria_db.is_connection_error(error)
+
+    def _write_rows(self, rows) -> bool:
+        """Write a rejected batch row by row, rows which fail again are dropped
+
+        Returns False if the connection failed meanwhile (the remaining rows
+        are spooled or queued again)
+        """
+        for index, row in enumerate(rows):
+            error = self._write([row])
+            if error is None:
+                self.rows_written += 1
+            elif self._is_connection_error(error):
+                spool = self._maria_db.spool
+                if spool is not None:
+                    return self._spool(spool, rows[index:])
+                self._requeue(rows[index:])
+                return False
+            else:
+                print(f"ERROR: row {row} rejected and dropped!")
+                self.rows_rejected += 1
+        self.flush_count += 1
+        return True
+
+    def _spool(self, spool, rows, quiet = False) -> bool:
+        """Move the rows of a failed flush into the spool of the database
+
+        Returns False if the spool failed, the rows are queued again
+        """
+        try:
+            if self._procedure is None:
+                spool.add_insert(self._table, self._columns, rows)
+            else:
+                for row in rows:
+                    spool.add_procedure_call(self._procedure, row)
+        except Exception as exc:
+            print(f"ERROR: rows cannot be spooled ({exc!r})")
+            self._requeue(rows)
+            return False
+        if not quiet:
+            print(f"INFO: database not reachable, {len(rows)} rows spooled!")
+        return True
+
+    def _requeue(self, rows) -> None:
+        """Put rows of a failed flush back in front of the queue
+        """
+        with self._lock:
+            self._rows = rows + self._rows
+            overflow = len(self._rows) - self._max_queue
+            if overflow > 0:
+                del self._rows[:overflow]
+                self.rows_dropped += overflow
+
+    def _write(self, rows):
+        """Write the rows in one transaction
+
+        Returns None when successful otherwise the error (mysql.connector.Error
+        or e.g. a TypeError of a value which cannot be converted)
+        """
+        try:
+            with self._maria_db.connection() as connector:
+                cursor = connector.cursor()
+                try:
+                    if self._procedure is None:
+                        cursor.executemany(self._query, rows)
+                    else:
+                        for row in rows:
+                            cursor.callproc(self._procedure, row)
+                    connector.commit()
+                except Exception:
+                    try:
+                        connector.rollback()
+                    except mysql.connector.Error:
+                        pass
+                    raise
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as err:
+            if err.errno == errorcode.ER_PARSE_ERROR:
+                print(f"ERROR: Syntax! ({err.errno})")
+            else:
+                print(f"ERROR: {err.errno}")
+            return err
+        except Exception as exc:
+            print(f"ERROR: rows not written ({exc!r})")
+            return exc
+        return None
+
+    def start(self) -> None:
+        """Start the background thread which flushes every flush_interval seconds
+        """
+        self._stop.clear()
+        self._wake.clear()
+        self._thread = threading.Thread(target=self._run, name='MariaDBBatchWriter', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread and flush the remaining rows
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self._flush_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                result = self.flush()
+            except Exception as exc:
+                # keep the thread alive
+                print(f"ERROR: batch writer flush failed ({exc!r})")
+                result = False
+            if not result:
+                # do not retry at every add() while the database fails
+                self._stop.wait(self._flush_interval)
+
+    def stats(self) -> dict:
+        """Statistics of the writer
+        """
+        return {'queued': len(self._rows), 'rows_written': self.rows_written, \
+                'rows_dropped': self.rows_dropped, \
+                'rows_rejected': self.rows_rejected, 'flush_count': self.flush_count, \
+                'last_flush_latency': self.last_flush_latency, \
+                'max_flush_latency': self.max_flush_latency}
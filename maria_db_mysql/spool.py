@@ -0,0 +1,260 @@
+"""Class for a local store-and-forward spool of mariaDB inserts"""
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import datetime
+import decimal
+import json
+import sqlite3
+import threading
+
+import mysql.connector
+
+
+def _encode(value):
+    """JSON default of the SQL parameters which are no JSON types
+    """
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'__date__': value.isoformat()}
+    if isinstance(value, datetime.time):
+        return {'__time__': value.isoformat()}
+    if isinstance(value, decimal.Decimal):
+        return {'__decimal__': str(value)}
+    raise TypeError(f'{type(value).__name__} cannot be spooled')
+
+
+def _decode(obj):
+    """JSON object hook restoring the values of _encode()
+    """
+    if len(obj) == 1:
+        key, value = next(iter(obj.items()))
+        if key == '__datetime__':
+            return datetime.datetime.fromisoformat(value)
+        if key == '__date__':
+            return datetime.date.fromisoformat(value)
+        if key == '__time__':
+            return datetime.time.fromisoformat(value)
+        if key == '__decimal__':
+            return decimal.Decimal(value)
+    return obj
+
+
+def _dumps_row(row) -> str:
+    """Serialize the parameters of one row
+    """
+    return json.dumps(list(row), default=_encode)
+
+
+def _loads_row(payload) -> list:
+    """Deserialize the parameters of one row of _dumps_row()
+    """
+    return json.loads(payload, object_hook=_decode)
+
+
+class SampleSpool:
+    """Durable local spool (SQLite in WAL mode) for rows which could not be written
+
+    The rows are kept in the order of arrival. When the spool holds more than
+    max_rows rows the oldest are evicted. The background thread replays the
+    spooled rows in batches (one transaction per batch) as soon as the
+    database is reachable again. A batch which is rejected by the server
+    (e.g. duplicate key) is replayed row by row, only the rejected rows and
+    payloads which cannot be decoded are moved into the table dead_letter of
+    the spool file, it keeps the newest max_dead_rows rows.
+    """
+
+    def __init__(self, path, max_rows = 1000000, batch_size = 500, replay_interval = 10.0, \
+                 max_dead_rows = 10000):
+        """Constructor of SampleSpool
+        -----
+
+        Args:
+            path: path of the SQLite spool file
+            max_rows: maximal number of spooled rows, the oldest are evicted
+            batch_size: number of rows replayed in one transaction
+            replay_interval: seconds between two replay attempts
+            max_dead_rows: maximal number of rows in dead_letter, the oldest are evicted
+        """
+        self._max_rows = max_rows
+        self._max_dead_rows = max_dead_rows
+        self._batch_size = batch_size
+        self._replay_interval = replay_interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS spool ("
+                         "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "kind TEXT NOT NULL, target TEXT NOT NULL, payload TEXT NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS dead_letter ("
+                         "id INTEGER PRIMARY KEY, kind TEXT NOT NULL, target TEXT NOT NULL, "
+                         "payload TEXT NOT NULL, error TEXT NOT NULL)")
+        self._count = self._db.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+        self.rows_evicted = 0
+        self.rows_replayed = 0
+        self.rows_dead = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def close(self) -> None:
+        """Stop the replay thread and close the spool file
+        """
+        self.stop()
+        with self._lock:
+            self._db.close()
+
+    def add_procedure_call(self, procedure_name, arguments) -> None:
+        """Spool one call of a stored procedure
+        """
+        self._add_many('procedure', procedure_name, [_dumps_row(arguments)])
+
+    def add_insert(self, table, columns, rows) -> None:
+        """Spool rows of an insert into table (columns: tuple of column names)
+        """
+        target = json.dumps([table, list(columns)])
+        self._add_many('insert', target, [_dumps_row(row) for row in rows])
+
+    def _add_many(self, kind, target, payloads) -> None:
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany("INSERT INTO spool (kind, target, payload) VALUES (?, ?, ?)", \
+                                 [(kind, target, payload) for payload in payloads])
+            self._count += len(payloads)
+            overflow = self._count - self._max_rows
+            if overflow > 0:
+                # evict the oldest rows
+                self._db.execute("DELETE FROM spool WHERE id IN "
+                                 "(SELECT id FROM spool ORDER BY id LIMIT ?)", (overflow,))
+                self._count -= overflow
+                self.rows_evicted += overflow
+            self._db.execute("COMMIT")
+
+    def replay(self, maria_db) -> bool:
+        """Replay the spooled rows oldest first in batches
+        -----
+
+        Args:
+            maria_db: MariaDBMysql object
+
+        Returns:
+            True when the spool is empty, False when the database is not reachable
+        """
+        while True:
+            with self._lock:
+                batch = self._db.execute("SELECT id, kind, target, payload FROM spool "
+                                         "ORDER BY id LIMIT ?", (self._batch_size,)).fetchall()
+            if not batch:
+                return True
+            try:
+                self._transaction(maria_db, batch)
+            except Exception as exc:
+                if isinstance(exc, mysql.connector.Error) and maria_db.is_connection_error(exc):
+                    return False
+                # find the rejected rows (or payloads), the others are written
+                if not self._replay_rows(maria_db, batch):
+                    return False
+                continue
+            self.rows_replayed += len(batch)
+            self._delete([row[0] for row in batch])
+
+    def _transaction(self, maria_db, batch) -> None:
+        """Write rows of the spool in one transaction
+
+        Raises mysql.connector.Error or the error of a payload which cannot be decoded
+        """
+        with maria_db.connection() as connector:
+            cursor = connector.cursor()
+            try:
+                self._write_batch(maria_db, cursor, batch)
+                connector.commit()
+            except Exception:
+                connector.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def _replay_rows(self, maria_db, batch) -> bool:
+        """Replay a rejected batch row by row, rejected rows go to dead_letter
+
+        Returns False when the database is not reachable
+        """
+        for row in batch:
+            try:
+                self._transaction(maria_db, [row])
+            except Exception as exc:
+                if isinstance(exc, mysql.connector.Error) and maria_db.is_connection_error(exc):
+                    return False
+                print(f"ERROR: {exc!r}, spooled row {row[0]} moved to dead_letter!")
+                self._add_dead_letter(row, exc)
+            else:
+                self.rows_replayed += 1
+            self._delete([row[0]])
+        return True
+
+    def _add_dead_letter(self, row, error) -> None:
+        """Keep a rejected row in dead_letter, the oldest are evicted beyond max_dead_rows
+        """
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.execute("INSERT OR REPLACE INTO dead_letter (id, kind, target, payload, error) "
+                             "VALUES (?, ?, ?, ?, ?)", (*row, repr(error)))
+            self._db.execute("DELETE FROM dead_letter WHERE id IN "
+                             "(SELECT id FROM dead_letter ORDER BY id DESC LIMIT -1 OFFSET ?)", \
+                             (self._max_dead_rows,))
+            self._db.execute("COMMIT")
+        self.rows_dead += 1
+
+    def _delete(self, ids) -> None:
+        """Delete replayed rows, the count is taken from the spool (rows may be evicted meanwhile)
+        """
+        with self._lock:
+            self._db.executemany("DELETE FROM spool WHERE id = ?", [(row_id,) for row_id in ids])
+            self._count = self._db.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    @staticmethod
+    def _write_batch(maria_db, cursor, batch) -> None:
+        """Write one batch, consecutive inserts into the same table with one executemany
+        """
+        index = 0
+        while index < len(batch):
+            _, kind, target, payload = batch[index]
+            if kind == 'procedure':
+                cursor.callproc(target, _loads_row(payload))
+                index += 1
+                continue
+            rows = []
+            while index < len(batch) and batch[index][1] == kind and batch[index][2] == target:
+                rows.append(tuple(_loads_row(batch[index][3])))
+                index += 1
+            table, columns = json.loads(target)
+            cursor.executemany(maria_db.insert_query(table, columns), rows)
+
+    def start(self, maria_db) -> None:
+        """Start the background thread replaying the spool every replay_interval seconds
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(maria_db,), \
+                                        name='SampleSpool', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, maria_db) -> None:
+        while not self._stop.wait(self._replay_interval):
+            if not self._count:
+                continue
+            try:
+                self.replay(maria_db)
+            except Exception as exc:
+                # e.g. a sqlite3 error, the replay is tried again
+                print(f"ERROR: replay of the spool failed ({exc!r})")